@@ -53,12 +53,17 @@ resource "aws_glue_catalog_table" "vpc_flow_logs" {
     "projection.day.range"  = "1,31"
     "projection.day.digits" = "2"
 
+    # Hour (per_hour_partition en aws_flow_log.main)
+    "projection.hour.type"   = "integer"
+    "projection.hour.range"  = "0,23"
+    "projection.hour.digits" = "2"
+
     # Debe coincidir con tu layout real (no Hive key=value)
-    "storage.location.template" = "s3://anomaly-detection-flow-logs-12051980/AWSLogs/730335323500/vpcflowlogs/us-east-1/$${year}/$${month}/$${day}/"
+    "storage.location.template" = "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/AWSLogs/${data.aws_caller_identity.current.account_id}/vpcflowlogs/${data.aws_region.current.id}/$${year}/$${month}/$${day}/$${hour}/"
   }
 
   storage_descriptor {
-    location      = "s3://anomaly-detection-flow-logs-12051980/AWSLogs/"
+    location      = "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/AWSLogs/"
     input_format  = "org.apache.hadoop.mapred.TextInputFormat"
     output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
 
@@ -142,7 +147,7 @@ resource "aws_glue_catalog_table" "vpc_flow_logs" {
     }
   }
 
-  # Particiones por día
+  # Particiones por hora
   partition_keys {
     name = "year"
     type = "string"
@@ -157,6 +162,274 @@ resource "aws_glue_catalog_table" "vpc_flow_logs" {
     name = "day"
     type = "string"
   }
+
+  partition_keys {
+    name = "hour"
+    type = "string"
+  }
+}
+
+# Fan-out multi-cuenta / multi-región: una tabla por target de var.fanout_targets
+# sobre el prefijo AWSLogs/<cuenta>/vpcflowlogs/<región>/ del bucket central
+# (los flow logs de esas cuentas deben entregarse en este bucket)
+locals {
+  fanout_targets = {
+    for target in var.fanout_targets :
+    "${target.account_id}_${replace(target.region, "-", "_")}" => target
+  }
+
+  flow_log_columns = [
+    { name = "version", type = "int" },
+    { name = "account_id", type = "string" },
+    { name = "interface_id", type = "string" },
+    { name = "srcaddr", type = "string" },
+    { name = "dstaddr", type = "string" },
+    { name = "srcport", type = "int" },
+    { name = "dstport", type = "int" },
+    { name = "protocol", type = "bigint" },
+    { name = "packets", type = "bigint" },
+    { name = "bytes", type = "bigint" },
+    { name = "start", type = "bigint" },
+    { name = "end", type = "bigint" },
+    { name = "action", type = "string" },
+    { name = "log_status", type = "string" },
+  ]
+}
+
+resource "aws_glue_catalog_table" "vpc_flow_logs_targets" {
+  for_each = local.fanout_targets
+
+  # Mismo nombre que fanout.default_table()
+  name          = "vpc_flow_logs_${each.key}"
+  database_name = aws_glue_catalog_database.vpc_flow_logs.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    classification = "csv"
+    "typeOfData"   = "file"
+
+    "projection.enabled" = "true"
+
+    "projection.year.type"  = "integer"
+    "projection.year.range" = "2020,2035"
+
+    "projection.month.type"   = "integer"
+    "projection.month.range"  = "1,12"
+    "projection.month.digits" = "2"
+
+    "projection.day.type"   = "integer"
+    "projection.day.range"  = "1,31"
+    "projection.day.digits" = "2"
+
+    "projection.hour.type"   = "integer"
+    "projection.hour.range"  = "0,23"
+    "projection.hour.digits" = "2"
+
+    "storage.location.template" = "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/AWSLogs/${each.value.account_id}/vpcflowlogs/${each.value.region}/$${year}/$${month}/$${day}/$${hour}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/AWSLogs/${each.value.account_id}/vpcflowlogs/${each.value.region}/"
+    input_format  = "org.apache.hadoop.mapred.TextInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe"
+      parameters = {
+        "field.delim"          = " "
+        "serialization.format" = " "
+      }
+    }
+
+    dynamic "columns" {
+      for_each = local.flow_log_columns
+      content {
+        name = columns.value.name
+        type = columns.value.type
+      }
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "hour"
+    type = "string"
+  }
+}
+
+# Targets del fan-out para la Lambda (FANOUT_TARGETS): la cuenta/región de
+# despliegue primero; vacío si no hay fanout_targets
+locals {
+  fanout_targets_json = length(var.fanout_targets) == 0 ? "" : jsonencode(concat(
+    [{
+      account_id = data.aws_caller_identity.current.account_id
+      region     = data.aws_region.current.id
+      table      = aws_glue_catalog_table.vpc_flow_logs.name
+    }],
+    [for key, table in aws_glue_catalog_table.vpc_flow_logs_targets : {
+      account_id = local.fanout_targets[key].account_id
+      region     = local.fanout_targets[key].region
+      table      = table.name
+    }]
+  ))
+}
+
+# Tabla columnar generada por scripts/compaction.py: Parquet + Snappy, una
+# partición por hora, filas ordenadas por srcaddr/dstaddr e IPv4 como bigint
+# (las direcciones no IPv4 van en srcaddr_text/dstaddr_text)
+resource "aws_glue_catalog_table" "vpc_flow_logs_parquet" {
+  name          = "vpc_flow_logs_parquet"
+  database_name = aws_glue_catalog_database.vpc_flow_logs.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    classification        = "parquet"
+    "parquet.compression" = "SNAPPY"
+
+    "projection.enabled" = "true"
+
+    "projection.year.type"  = "integer"
+    "projection.year.range" = "2020,2035"
+
+    "projection.month.type"   = "integer"
+    "projection.month.range"  = "1,12"
+    "projection.month.digits" = "2"
+
+    "projection.day.type"   = "integer"
+    "projection.day.range"  = "1,31"
+    "projection.day.digits" = "2"
+
+    "projection.hour.type"   = "integer"
+    "projection.hour.range"  = "0,23"
+    "projection.hour.digits" = "2"
+
+    "storage.location.template" = "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/compacted/year=$${year}/month=$${month}/day=$${day}/hour=$${hour}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/compacted/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    # Columnas
+    columns {
+      name = "version"
+      type = "int"
+    }
+
+    columns {
+      name = "account_id"
+      type = "string"
+    }
+
+    columns {
+      name = "interface_id"
+      type = "string"
+    }
+
+    columns {
+      name = "srcaddr"
+      type = "bigint"
+    }
+
+    columns {
+      name = "dstaddr"
+      type = "bigint"
+    }
+
+    columns {
+      name = "srcaddr_text"
+      type = "string"
+    }
+
+    columns {
+      name = "dstaddr_text"
+      type = "string"
+    }
+
+    columns {
+      name = "srcport"
+      type = "int"
+    }
+
+    columns {
+      name = "dstport"
+      type = "int"
+    }
+
+    columns {
+      name = "protocol"
+      type = "bigint"
+    }
+
+    columns {
+      name = "packets"
+      type = "bigint"
+    }
+
+    columns {
+      name = "bytes"
+      type = "bigint"
+    }
+
+    columns {
+      name = "start"
+      type = "bigint"
+    }
+
+    columns {
+      name = "end"
+      type = "bigint"
+    }
+
+    columns {
+      name = "action"
+      type = "string"
+    }
+
+    columns {
+      name = "log_status"
+      type = "string"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "hour"
+    type = "string"
+  }
 }
 
 # ===========================================
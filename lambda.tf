@@ -1,3 +1,35 @@
+# Capa con las dependencias que no trae el runtime (numpy): se instalan con
+# pip para la plataforma de Lambda (manylinux x86_64, Python 3.11) cada vez
+# que cambia requirements-layer.txt. pyarrow no se incluye: la compactación
+# se ejecuta fuera de la Lambda
+resource "terraform_data" "layer_dependencies" {
+  triggers_replace = [filesha1("${path.root}/scripts/requirements-layer.txt")]
+
+  provisioner "local-exec" {
+    command = <<-EOT
+      rm -rf "${path.root}/build/layer" "${path.root}/lambda_layer.zip" && \
+      python3 -m pip install --quiet --no-compile \
+        --platform manylinux2014_x86_64 --implementation cp --python-version 3.11 --only-binary=:all: \
+        --target "${path.root}/build/layer/python" \
+        -r "${path.root}/scripts/requirements-layer.txt" && \
+      python3 -m zipfile -c "${path.root}/lambda_layer.zip" "${path.root}/build/layer/python"
+    EOT
+  }
+}
+
+# La capa se vuelve a publicar solo cuando se reconstruye (el zip no se lee en cada plan)
+resource "aws_lambda_layer_version" "dependencies" {
+  layer_name          = "${var.lambda_name}-dependencies"
+  filename            = "${path.root}/lambda_layer.zip"
+  compatible_runtimes = ["python3.11"]
+
+  depends_on = [terraform_data.layer_dependencies]
+
+  lifecycle {
+    replace_triggered_by = [terraform_data.layer_dependencies]
+  }
+}
+
 # Crear el archivo ZIP de la función Lambda
 data "archive_file" "lambda_zip" {
   type        = "zip"
@@ -8,6 +40,96 @@ data "archive_file" "lambda_zip" {
     filename = "lambda_function.py"
   }
 
+  source {
+    content  = file("${path.root}/scripts/local_engine.py")
+    filename = "local_engine.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/sketches.py")
+    filename = "sketches.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/state_store.py")
+    filename = "state_store.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/query_planner.py")
+    filename = "query_planner.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/query_cache.py")
+    filename = "query_cache.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/analysis_stage.py")
+    filename = "analysis_stage.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/analysis_cache.py")
+    filename = "analysis_cache.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/prompt_builder.py")
+    filename = "prompt_builder.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/alert_pipeline.py")
+    filename = "alert_pipeline.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/pipeline.py")
+    filename = "pipeline.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/query_scheduler.py")
+    filename = "query_scheduler.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/aws_clients.py")
+    filename = "aws_clients.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/telemetry.py")
+    filename = "telemetry.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/ip_index.py")
+    filename = "ip_index.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/fanout.py")
+    filename = "fanout.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/baselines.py")
+    filename = "baselines.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/stream_state.py")
+    filename = "stream_state.py"
+  }
+
+  source {
+    content  = file("${path.root}/scripts/object_index.py")
+    filename = "object_index.py"
+  }
+
   source {
     content  = file("${path.root}/scripts/requirements.txt")
     filename = "requirements.txt"
@@ -27,6 +149,7 @@ resource "aws_lambda_function" "anomaly_detection_processor" {
   role          = aws_iam_role.lambda_role.arn
   handler       = "lambda_function.lambda_handler"
   runtime       = "python3.11"
+  layers        = [aws_lambda_layer_version.dependencies.arn]
   timeout       = 600  # 10 minutos
   memory_size   = 1024 # 1GB
 
@@ -35,11 +158,40 @@ resource "aws_lambda_function" "anomaly_detection_processor" {
   # Variables de entorno
   environment {
     variables = {
-      DATABASE_NAME    = aws_glue_catalog_database.vpc_flow_logs.name
-      TABLE_NAME       = aws_glue_catalog_table.vpc_flow_logs.name
-      RESULTS_BUCKET   = data.aws_s3_bucket.anomaly-detection-athena-results.bucket
-      SNS_TOPIC_ARN    = aws_sns_topic.anomaly_alerts.arn
-      BEDROCK_MODEL_ID = var.bedrock_model_id
+      DATABASE_NAME               = aws_glue_catalog_database.vpc_flow_logs.name
+      TABLE_NAME                  = aws_glue_catalog_table.vpc_flow_logs.name
+      RESULTS_BUCKET              = data.aws_s3_bucket.anomaly-detection-athena-results.bucket
+      SNS_TOPIC_ARN               = aws_sns_topic.anomaly_alerts.arn
+      BEDROCK_MODEL_ID            = var.bedrock_model_id
+      DETECTION_ENGINE            = var.detection_engine
+      AGGREGATION_MODE            = var.aggregation_mode
+      QUERY_PLAN                  = var.query_plan
+      ANALYSIS_WINDOW_MINUTES     = var.analysis_window_minutes
+      IP_ALLOWLIST                = var.ip_allowlist
+      IP_DENYLIST                 = var.ip_denylist
+      FANOUT_TARGETS              = local.fanout_targets_json
+      FANOUT_MAX_CONCURRENCY      = var.fanout_max_concurrency
+      BASELINE_LOCATION           = var.adaptive_thresholds ? "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/baselines/" : ""
+      BASELINE_CANDIDATE_RATIO    = var.baseline_candidate_ratio
+      STREAM_STATE_LOCATION       = var.stream_detection ? "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/stream-state/" : ""
+      STREAM_SHARDS               = var.stream_shards
+      INDEX_LOCATION              = var.object_index ? "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/flow-log-index/" : ""
+      CHECKPOINT_LOCATION         = var.incremental_detection ? "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/checkpoints/" : ""
+      COLUMNAR_TABLE_NAME         = var.columnar_compaction ? aws_glue_catalog_table.vpc_flow_logs_parquet.name : ""
+      COMPACTED_LOCATION          = var.columnar_compaction ? "s3://${data.aws_s3_bucket.anomaly-detection-flow-logs.bucket}/compacted/" : ""
+      QUERY_CACHE_TTL_SECONDS     = var.query_cache_ttl_seconds
+      QUERY_CACHE_LOCATION        = "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/query-cache/"
+      BEDROCK_MAX_CONCURRENCY     = var.bedrock_max_concurrency
+      BEDROCK_REQUESTS_PER_MINUTE = var.bedrock_requests_per_minute
+      ANALYSIS_CACHE_TTL_SECONDS  = var.analysis_cache_ttl_seconds
+      ANALYSIS_CACHE_LOCATION     = "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/analysis-cache/"
+      ALERT_SUPPRESSION_SECONDS   = var.alert_suppression_seconds
+      ALERT_STATE_LOCATION        = "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/alert-state/"
+      ALERT_OFFLOAD_LOCATION      = "s3://${data.aws_s3_bucket.anomaly-detection-athena-results.bucket}/alert-data/"
+      LOG_FORMAT                  = "json"
+      DECORATIVE_LOGS             = var.decorative_logs
+      FLOW_LOGS_BUCKET            = data.aws_s3_bucket.anomaly-detection-flow-logs.bucket
+      FLOW_LOGS_PREFIX            = "AWSLogs/${data.aws_caller_identity.current.account_id}/vpcflowlogs/${data.aws_region.current.id}/"
     }
   }
 
@@ -60,3 +212,31 @@ resource "aws_cloudwatch_log_group" "lambda_logs" {
 
   tags = local.common_tags
 }
+
+# Micro-lotes (stream_detection) e índice de objetos (object_index): cada
+# objeto nuevo de flow logs invoca la Lambda, que actualiza el estado por
+# shards y/o guarda la entrada del objeto en el índice (s3_event_handler)
+resource "aws_lambda_permission" "flow_logs_events" {
+  count          = var.stream_detection || var.object_index ? 1 : 0
+  statement_id   = "AllowFlowLogsObjectCreated"
+  action         = "lambda:InvokeFunction"
+  function_name  = aws_lambda_function.anomaly_detection_processor.function_name
+  principal      = "s3.amazonaws.com"
+  source_arn     = data.aws_s3_bucket.anomaly-detection-flow-logs.arn
+  source_account = data.aws_caller_identity.current.account_id
+}
+
+# La notificación sustituye a cualquier otra configurada en el bucket de flow logs
+resource "aws_s3_bucket_notification" "flow_logs_events" {
+  count  = var.stream_detection || var.object_index ? 1 : 0
+  bucket = data.aws_s3_bucket.anomaly-detection-flow-logs.id
+
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.anomaly_detection_processor.arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "AWSLogs/"
+    filter_suffix       = ".log.gz"
+  }
+
+  depends_on = [aws_lambda_permission.flow_logs_events]
+}
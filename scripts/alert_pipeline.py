@@ -0,0 +1,165 @@
+"""
+Etapa de alertas: deduplicación, digest y publicación por lotes en SNS.
+
+- Deduplicación: cada anomalía tiene la huella de analysis_cache (tipo,
+  participantes y magnitudes en potencias de 2). Una huella ya alertada
+  dentro de la ventana de supresión no se vuelve a enviar.
+- Digest: las anomalías nuevas de una ejecución se agrupan en el menor
+  número de mensajes posible (límite de 256 KB de SNS) y se envían con
+  publish_batch (hasta 10 mensajes y 256 KB por llamada).
+- Datos técnicos grandes: se guardan comprimidos en S3 (state_store) y el
+  mensaje solo lleva las primeras filas y la ubicación del objeto (sin
+  ubicación, solo las primeras filas).
+"""
+import json
+from datetime import datetime, timezone
+
+import analysis_cache
+import state_store
+import telemetry
+
+SNS_MAX_MESSAGE_BYTES = 256 * 1024
+# Margen para el asunto y los atributos del mensaje
+SNS_MESSAGE_MARGIN_BYTES = 4 * 1024
+PUBLISH_BATCH_SIZE = 10
+
+class SentAlerts(state_store.PersistentCache):
+    """Huellas de alertas enviadas; el TTL es la ventana de supresión"""
+    document = 'sent-alerts'
+
+class AlertPipeline:
+    def __init__(self, sns_client, topic_arn, render, subject, sent=None,
+                 offload_location='', s3_client=None, inline_data_bytes=16 * 1024, preview_rows=5):
+        """
+        render(anomaly, data_text) -> sección de texto de una anomalía
+        subject(anomaly) -> asunto cuando el mensaje lleva una sola anomalía
+        """
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.render = render
+        self.subject = subject
+        self.sent = sent
+        self.offload_location = offload_location
+        self.s3_client = s3_client
+        self.inline_data_bytes = inline_data_bytes
+        self.preview_rows = preview_rows
+        self.queue = []
+        self.stats = {'alerts': 0, 'suppressed': 0, 'messages': 0, 'offloaded': 0, 'failed': 0}
+
+    def is_suppressed(self, anomaly):
+        """True si la misma anomalía ya se alertó dentro de la ventana de supresión"""
+        if self.sent is None:
+            return False
+        if self.sent.get(analysis_cache.anomaly_fingerprint(anomaly)) is None:
+            return False
+        self.stats['suppressed'] += 1
+        return True
+
+    def add(self, anomaly):
+        """Encola una anomalía para el próximo flush"""
+        fingerprint = analysis_cache.anomaly_fingerprint(anomaly)
+        section = self.render(anomaly, self.technical_data(anomaly, fingerprint))
+        self.queue.append((anomaly, fingerprint, section))
+
+    def technical_data(self, anomaly, fingerprint):
+        """
+        JSON de las filas, o vista previa y ubicación en S3 si es demasiado
+        grande (sin ubicación, solo la vista previa: el JSON completo podría
+        superar el límite de SNS)
+        """
+        data = json.dumps(anomaly['data'], indent=2)
+        if len(data.encode()) <= self.inline_data_bytes:
+            return data
+        if not self.offload_location:
+            return self.preview(anomaly)
+
+        day = datetime.now(timezone.utc).strftime('%Y/%m/%d')
+        name = f"{day}/{anomaly['type'].lower().replace(' ', '-')}-{fingerprint[:16]}"
+        try:
+            state_store.save_json(self.offload_location, name, anomaly['data'], self.s3_client)
+        except Exception as e:
+            telemetry.console(f"⚠️ No se pudieron guardar los datos técnicos en {self.offload_location}: {str(e)}")
+            return self.preview(anomaly)
+
+        self.stats['offloaded'] += 1
+        location = f"{self.offload_location.rstrip('/')}/{name}.json.gz"
+        preview = json.dumps(anomaly['data'][:self.preview_rows], indent=2)
+        return f"{preview}\n... {len(anomaly['data'])} filas en total (JSON gzip completo): {location}"
+
+    def preview(self, anomaly):
+        """Primeras filas y total, para datos que no caben en el mensaje"""
+        return json.dumps(anomaly['data'][:self.preview_rows], indent=2) + f"\n... ({len(anomaly['data'])} filas en total)"
+
+    def _pack(self):
+        """Agrupa las secciones en mensajes que no superan el límite de SNS"""
+        limit = SNS_MAX_MESSAGE_BYTES - SNS_MESSAGE_MARGIN_BYTES
+        messages = []
+        for item in self.queue:
+            size = len(item[2].encode())
+            if messages and messages[-1]['size'] + size <= limit:
+                messages[-1]['items'].append(item)
+                messages[-1]['size'] += size
+            else:
+                messages.append({'items': [item], 'size': size})
+        return messages
+
+    def _entry(self, index, items):
+        if len(items) == 1:
+            subject = self.subject(items[0][0])
+            body = items[0][2]
+        else:
+            types = ', '.join(sorted({anomaly['type'] for anomaly, _, _ in items}))
+            subject = f"🚨 ALERTA: {len(items)} anomalías - {types}"
+            header = f"🚨 RESUMEN: {len(items)} anomalías nuevas en esta ejecución ({types})\n"
+            body = header + '\n'.join(section for _, _, section in items)
+        # SNS limita el asunto a 100 caracteres
+        return {'Id': f"alert-{index}", 'Subject': subject[:99], 'Message': body}
+
+    def flush(self):
+        """Publica las alertas encoladas y registra las huellas enviadas"""
+        if not self.queue:
+            return self.stats
+
+        messages = self._pack()
+        entries = [self._entry(index, message['items']) for index, message in enumerate(messages)]
+
+        # publish_batch: hasta 10 mensajes y 256 KB por llamada
+        batches = []
+        for entry, message in zip(entries, messages):
+            size = message['size'] + SNS_MESSAGE_MARGIN_BYTES
+            if (batches and len(batches[-1]['entries']) < PUBLISH_BATCH_SIZE
+                    and batches[-1]['size'] + size <= SNS_MAX_MESSAGE_BYTES):
+                batches[-1]['entries'].append((entry, message))
+                batches[-1]['size'] += size
+            else:
+                batches.append({'entries': [(entry, message)], 'size': size})
+
+        for batch in batches:
+            by_id = {entry['Id']: message for entry, message in batch['entries']}
+            try:
+                response = self.sns_client.publish_batch(
+                    TopicArn=self.topic_arn,
+                    PublishBatchRequestEntries=[entry for entry, _ in batch['entries']]
+                )
+            except Exception as e:
+                telemetry.console(f"❌ Error enviando alertas: {str(e)}")
+                # Un mensaje (digest) puede llevar varias alertas
+                self.stats['failed'] += sum(len(message['items']) for message in by_id.values())
+                continue
+
+            for failed in response.get('Failed', []):
+                telemetry.console(f"❌ Alerta {failed['Id']} rechazada por SNS: {failed.get('Message', failed.get('Code'))}")
+                self.stats['failed'] += len(by_id[failed['Id']]['items'])
+            for successful in response.get('Successful', []):
+                message = by_id[successful['Id']]
+                self.stats['messages'] += 1
+                for anomaly, fingerprint, _ in message['items']:
+                    self.stats['alerts'] += 1
+                    if self.sent is not None:
+                        self.sent.put(fingerprint, anomaly['type'])
+
+        self.queue = []
+        if self.sent is not None:
+            self.sent.flush()
+        telemetry.console(f"📧 Alertas: {self.stats}")
+        return self.stats
@@ -0,0 +1,49 @@
+"""
+Caché de análisis de IA por huella de la anomalía.
+
+Un ataque en curso (port scan, DDoS) dura más que el intervalo de ejecución
+y las consultas acumulan el día completo, así que cada ejecución vuelve a
+encontrar prácticamente la misma anomalía. La huella combina el tipo, el
+conjunto ordenado de direcciones implicadas y los campos numéricos de cada
+fila redondeados a potencias de 2: mientras el ataque no cambie de
+magnitud ni de participantes, se reutiliza el análisis ya generado.
+"""
+import hashlib
+import json
+import math
+
+import state_store
+
+# Campos que identifican a los participantes de una anomalía
+ADDRESS_FIELDS = ('srcaddr', 'dstaddr', 'protocol')
+
+def magnitude_bucket(value):
+    """Bucket logarítmico (base 2): un cambio material es duplicar o reducir a la mitad"""
+    if value <= 0:
+        return 0
+    return int(math.log2(value)) + 1
+
+def anomaly_fingerprint(anomaly):
+    """Huella estable de una anomalía (independiente del orden de las filas)"""
+    rows = []
+    for row in anomaly['data']:
+        participants = tuple(str(row[field]) for field in ADDRESS_FIELDS if field in row)
+        magnitudes = tuple(sorted(
+            (field, magnitude_bucket(value))
+            for field, value in row.items()
+            if field not in ADDRESS_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool)
+        ))
+        rows.append((participants, magnitudes))
+
+    key = json.dumps([anomaly['type'], anomaly['severity'], sorted(rows)], separators=(',', ':'))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+class AnalysisCache(state_store.PersistentCache):
+    document = 'analysis-cache'
+
+    def lookup(self, anomaly):
+        """Entrada con el análisis de una anomalía equivalente, o None"""
+        return self.get_entry(anomaly_fingerprint(anomaly))
+
+    def store(self, anomaly, analysis):
+        self.put(anomaly_fingerprint(anomaly), analysis, type=anomaly['type'])
@@ -0,0 +1,103 @@
+"""
+Etapa de análisis concurrente con límite de tasa.
+
+El pipeline (pipeline.py) analiza cada anomalía con analyze_one desde su
+pool de hilos acotado. Un token bucket compartido limita las llamadas por
+segundo a la cuota de Bedrock de la cuenta, los ThrottlingException se
+reintentan con backoff exponencial con jitter, y ninguna llamada empieza si
+no cabe antes del deadline de la invocación. Si no hay tiempo, la anomalía
+recibe el análisis de respaldo (sin IA).
+
+analyze(anomaly, deadline) recibe el deadline para poder cortar la respuesta
+y conservar un análisis parcial.
+"""
+import random
+import threading
+import time
+import telemetry
+
+THROTTLING_ERROR_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException'}
+
+class TokenBucket:
+    """Token bucket thread-safe: rate tokens por segundo, ráfagas de hasta capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, deadline):
+        """Espera un token; retorna False si no llega antes del deadline (monotonic)"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_seconds = (1 - self.tokens) / self.rate
+
+            if now + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+def is_throttling_error(error):
+    """True si el error de botocore indica throttling o saturación del servicio"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLING_ERROR_CODES or type(error).__name__ in THROTTLING_ERROR_CODES
+
+def backoff_delay(attempt, base, cap):
+    """Backoff exponencial con full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class AnalysisStage:
+    def __init__(self, analyze, fallback, requests_per_second, max_workers=4,
+                 max_retries=4, backoff_base=1.0, backoff_cap=20.0, min_call_seconds=20.0):
+        self.analyze = analyze
+        self.fallback = fallback
+        self.bucket = TokenBucket(requests_per_second, max(1, max_workers))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.min_call_seconds = min_call_seconds
+        self.stats = {'analyzed': 0, 'throttled': 0, 'fallback': 0}
+        self.stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _fallback(self, anomaly, reason):
+        self._count('fallback')
+        return self.fallback(anomaly) + f"\n\n⚠️ Nota: {reason}"
+
+    def analyze_one(self, anomaly, deadline):
+        """
+        Análisis de una anomalía (bloqueante) con el límite de tasa compartido,
+        reintentos y deadline
+        """
+        for attempt in range(self.max_retries + 1):
+            # La llamada debe poder terminar antes del deadline
+            call_deadline = deadline - self.min_call_seconds
+            if not self.bucket.acquire(call_deadline):
+                return self._fallback(anomaly, "Sin tiempo para el análisis de IA")
+
+            try:
+                analysis = self.analyze(anomaly, deadline)
+                self._count('analyzed')
+                return analysis
+            except Exception as e:
+                if not is_throttling_error(e):
+                    return self._fallback(anomaly, f"Error en análisis de IA: {str(e)}")
+                self._count('throttled')
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                if attempt == self.max_retries or time.monotonic() + delay > call_deadline:
+                    return self._fallback(anomaly, f"Bedrock limitado (throttling) tras {attempt + 1} intentos")
+                telemetry.console(f"⏳ Throttling en {anomaly['type']}, reintento en {delay:.1f}s")
+                time.sleep(delay)
@@ -0,0 +1,69 @@
+"""
+Clientes de AWS perezosos y compartidos.
+
+boto3 se importa y cada cliente se construye la primera vez que se usa (una
+ejecución sin anomalías no llega a crear el cliente de Bedrock), y todos los
+módulos comparten la misma instancia por servicio. La configuración de
+botocore ajusta el pool de conexiones a los hilos de análisis, mantiene las
+conexiones vivas entre invocaciones de una Lambda caliente y usa reintentos
+adaptativos.
+"""
+import threading
+
+import telemetry
+
+# Config de botocore común a todos los clientes
+CLIENT_CONFIG = {
+    'connect_timeout': 5,
+    'read_timeout': 30,
+    'tcp_keepalive': True,
+    # Hilos de análisis de Bedrock + lecturas de S3/Athena concurrentes
+    'max_pool_connections': 16,
+    'retries': {'mode': 'adaptive', 'max_attempts': 5}
+}
+
+# Ajustes por servicio sobre CLIENT_CONFIG
+SERVICE_CONFIG = {
+    # Respuestas largas en streaming; los reintentos por throttling los
+    # gestiona analysis_stage (con jitter y deadline)
+    'bedrock-runtime': {'read_timeout': 60, 'retries': {'mode': 'standard', 'max_attempts': 1}}
+}
+
+_clients = {}
+_lock = threading.Lock()
+# Manejadores de eventos de botocore que se registran en cada cliente nuevo
+# (los usan los tests y benchmarks para responder sin llamar a AWS)
+_event_handlers = []
+
+def register_event_handler(event_name, handler):
+    _event_handlers.append((event_name, handler))
+
+def get_client(service):
+    """Cliente compartido de un servicio, creado en el primer uso"""
+    client = _clients.get(service)
+    if client is not None:
+        return client
+
+    # La sesión por defecto de boto3 no es segura entre hilos al crear clientes
+    with _lock:
+        client = _clients.get(service)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            options = dict(CLIENT_CONFIG, **SERVICE_CONFIG.get(service, {}))
+            client = boto3.client(service, config=Config(**options))
+            for event_name, handler in _event_handlers:
+                client.meta.events.register(event_name, handler)
+            _clients[service] = client
+            telemetry.console(f"🔌 Cliente {service} inicializado")
+    return client
+
+class LazyClient:
+    """Referencia a un cliente que se crea al acceder a su primer método"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service), name)
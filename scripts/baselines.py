@@ -0,0 +1,374 @@
+"""
+Baselines por dirección para umbrales adaptativos.
+
+Los umbrales fijos de los detectores (>50 puertos, >100.000 paquetes, >100
+orígenes, >25 MB) generan ruido en los hosts con mucho tráfico y no ven a
+los que normalmente están callados. Con baselines cada clave de un detector
+(srcaddr, dstaddr o el par) se compara con su propio historial horario.
+
+- Rollup horario: al cerrarse una hora se agregan sus parciales (las mismas
+  consultas de la detección incremental, o el motor local) y se guarda el
+  valor de cada métrica por clave en rollups/AAAA/MM/DD/HH (las top
+  ROLLUP_MAX_KEYS claves por detector).
+- Baseline: por clave y métrica, una EWMA con su varianza y un t-digest de
+  los valores horarios (con decaimiento, así que el historial antiguo pesa
+  cada vez menos). Las horas sin tráfico de una clave cuentan como ceros y
+  se aplican de forma perezosa en su siguiente actualización o lectura.
+- Índice: las baselines se reparten en BASELINE_SHARDS documentos por hash
+  de la clave; comprobar las filas candidatas de un detector solo lee los
+  documentos de sus claves, nunca el historial.
+
+Una fila supera su baseline si alguna métrica es mayor que
+max(p99, EWMA + 3σ) del valor horario (escalado por las horas de la ventana
+en las métricas aditivas, como bytes o paquetes; los recuentos de valores
+distintos no se escalan). Las claves con menos de BASELINE_MIN_HOURS horas de
+historial usan el umbral fijo.
+"""
+import math
+import threading
+import zlib
+from datetime import datetime, timezone
+
+import state_store
+
+# Métricas del rollup por detector: alias de la fila -> origen en el estado
+# exacto del motor local ('sum' = primera suma del grupo, 'distinct' = recuento)
+ROLLUP_METRICS = {
+    'port_scanning': {'unique_ports': 'distinct'},
+    'ddos': {'total_packets': 'sum', 'unique_sources': 'distinct'},
+    'data_exfiltration': {'total_bytes': 'sum'}
+}
+# Campos de la fila que forman la clave de cada detector
+KEY_FIELDS = {
+    'port_scanning': ('srcaddr',),
+    'ddos': ('dstaddr',),
+    'data_exfiltration': ('srcaddr', 'dstaddr')
+}
+# Métricas que se suman entre horas: su baseline horario se escala por la ventana
+ADDITIVE_METRICS = {'total_packets', 'total_bytes'}
+
+# Claves por detector que se guardan en cada rollup (las de mayor valor)
+ROLLUP_MAX_KEYS = 20000
+# Documentos entre los que se reparten las baselines de cada detector
+BASELINE_SHARDS = 64
+# Horas de historial necesarias para usar la baseline en lugar del umbral fijo
+BASELINE_MIN_HOURS = 24
+# Claves sin tráfico durante más horas que esto se eliminan
+BASELINE_RETENTION_HOURS = 14 * 24
+# Las horas sin tráfico acumuladas de una vez (los ceros) se limitan a esto
+MAX_GAP_HOURS = 7 * 24
+
+# Vida media de la EWMA y de los pesos del t-digest, en horas
+EWMA_HALF_LIFE_HOURS = 24
+DIGEST_HALF_LIFE_HOURS = 7 * 24
+EWMA_ALPHA = 1 - 0.5 ** (1 / EWMA_HALF_LIFE_HOURS)
+DIGEST_DECAY = 0.5 ** (1 / DIGEST_HALF_LIFE_HOURS)
+DIGEST_COMPRESSION = 20
+
+# Límite horario: max(cuantil QUANTILE, EWMA + SIGMAS desviaciones)
+QUANTILE = 0.99
+SIGMAS = 3
+
+# Filas candidatas que se evalúan de cada vez
+ROW_BLOCK_SIZE = 1024
+
+MANIFEST_NAME = 'baselines/manifest'
+
+def hour_start(epoch):
+    return int(epoch) - int(epoch) % 3600
+
+def rollup_name(hour):
+    return f"rollups/{datetime.fromtimestamp(hour, tz=timezone.utc):%Y/%m/%d/%H}"
+
+def key_text(key):
+    """Clave de un grupo del motor local (texto o tupla) como texto"""
+    return '|'.join(key) if isinstance(key, tuple) else str(key)
+
+def row_key(detector, row):
+    return '|'.join(str(row.get(field, '')) for field in KEY_FIELDS[detector])
+
+class TDigest:
+    """
+    t-digest con fusión: centroides (media, peso) ordenados cuyo peso máximo
+    es proporcional a sqrt(q(1 - q)), de modo que las colas (p99) conservan
+    resolución con unas ~1,6 * compression centroides
+    """
+
+    def __init__(self, compression=DIGEST_COMPRESSION, centroids=None):
+        self.compression = compression
+        self.centroids = centroids or []
+
+    @property
+    def total(self):
+        return sum(weight for _, weight in self.centroids)
+
+    def add(self, value, weight=1.0):
+        if weight > 0:
+            self.centroids.append([float(value), float(weight)])
+        if len(self.centroids) > 2 * self.compression:
+            self.compress()
+
+    def merge(self, other):
+        self.centroids.extend([mean, weight] for mean, weight in other.centroids)
+        self.compress()
+        return self
+
+    def scale(self, factor):
+        """Multiplica todos los pesos (decaimiento del historial)"""
+        for centroid in self.centroids:
+            centroid[1] *= factor
+
+    def compress(self):
+        centroids = sorted(self.centroids)
+        total = sum(weight for _, weight in centroids)
+        merged = []
+        before = 0.0
+        for mean, weight in centroids:
+            if merged:
+                last_mean, last_weight = merged[-1]
+                q = (before + (last_weight + weight) / 2) / total
+                if last_weight + weight <= max(1.0, 2 * total * math.sqrt(q * (1 - q)) / self.compression):
+                    combined = last_weight + weight
+                    merged[-1] = [last_mean + (mean - last_mean) * weight / combined, combined]
+                    continue
+                before += last_weight
+            merged.append([mean, weight])
+        self.centroids = merged
+
+    def quantile(self, q):
+        """Valor aproximado del cuantil q, interpolando entre centroides; None si está vacío"""
+        self.compress()
+        if not self.centroids:
+            return None
+        target = q * self.total
+        cumulative = 0.0
+        previous = None
+        for mean, weight in self.centroids:
+            middle = cumulative + weight / 2
+            if target <= middle:
+                if previous is None:
+                    return mean
+                previous_middle, previous_mean = previous
+                return previous_mean + (mean - previous_mean) * (target - previous_middle) / (middle - previous_middle)
+            previous = (middle, mean)
+            cumulative += weight
+        return self.centroids[-1][0]
+
+    def to_list(self):
+        return [round(value, 4) for centroid in self.centroids for value in centroid]
+
+    @classmethod
+    def from_list(cls, values, compression=DIGEST_COMPRESSION):
+        return cls(compression, [[values[i], values[i + 1]] for i in range(0, len(values), 2)])
+
+class Baseline:
+    """Estadísticas de los valores horarios de una métrica de una clave"""
+
+    def __init__(self, ewma=0.0, variance=0.0, hours=0, last_hour=None, digest=None):
+        self.ewma = ewma
+        self.variance = variance
+        self.hours = hours
+        self.last_hour = last_hour
+        self.digest = digest or TDigest()
+
+    def _update_ewma(self, value):
+        # Varianza exponencial incremental (misma alpha que la media)
+        difference = value - self.ewma
+        increment = EWMA_ALPHA * difference
+        self.ewma += increment
+        self.variance = (1 - EWMA_ALPHA) * (self.variance + difference * increment)
+
+    def advance(self, hour):
+        """Cuenta como ceros las horas sin valor entre la última observada y hour (excluida)"""
+        if self.last_hour is None or hour - self.last_hour <= 3600:
+            return
+        gap = min((hour - self.last_hour) // 3600 - 1, MAX_GAP_HOURS)
+        for _ in range(gap):
+            self._update_ewma(0.0)
+        self.digest.scale(DIGEST_DECAY ** gap)
+        self.digest.add(0.0, gap)
+        self.hours += gap
+        self.last_hour = hour - 3600
+
+    def observe(self, hour, value):
+        """Añade el valor de una hora; las horas ya observadas se ignoran"""
+        if self.last_hour is not None and hour <= self.last_hour:
+            return
+        self.advance(hour)
+        self._update_ewma(float(value))
+        self.digest.scale(DIGEST_DECAY)
+        self.digest.add(value)
+        self.hours += 1
+        self.last_hour = hour
+
+    def limit(self):
+        """Valor horario por encima del cual la métrica es anómala para la clave"""
+        upper = self.ewma + SIGMAS * math.sqrt(max(self.variance, 0.0))
+        return max(self.digest.quantile(QUANTILE) or 0.0, upper)
+
+    def to_list(self):
+        return [round(self.ewma, 4), round(self.variance, 4), self.hours, self.last_hour, self.digest.to_list()]
+
+    @classmethod
+    def from_list(cls, values):
+        ewma, variance, hours, last_hour, digest = values
+        return cls(ewma, variance, hours, last_hour, TDigest.from_list(digest))
+
+def rollup_from_aggregators(aggregators, max_keys=ROLLUP_MAX_KEYS):
+    """
+    Rollup de una hora a partir de los agregadores exactos del motor local:
+    {detector: {clave: {métrica: valor}}} con las max_keys claves de mayor
+    valor (primera métrica) de cada detector
+    """
+    rollup = {}
+    for name, metrics in ROLLUP_METRICS.items():
+        state = getattr(aggregators.get(name), 'state', None)
+        if state is None:
+            continue
+        values = {
+            key_text(key): {
+                metric: len(group['distinct']) if source == 'distinct' else group['sums'][0]
+                for metric, source in metrics.items()
+            }
+            for key, group in state.groups.items()
+        }
+        if len(values) > max_keys:
+            first = next(iter(metrics))
+            top = sorted(values, key=lambda key: values[key][first], reverse=True)[:max_keys]
+            values = {key: values[key] for key in top}
+        rollup[name] = values
+    return rollup
+
+class BaselineStore:
+    """
+    Baselines por (detector, clave, métrica) repartidas en documentos de
+    state_store por hash de la clave, más el manifiesto con la última hora
+    incorporada. Los documentos leídos se mantienen en memoria.
+    """
+
+    stat_names = ('baseline_rows', 'static_rows', 'suppressed_rows', 'promoted_rows')
+
+    def __init__(self, location, s3_client=None, shards=BASELINE_SHARDS):
+        self.location = location
+        self.s3_client = s3_client
+        self.shard_count = shards
+        self.shards = {}
+        self.dirty = set()
+        self.manifest = state_store.load_json(location, MANIFEST_NAME, s3_client) or {}
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(self.stat_names, 0)
+
+    def begin(self):
+        self.stats = dict.fromkeys(self.stat_names, 0)
+
+    @property
+    def rolled_up_until(self):
+        """Inicio (epoch) de la última hora incorporada, o None"""
+        return self.manifest.get('rolled_up_until')
+
+    def shard_name(self, detector, number):
+        return f"baselines/{detector}-{number:03d}"
+
+    def shard_number(self, key):
+        return zlib.crc32(key.encode()) % self.shard_count
+
+    def shard(self, detector, number):
+        """Documento {clave: {métrica: baseline}} de un shard, leído en su primer uso"""
+        with self.lock:
+            shard = self.shards.get((detector, number))
+            if shard is None:
+                shard = state_store.load_json(self.location, self.shard_name(detector, number), self.s3_client) or {}
+                self.shards[(detector, number)] = shard
+            return shard
+
+    def lookup(self, detector, keys):
+        """{clave: {métrica: Baseline}} de las claves con historial (solo lee sus shards)"""
+        found = {}
+        for key in keys:
+            entry = self.shard(detector, self.shard_number(key)).get(key)
+            if entry:
+                found[key] = {metric: Baseline.from_list(values) for metric, values in entry.items()}
+        return found
+
+    def observe(self, hour, rollup):
+        """Incorpora el rollup de una hora a las baselines y purga las claves inactivas"""
+        for detector, values in rollup.items():
+            for key, metrics in values.items():
+                number = self.shard_number(key)
+                entry = self.shard(detector, number).setdefault(key, {})
+                for metric, value in metrics.items():
+                    baseline = Baseline.from_list(entry[metric]) if metric in entry else Baseline()
+                    baseline.observe(hour, value)
+                    entry[metric] = baseline.to_list()
+                self.dirty.add((detector, number))
+
+        expired_before = hour - BASELINE_RETENTION_HOURS * 3600
+        for (detector, number) in self.dirty:
+            shard = self.shards[(detector, number)]
+            for key in [key for key, entry in shard.items()
+                        if all(values[3] < expired_before for values in entry.values())]:
+                del shard[key]
+        self.manifest['rolled_up_until'] = hour
+
+    def save_rollup(self, hour, rollup):
+        state_store.save_json(self.location, rollup_name(hour), {'hour': hour, 'detectors': rollup}, self.s3_client)
+
+    def flush(self):
+        """Guarda los shards modificados y el manifiesto"""
+        for detector, number in sorted(self.dirty):
+            state_store.save_json(self.location, self.shard_name(detector, number),
+                                  self.shards[(detector, number)], self.s3_client)
+        self.dirty = set()
+        state_store.save_json(self.location, MANIFEST_NAME, self.manifest, self.s3_client)
+
+    def row_limits(self, detector, row, baselines, thresholds, floors, window_hours):
+        """Límite de cada métrica de la fila: su baseline (con historial suficiente) o el umbral fijo"""
+        next_hour = (self.rolled_up_until or 0) + 3600
+        limits = {}
+        for metric, threshold in thresholds.items():
+            baseline = baselines.get(metric)
+            if baseline is None or baseline.hours < BASELINE_MIN_HOURS:
+                limits[metric] = (threshold, False)
+                continue
+            baseline.advance(next_hour)
+            scale = window_hours if metric in ADDITIVE_METRICS else 1
+            limits[metric] = (max(floors.get(metric, 0), baseline.limit() * scale), True)
+        return limits
+
+    def filter_block(self, detector, rows, thresholds, floors, window_hours):
+        found = self.lookup(detector, {row_key(detector, row) for row in rows})
+        kept = []
+        for row in rows:
+            limits = self.row_limits(detector, row, found.get(row_key(detector, row), {}), thresholds, floors, window_hours)
+            exceeded = [metric for metric, (limit, _) in limits.items() if (row.get(metric) or 0) > limit]
+            if any(adaptive for _, adaptive in limits.values()):
+                self.stats['baseline_rows'] += 1
+            else:
+                self.stats['static_rows'] += 1
+            if not exceeded:
+                self.stats['suppressed_rows'] += 1
+                continue
+            if all((row.get(metric) or 0) <= threshold for metric, threshold in thresholds.items()):
+                # Por debajo del umbral fijo: solo es anómala respecto a su historial
+                self.stats['promoted_rows'] += 1
+            for metric, (limit, adaptive) in limits.items():
+                if adaptive:
+                    row[f"{metric}_baseline"] = int(limit)
+            kept.append(row)
+        return kept
+
+    def filter_rows(self, detector, rows, thresholds, floors=None, window_hours=1):
+        """
+        Filtra las filas candidatas de un detector contra sus baselines
+        (thresholds: umbrales fijos; floors: mínimos de los límites
+        adaptativos, los umbrales de las consultas de candidatos). Las filas
+        que se conservan llevan el límite usado en '<métrica>_baseline'.
+        """
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == ROW_BLOCK_SIZE:
+                yield from self.filter_block(detector, block, thresholds, floors or {}, window_hours)
+                block = []
+        if block:
+            yield from self.filter_block(detector, block, thresholds, floors or {}, window_hours)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Benchmark offline de detección sobre flow logs sintéticos (flowlog_generator.py)
+# Mide, por escala: parseo, cada detector del motor local y lambda_handler completo
+# (S3/SNS locales, sin Bedrock), con throughput, RSS máximo y recall frente a los
+# ataques inyectados. Cada medida corre en un proceso nuevo para aislar el RSS.
+#
+# Uso:
+#   python benchmark_detection.py                        # 10^5 y 10^6 registros
+#   python benchmark_detection.py --scales 1e5,1e6,1e7,1e8 --data-dir /mnt/bench
+#   python benchmark_detection.py --mode sketch --json resultados.json
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_DIR)
+
+import flowlog_generator
+
+DETECTORS = ['port_scanning', 'ddos', 'data_exfiltration']
+# Campos que identifican cada anomalía en los resultados de un detector
+DETECTOR_KEYS = {
+    'port_scanning': ('srcaddr',),
+    'ddos': ('dstaddr',),
+    'data_exfiltration': ('srcaddr', 'dstaddr')
+}
+BENCHMARK_BUCKET = 'flow-logs-benchmark'
+
+def peak_rss_mb():
+    # ru_maxrss está en KB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def result_keys(detector, rows):
+    return {tuple(row[field] for field in DETECTOR_KEYS[detector]) for row in rows or []}
+
+def truth_keys(detector, truth):
+    return {tuple(item) if isinstance(item, list) else (item,) for item in truth['anomalies'][detector]}
+
+def score(detector, found, truth):
+    """Recall frente a los ataques inyectados y detecciones fuera de ellos"""
+    expected = truth_keys(detector, truth)
+    return {
+        'recall': len(found & expected) / len(expected),
+        'false_positives': len(found - expected)
+    }
+
+class LocalS3:
+    """Cliente S3 mínimo sobre el directorio generado (list_objects_v2 y get_object)"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        contents = []
+        for root, _, names in os.walk(os.path.join(self.root, Prefix)):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                modified = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+                contents.append({'Key': os.path.relpath(path, self.root), 'LastModified': modified})
+        yield {'Contents': sorted(contents, key=lambda item: item['Key'])}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return {'Body': open(os.path.join(self.root, Key), 'rb')}
+
+class CaptureSNS:
+    """SNS local: guarda los mensajes publicados"""
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.messages.append(Message)
+        return {'MessageId': str(len(self.messages))}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        for entry in PublishBatchRequestEntries:
+            self.messages.append(entry['Message'])
+        return {'Successful': [{'Id': entry['Id']} for entry in PublishBatchRequestEntries], 'Failed': []}
+
+class Context:
+    aws_request_id = 'detection-benchmark'
+
+    def get_remaining_time_in_millis(self):
+        return 600000
+
+def bench_parse(data_dir, truth, mode):
+    import local_engine
+
+    started_at = time.perf_counter()
+    records = 0
+    for path in flowlog_generator.flow_log_files(data_dir, truth):
+        for batch in local_engine.parse_batches(local_engine.iter_file_chunks(path)):
+            records += len(batch['start'])
+    return {'seconds': time.perf_counter() - started_at, 'records': records}
+
+def bench_detector(data_dir, truth, mode, detector):
+    """Parseo + un solo detector; el tiempo del detector excluye el parseo"""
+    import local_engine
+
+    aggregator = local_engine.create_aggregators(mode)[detector]
+    started_at = time.perf_counter()
+    detector_seconds = 0.0
+    records = 0
+    for path in flowlog_generator.flow_log_files(data_dir, truth):
+        for batch in local_engine.parse_batches(local_engine.iter_file_chunks(path)):
+            records += len(batch['start'])
+            updated_at = time.perf_counter()
+            aggregator.update(batch)
+            detector_seconds += time.perf_counter() - updated_at
+
+    updated_at = time.perf_counter()
+    rows = aggregator.results()
+    detector_seconds += time.perf_counter() - updated_at
+    result = {
+        'seconds': time.perf_counter() - started_at,
+        'detector_seconds': detector_seconds,
+        'records': records
+    }
+    result.update(score(detector, result_keys(detector, rows), truth))
+    return result
+
+def bench_handler(data_dir, truth, mode):
+    """lambda_handler completo con el motor local: S3 y SNS locales, análisis sin IA"""
+    os.environ.update({
+        'DETECTION_ENGINE': 'local',
+        'AGGREGATION_MODE': mode,
+        'FLOW_LOGS_BUCKET': BENCHMARK_BUCKET,
+        'FLOW_LOGS_PREFIX': truth['base_prefix'],
+        'BEDROCK_ENABLED': 'false',
+        'CHECKPOINT_LOCATION': '',
+        'QUERY_CACHE_LOCATION': '',
+        'ANALYSIS_CACHE_LOCATION': '',
+        'ALERT_STATE_LOCATION': '',
+        'ALERT_OFFLOAD_LOCATION': ''
+    })
+    import lambda_function
+
+    sns = CaptureSNS()
+    lambda_function.s3_client = LocalS3(data_dir)
+    lambda_function.sns_client = sns
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    started_at = time.perf_counter()
+    try:
+        response = lambda_function.lambda_handler({}, Context())
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    seconds = time.perf_counter() - started_at
+
+    # Recall extremo a extremo: los ataques deben aparecer en las alertas enviadas
+    alerts = '\n'.join(sns.messages)
+    expected = [key for detector in DETECTORS for key in truth_keys(detector, truth)]
+    alerted = [key for key in expected if all(f'"{value}"' in alerts for value in key)]
+    return {
+        'seconds': seconds,
+        'records': truth['records'],
+        'status': response['statusCode'],
+        'anomalies': json.loads(response['body']).get('anomalies_found'),
+        'recall': len(alerted) / len(expected)
+    }
+
+def measure(stage, data_dir, mode):
+    """Proceso hijo: ejecuta una etapa y escribe el resultado como JSON"""
+    truth = flowlog_generator.load_truth(data_dir)
+    if stage == 'parse':
+        result = bench_parse(data_dir, truth, mode)
+    elif stage == 'handler':
+        result = bench_handler(data_dir, truth, mode)
+    else:
+        result = bench_detector(data_dir, truth, mode, stage)
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+def run_stage(stage, data_dir, mode):
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', stage, '--data-dir', data_dir, '--mode', mode],
+        env=env, capture_output=True, text=True
+    )
+    if output.returncode != 0:
+        raise RuntimeError(f"Etapa {stage} fallida: {output.stderr.strip().splitlines()[-1:]}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def prepare_data(base_dir, records, seed):
+    """Genera el conjunto de datos de una escala (o reutiliza uno ya generado hoy)"""
+    data_dir = os.path.join(base_dir, f"{records}-seed{seed}")
+    today = datetime.now(timezone.utc).date().isoformat()
+    truth = flowlog_generator.load_truth(data_dir)
+    if truth and truth['records'] == records and truth['day'] == today:
+        print(f"♻️ Reutilizando {records} registros en {data_dir}")
+        return data_dir
+
+    print(f"🏭 Generando {records} registros en {data_dir}...")
+    started_at = time.perf_counter()
+    flowlog_generator.generate(data_dir, records, seed)
+    print(f"   {time.perf_counter() - started_at:.1f}s")
+    return data_dir
+
+def print_row(name, result):
+    seconds = result.get('detector_seconds', result['seconds'])
+    throughput = result['records'] / seconds if seconds else 0
+    line = f"   {name:<20} {seconds:>8.2f}s {throughput / 1e6:>8.2f} M reg/s {result['peak_rss_mb']:>8.0f} MB"
+    if 'recall' in result:
+        line += f"   recall {result['recall']:.0%}"
+    if 'false_positives' in result:
+        line += f" (+{result['false_positives']} fuera de los ataques)"
+    print(line)
+
+def benchmark_scale(base_dir, records, seed, mode):
+    data_dir = prepare_data(base_dir, records, seed)
+    results = {}
+    print(f"\n📏 {records:,} registros (modo {mode})")
+    print(f"   {'etapa':<20} {'tiempo':>9} {'throughput':>14} {'RSS máx':>11}")
+    for stage in ['parse'] + DETECTORS + ['handler']:
+        results[stage] = run_stage(stage, data_dir, mode)
+        print_row(stage, results[stage])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de detección sobre flow logs sintéticos')
+    parser.add_argument('--scales', default='1e5,1e6', help='Registros por escala, separados por comas')
+    parser.add_argument('--data-dir', default=os.path.join('/tmp', 'flow-logs-benchmark'))
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--mode', choices=['exact', 'sketch'], default='exact')
+    parser.add_argument('--min-recall', type=float, default=1.0, help='Recall mínimo para salir con éxito')
+    parser.add_argument('--json', help='Guarda los resultados en este fichero')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.child, args.data_dir, args.mode)
+        return 0
+
+    print("🔬 === DETECTION BENCHMARK (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    report = {}
+    for scale in args.scales.split(','):
+        records = int(float(scale))
+        report[records] = benchmark_scale(args.data_dir, records, args.seed, args.mode)
+
+    if args.json:
+        with open(args.json, 'w') as stream:
+            json.dump(report, stream, indent=2)
+        print(f"\n💾 Resultados en {args.json}")
+
+    recalls = [result['recall'] for results in report.values() for result in results.values() if 'recall' in result]
+    recall_ok = min(recalls) >= args.min_recall
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN:")
+    print(f"   🎯 Recall mínimo: {min(recalls):.0%} ({'✅ OK' if recall_ok else '❌ FAIL'}, umbral {args.min_recall:.0%})")
+    return 0 if recall_ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Benchmark de ip_index.py con listas de CIDRs grandes (por defecto 100.000)
+# Mide la compilación de la lista, la pertenencia vectorizada sobre columnas de
+# direcciones como las del motor local y el filtrado de filas de resultados,
+# frente a la comprobación fila a fila con ipaddress. Verifica además que ambos
+# métodos coinciden sobre una muestra.
+#
+# Uso:
+#   python benchmark_ip_index.py
+#   python benchmark_ip_index.py --cidrs 100000 --addresses 1000000 --ipv6 1000
+import argparse
+import ipaddress
+import random
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import ip_index
+import local_engine
+
+# Direcciones comprobadas con ipaddress (la referencia lenta)
+REFERENCE_SAMPLE = 2000
+# Objetivo: filtrar un lote del motor local (100.000 registros) en menos de esto
+MAX_BATCH_MS = 100
+
+def random_cidrs(rng, count, ipv6_count):
+    """CIDRs IPv4 de /16 a /32 (sesgados a prefijos largos, como las listas de reputación) y algunos IPv6"""
+    cidrs = []
+    for _ in range(count):
+        length = rng.choice([16, 20, 24, 24, 24, 28, 32, 32, 32, 32])
+        cidrs.append(f"{ipaddress.IPv4Address(rng.getrandbits(32))}/{length}")
+    for _ in range(ipv6_count):
+        cidrs.append(f"{ipaddress.IPv6Address(rng.getrandbits(128))}/{rng.choice([32, 48, 64, 128])}")
+    return cidrs
+
+def random_addresses(rng, count, cidrs):
+    """Columna de direcciones (bytes): mitad aleatorias, mitad dentro de los CIDRs"""
+    networks = [ipaddress.ip_network(cidr, strict=False) for cidr in rng.sample(cidrs, min(len(cidrs), 1000))]
+    addresses = []
+    for i in range(count):
+        if i % 2:
+            network = networks[i % len(networks)]
+            address = network.network_address + rng.randrange(network.num_addresses)
+        else:
+            address = ipaddress.IPv4Address(rng.getrandbits(32))
+        addresses.append(str(address).encode())
+    return np.array(addresses, dtype=bytes)
+
+def reference_contains(networks, address):
+    """Comprobación fila a fila con ipaddress (lo que se evita)"""
+    address = ipaddress.ip_address(address.decode())
+    return any(address in network for network in networks)
+
+def timed(function, *args):
+    started_at = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started_at
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de ip_index con listas de CIDRs grandes')
+    parser.add_argument('--cidrs', type=int, default=100000)
+    parser.add_argument('--ipv6', type=int, default=1000, help='CIDRs IPv6 añadidos a la lista')
+    parser.add_argument('--addresses', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print("🔬 === IP INDEX BENCHMARK ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    rng = random.Random(args.seed)
+    cidrs = random_cidrs(rng, args.cidrs, args.ipv6)
+    addresses = random_addresses(rng, args.addresses, cidrs[:args.cidrs])
+
+    index, compile_seconds = timed(ip_index.CidrIndex, cidrs)
+    print(f"📋 Compilación: {len(cidrs):,} CIDRs -> {len(index.v4_starts):,} intervalos IPv4 "
+          f"y {len(index.v6_starts):,} IPv6 en {compile_seconds * 1000:.0f} ms")
+
+    found, contains_seconds = timed(index.contains, addresses)
+    print(f"🔎 Pertenencia: {len(addresses):,} direcciones en {contains_seconds * 1000:.0f} ms "
+          f"({len(addresses) / contains_seconds / 1e6:.1f} M/s), {int(found.sum()):,} dentro")
+
+    batch = {'srcaddr': addresses[:local_engine.BATCH_SIZE], 'bytes': np.arange(min(local_engine.BATCH_SIZE, len(addresses)))}
+    lists = ip_index.IPLists()
+    lists.allow = index
+    _, batch_seconds = timed(lists.filter_batch, batch)
+    print(f"🧹 filter_batch: {len(batch['srcaddr']):,} registros en {batch_seconds * 1000:.1f} ms")
+
+    rows = [{'srcaddr': address.decode(), 'dstaddr': '10.0.0.1'} for address in addresses[:100000].tolist()]
+    lists.deny = index
+    kept, rows_seconds = timed(lambda: list(lists.filter_rows(rows)))
+    print(f"🧾 filter_rows: {len(rows):,} filas en {rows_seconds * 1000:.0f} ms ({len(kept):,} conservadas)")
+
+    # Referencia: ipaddress fila a fila sobre una muestra pequeña (extrapolado)
+    networks = [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs]
+    slow_sample = rng.sample(range(len(addresses)), min(REFERENCE_SAMPLE // 20, len(addresses)))
+    expected, reference_seconds = timed(lambda: [reference_contains(networks, addresses[i]) for i in slow_sample])
+    per_address = reference_seconds / len(slow_sample)
+    print(f"🐢 ipaddress fila a fila: {per_address * 1000:.1f} ms por dirección "
+          f"(~{per_address * len(addresses) / 3600:.1f} h para {len(addresses):,})")
+    mismatches = sum(inside != bool(found[i]) for i, inside in zip(slow_sample, expected))
+
+    # Muestra mayor contra los rangos que fusiona ipaddress.collapse_addresses
+    collapsed = list(ipaddress.collapse_addresses(network for network in networks if network.version == 4))
+    starts = [int(network.network_address) for network in collapsed]
+    sample = rng.sample(range(len(addresses)), min(REFERENCE_SAMPLE, len(addresses)))
+    for i in sample:
+        value = int(ipaddress.IPv4Address(addresses[i].decode()))
+        position = np.searchsorted(starts, value, side='right') - 1
+        inside = position >= 0 and value <= int(collapsed[position].broadcast_address)
+        mismatches += inside != bool(found[i])
+    checked = len(slow_sample) + len(sample)
+
+    batch_ok = batch_seconds * 1000 <= MAX_BATCH_MS
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN:")
+    print(f"   🎯 Coincidencia con ipaddress: {checked - mismatches}/{checked} "
+          f"({'✅ OK' if not mismatches else '❌ FAIL'})")
+    print(f"   ⏱️ Lote de {len(batch['srcaddr']):,} registros: {batch_seconds * 1000:.1f} ms "
+          f"({'✅ OK' if batch_ok else '❌ FAIL'}, máximo {MAX_BATCH_MS} ms)")
+    print(f"   🚀 Aceleración frente a ipaddress: {per_address / (contains_seconds / len(addresses)):,.0f}x")
+    return 0 if not mismatches and batch_ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Benchmark de object_index.py sobre flow logs sintéticos (flowlog_generator)
+# Construye el índice por objeto de un día, ejecuta búsquedas típicas de una
+# investigación (una IP en los últimos minutos, una IP que no aparece, un
+# destino en la última hora, el día entero) y mide la fracción de objetos que
+# el índice descarta y el tiempo frente a leer todos los objetos. Verifica
+# que ambas lecturas retornan los mismos registros.
+#
+# Uso:
+#   python benchmark_object_index.py
+#   python benchmark_object_index.py --records 1000000 --records-per-object 10000
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import flowlog_generator
+import object_index
+
+# Dirección que el generador nunca usa (TEST-NET-1)
+ABSENT_ADDRESS = '192.0.2.123'
+# Objetivo: una búsqueda en los últimos 15 minutos descarta al menos esta fracción
+MIN_RECENT_SKIP = 0.9
+
+def prepare_data(base_dir, records, records_per_object, seed):
+    """Genera el día de flow logs (o reutiliza uno ya generado hoy)"""
+    data_dir = os.path.join(base_dir, f"{records}-{records_per_object}-seed{seed}")
+    today = datetime.now(timezone.utc).date().isoformat()
+    truth = flowlog_generator.load_truth(data_dir)
+    if truth and truth['records'] == records and truth['day'] == today:
+        print(f"♻️ Reutilizando {records:,} registros en {data_dir}")
+        return data_dir, truth
+
+    print(f"🏭 Generando {records:,} registros en objetos de {records_per_object:,} en {data_dir}...")
+    started_at = time.perf_counter()
+    truth = flowlog_generator.generate(data_dir, records, seed, records_per_object=records_per_object)
+    print(f"   {time.perf_counter() - started_at:.1f}s")
+    return data_dir, truth
+
+def timed(function, *args):
+    started_at = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started_at
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del índice por objeto de los flow logs')
+    parser.add_argument('--records', type=int, default=500000)
+    parser.add_argument('--records-per-object', type=int, default=5000)
+    parser.add_argument('--data-dir', default=os.path.join('/tmp', 'flow-index-benchmark'))
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print("🔬 === OBJECT INDEX BENCHMARK ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    data_dir, truth = prepare_data(args.data_dir, args.records, args.records_per_object, args.seed)
+    day_start = int(datetime.fromisoformat(truth['day']).replace(tzinfo=timezone.utc).timestamp())
+    day_end = day_start + 86400
+    prefixes = object_index.hour_prefixes(truth['base_prefix'], day_start, day_end - 1)
+    keys = [key for prefix in prefixes for key in object_index.list_objects(data_dir, '', prefix)]
+    data_bytes = sum(os.path.getsize(os.path.join(data_dir, key)) for key in keys)
+
+    def chunks_of(key):
+        return object_index.object_chunks(data_dir, '', key)
+
+    with tempfile.TemporaryDirectory() as location:
+        def build():
+            for prefix in prefixes:
+                directory = prefix.rstrip('/')
+                object_index.build_hour(location, directory, (
+                    (key, chunks_of(key)) for key in object_index.list_objects(data_dir, '', prefix)
+                ))
+
+        _, build_seconds = timed(build)
+        index_bytes = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(location) for name in names
+        )
+        index, load_seconds = timed(object_index.load_prefixes, location, prefixes)
+        print(f"🗂️ Índice: {len(index)} objetos en {build_seconds:.2f}s, {index_bytes / 1024:.0f} KB "
+              f"({index_bytes / data_bytes:.2%} de {data_bytes / 1e6:.1f} MB de objetos), carga en {load_seconds * 1000:.0f} ms")
+
+        scanner = truth['anomalies']['port_scanning'][0]
+        target = truth['anomalies']['ddos'][0]
+        lookups = [
+            ('REJECT de un escáner, 15 min', dict(start=day_end - 900, end=day_end, action='REJECT', srcaddr=scanner)),
+            ('IP ausente, todo el día', dict(srcaddr=ABSENT_ADDRESS)),
+            ('Destino DDoS, última hora', dict(start=day_end - 3600, end=day_end, dstaddr=target)),
+            ('Escáner, todo el día', dict(srcaddr=scanner))
+        ]
+
+        # Referencia: índice vacío, se leen todos los objetos
+        full_scan = object_index.ObjectIndex.concat([])
+        results = []
+        print(f"\n{'Búsqueda':<32} {'registros':>10} {'leídos':>8} {'descartados':>12} {'índice':>9} {'completo':>9}")
+        for name, filters in lookups:
+            (records, scanned), seconds = timed(lambda: object_index.lookup(index, keys, chunks_of, **filters))
+            (expected, _), full_seconds = timed(lambda: object_index.lookup(full_scan, keys, chunks_of, **filters))
+            skipped = 1 - len(scanned) / len(keys)
+            same = sorted(map(sorted, (record.items() for record in records))) == \
+                sorted(map(sorted, (record.items() for record in expected)))
+            results.append((name, skipped, same))
+            print(f"{name:<32} {len(records):>10,} {len(scanned):>8} {skipped:>12.0%} "
+                  f"{seconds:>8.2f}s {full_seconds:>8.2f}s {'✅' if same else '❌'}")
+
+    mismatches = [name for name, _, same in results if not same]
+    recent_skip = results[0][1]
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN:")
+    print(f"   🎯 Mismos registros que leyendo todo: {len(results) - len(mismatches)}/{len(results)} "
+          f"({'✅ OK' if not mismatches else '❌ FAIL'})")
+    print(f"   ✂️ Descartados en los últimos 15 minutos: {recent_skip:.0%} "
+          f"({'✅ OK' if recent_skip >= MIN_RECENT_SKIP else '❌ FAIL'}, mínimo {MIN_RECENT_SKIP:.0%})")
+    print(f"   📦 Tamaño del índice: {index_bytes / len(keys) / 1024:.1f} KB por objeto")
+    return 0 if not mismatches and recent_skip >= MIN_RECENT_SKIP else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Compactación de VPC Flow Logs a Parquet.
+
+Convierte las horas ya cerradas de los objetos de texto (gzip) en ficheros
+Parquet con compresión Snappy, particionados como
+year=YYYY/month=MM/day=DD/hour=HH/ (tabla vpc_flow_logs_parquet de athena.tf).
+Dentro de cada hora las filas se ordenan por srcaddr/dstaddr, y las
+direcciones IPv4 se guardan como enteros. Las direcciones que no son IPv4
+(IPv6 o '-') van en srcaddr_text/dstaddr_text y el valor entero queda nulo.
+
+El manifiesto (compaction-manifest en la ubicación de salida) registra
+cuántas horas de cada día están compactadas. lambda_function.py lo usa para
+leer esas horas de la tabla columnar y el resto del día de la tabla de texto.
+
+Uso local (ficheros en disco, imprime la comparación de bytes escaneados):
+    python compaction.py --output /tmp/compacted logs/*.log.gz
+
+Uso sobre S3 (compacta las horas cerradas pendientes del día):
+    python compaction.py --bucket <bucket> --prefix AWSLogs/<acct>/vpcflowlogs/<region>/ \\
+        --output s3://<bucket>/compacted/ [--day YYYY-MM-DD]
+"""
+import argparse
+import io
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ip_index
+import local_engine
+import query_planner
+import state_store
+
+MANIFEST_NAME = 'compaction-manifest'
+# Días conservados en el manifiesto
+MANIFEST_DAYS = 31
+
+COMPRESSION = 'snappy'
+ROW_GROUP_SIZE = 1000000
+
+# Una hora se considera cerrada cuando ha pasado este margen desde su fin
+# (mismo criterio de llegada tardía que WATERMARK_LATENESS_SECONDS)
+HOUR_LATENESS_SECONDS = 600
+# Los objetos de S3 contienen registros de hasta ~10 minutos antes de su entrega
+OBJECT_DELIVERY_SECONDS = 900
+
+IP_FIELDS = ['srcaddr', 'dstaddr']
+INT32_FIELDS = ['version', 'srcport', 'dstport']
+INT64_FIELDS = ['protocol', 'packets', 'bytes', 'start', 'end']
+STRING_FIELDS = ['account_id', 'interface_id', 'action', 'log_status']
+
+# Mismo orden y tipos que la tabla de texto, con las IPs como bigint
+COMPACTED_SCHEMA = pa.schema([
+    ('version', pa.int32()),
+    ('account_id', pa.string()),
+    ('interface_id', pa.string()),
+    ('srcaddr', pa.int64()),
+    ('dstaddr', pa.int64()),
+    ('srcaddr_text', pa.string()),
+    ('dstaddr_text', pa.string()),
+    ('srcport', pa.int32()),
+    ('dstport', pa.int32()),
+    ('protocol', pa.int64()),
+    ('packets', pa.int64()),
+    ('bytes', pa.int64()),
+    ('start', pa.int64()),
+    ('end', pa.int64()),
+    ('action', pa.string()),
+    ('log_status', pa.string())
+])
+
+def iter_record_blocks(chunks):
+    """Bloques (n, 14) con todos los registros (incluidos NODATA/SKIPDATA) sin la cabecera"""
+    start = local_engine.FLOW_LOG_FIELDS.index('start')
+    for chunk in chunks:
+        records = local_engine.split_records(chunk)
+        records = records[np.char.isdigit(records[:, start])]
+        if len(records):
+            yield records
+
+def ip_to_int(values):
+    """
+    Convierte direcciones (bytes) a enteros: retorna (enteros, máscara IPv4,
+    texto de las que no son IPv4). El parseo de IPv4 es vectorizado (ip_index).
+    """
+    numbers, valid = ip_index.parse_ipv4(values)
+    texts = np.empty(len(values), dtype=object)
+    others = np.flatnonzero(~valid)
+    if len(others):
+        texts[others] = np.char.decode(values[others]).tolist()
+    return numbers.astype(np.int64), valid, texts
+
+def _numeric_array(column, arrow_type):
+    """Columna numérica; '-' (registros NODATA/SKIPDATA) se guarda como nulo"""
+    mask = column == b'-'
+    values = np.where(mask, b'0', column).astype(np.int64)
+    return pa.array(values, type=arrow_type, mask=mask)
+
+def records_to_table(records):
+    """Tabla Arrow ordenada por (srcaddr, dstaddr) a partir de una matriz de registros"""
+    fields = local_engine.FLOW_LOG_FIELDS
+    columns = {}
+    sort_keys = []
+
+    for name in IP_FIELDS:
+        numbers, valid, texts = ip_to_int(records[:, fields.index(name)])
+        columns[name] = pa.array(numbers, type=pa.int64(), mask=~valid)
+        columns[f"{name}_text"] = pa.array(texts, type=pa.string())
+        # Las direcciones no IPv4 quedan al final de cada grupo
+        sort_keys.append(np.where(valid, numbers, np.iinfo(np.int64).max))
+
+    for name in INT32_FIELDS:
+        columns[name] = _numeric_array(records[:, fields.index(name)], pa.int32())
+    for name in INT64_FIELDS:
+        columns[name] = _numeric_array(records[:, fields.index(name)], pa.int64())
+    for name in STRING_FIELDS:
+        columns[name] = pa.array(np.char.decode(records[:, fields.index(name)]), type=pa.string())
+
+    order = np.lexsort((sort_keys[1], sort_keys[0]))
+    table = pa.table([columns[field.name] for field in COMPACTED_SCHEMA], schema=COMPACTED_SCHEMA)
+    return table.take(pa.array(order))
+
+def hour_partition(hour_start):
+    """Ruta de partición de una hora (epoch de su inicio)"""
+    moment = datetime.fromtimestamp(hour_start, tz=timezone.utc)
+    return f"year={moment:%Y}/month={moment:%m}/day={moment:%d}/hour={moment:%H}"
+
+def split_by_hour(blocks, hours=None):
+    """
+    Agrupa los registros por hora de inicio ({epoch de la hora: [bloques]}).
+    Con hours solo se conservan esas horas.
+    """
+    start = local_engine.FLOW_LOG_FIELDS.index('start')
+    by_hour = {}
+    for records in blocks:
+        record_hours = records[:, start].astype(np.int64) // 3600 * 3600
+        for hour in np.unique(record_hours).tolist():
+            if hours is not None and hour not in hours:
+                continue
+            by_hour.setdefault(hour, []).append(records[record_hours == hour])
+    return by_hour
+
+def write_table(table, output, partition, name, s3_client=None):
+    """Escribe un fichero Parquet en un directorio local o en s3://bucket/prefijo"""
+    if state_store.is_s3_location(output):
+        bucket, _, prefix = output[len('s3://'):].partition('/')
+        key = '/'.join(part for part in (prefix.strip('/'), partition, name) if part)
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        return f"s3://{bucket}/{key}"
+
+    directory = os.path.join(output, partition)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    pq.write_table(table, path, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+    return path
+
+def write_hours(by_hour, output, s3_client=None):
+    """Escribe un Parquet por hora (sobrescribe: recompactar una hora es idempotente)"""
+    written = {}
+    for hour, blocks in sorted(by_hour.items()):
+        table = records_to_table(np.concatenate(blocks))
+        written[hour] = write_table(table, output, hour_partition(hour), 'part-00000.snappy.parquet', s3_client)
+        print(f"🗜️  {hour_partition(hour)}: {table.num_rows} registros")
+    return written
+
+def compact_files(paths, output):
+    """Compacta ficheros locales de flow logs (todas sus horas se tratan como cerradas)"""
+    blocks = (
+        records
+        for path in paths
+        for records in iter_record_blocks(local_engine.iter_file_chunks(os.fspath(path)))
+    )
+    return write_hours(split_by_hour(blocks), output)
+
+def update_manifest(manifest, hours):
+    """Avanza las horas compactadas de cada día (solo horas consecutivas desde las 00)"""
+    days = manifest.setdefault('days', {})
+    for hour in sorted(hours):
+        moment = datetime.fromtimestamp(hour, tz=timezone.utc)
+        day = f"{moment:%Y/%m/%d}"
+        if days.get(day, 0) == moment.hour:
+            days[day] = moment.hour + 1
+    manifest['days'] = dict(sorted(days.items())[-MANIFEST_DAYS:])
+    return manifest
+
+def compacted_hours(manifest, day):
+    """Horas del día (date) ya compactadas: las horas 0..n-1"""
+    if not manifest:
+        return 0
+    return manifest.get('days', {}).get(f"{day:%Y/%m/%d}", 0)
+
+def compact_finished_hours(s3_client, bucket, base_prefix, output, day=None, now=None):
+    """
+    Compacta las horas cerradas pendientes de un día leyendo solo los objetos
+    entregados en la ventana de cada hora, y actualiza el manifiesto
+    """
+    now = now or datetime.now(timezone.utc).timestamp()
+    day = day or datetime.fromtimestamp(now, tz=timezone.utc).date()
+    manifest = state_store.load_json(output, MANIFEST_NAME, s3_client) or {}
+    day_start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+    pending = [
+        day_start + hour * 3600
+        for hour in range(compacted_hours(manifest, day), 24)
+        if day_start + (hour + 1) * 3600 + HOUR_LATENESS_SECONDS <= now
+    ]
+    if not pending:
+        print(f"🗜️  Sin horas cerradas pendientes para {day}")
+        return []
+
+    window_start = pending[0]
+    window_end = pending[-1] + 3600 + HOUR_LATENESS_SECONDS + OBJECT_DELIVERY_SECONDS
+    # Las últimas horas del día pueden entregarse bajo el prefijo del día siguiente
+    prefixes = {
+        local_engine.flow_log_day_prefix(base_prefix, moment.date())
+        for moment in (
+            datetime.fromtimestamp(window_start, tz=timezone.utc),
+            datetime.fromtimestamp(window_end, tz=timezone.utc)
+        )
+    }
+
+    def blocks():
+        for prefix in sorted(prefixes):
+            for key, last_modified in local_engine.list_flow_log_object_info(s3_client, bucket, prefix):
+                if window_start <= last_modified <= window_end:
+                    yield from iter_record_blocks(local_engine.iter_s3_object_chunks(s3_client, bucket, key))
+
+    by_hour = split_by_hour(blocks(), set(pending))
+    write_hours(by_hour, output, s3_client)
+    # Horas sin tráfico también cuentan como compactadas
+    state_store.save_json(output, MANIFEST_NAME, update_manifest(manifest, pending), s3_client)
+    return pending
+
+def referenced_columns(spec):
+    """Columnas de la tabla compactada que lee un detector del planificador"""
+    text = ' '.join(
+        [spec['filter'], ' '.join(spec['group_by'])]
+        + [expression for _, _, expression in spec['aggregates']]
+    )
+    columns = {'log_status'}
+    for name in COMPACTED_SCHEMA.names:
+        if re.search(rf'\b{name}\b', text):
+            columns.add(name)
+            if name in IP_FIELDS:
+                columns.add(f"{name}_text")
+    return columns
+
+def column_bytes(parquet_paths):
+    """Bytes comprimidos por columna (lo que Athena lee al proyectar esa columna)"""
+    sizes = dict.fromkeys(COMPACTED_SCHEMA.names, 0)
+    for path in parquet_paths:
+        metadata = pq.ParquetFile(path).metadata
+        for group in range(metadata.num_row_groups):
+            row_group = metadata.row_group(group)
+            for index in range(row_group.num_columns):
+                column = row_group.column(index)
+                sizes[column.path_in_schema] += column.total_compressed_size
+    return sizes
+
+def scan_comparison(raw_paths, parquet_paths, specs=query_planner.DETECTOR_SPECS):
+    """
+    Bytes escaneados por detector: la tabla de texto lee siempre el objeto
+    gzip completo; la tabla Parquet solo las columnas que usa la consulta
+    """
+    raw_bytes = sum(os.path.getsize(path) for path in raw_paths)
+    sizes = column_bytes(parquet_paths)
+    comparison = {
+        'raw_bytes': raw_bytes,
+        'parquet_bytes': sum(sizes.values()),
+        'detectors': {}
+    }
+
+    combined = set()
+    for spec in specs:
+        columns = referenced_columns(spec)
+        combined |= columns
+        comparison['detectors'][spec['name']] = {
+            'raw_bytes': raw_bytes,
+            'parquet_bytes': sum(sizes[column] for column in columns)
+        }
+    comparison['detectors']['combined'] = {
+        'raw_bytes': raw_bytes,
+        'parquet_bytes': sum(sizes[column] for column in combined)
+    }
+    return comparison
+
+def print_comparison(comparison):
+    print(f"📊 Texto gzip: {comparison['raw_bytes'] / 1e6:.2f} MB | Parquet: {comparison['parquet_bytes'] / 1e6:.2f} MB")
+    for name, sizes in comparison['detectors'].items():
+        ratio = sizes['raw_bytes'] / max(sizes['parquet_bytes'], 1)
+        print(f"   {name:<20} texto {sizes['raw_bytes'] / 1e6:8.2f} MB | parquet {sizes['parquet_bytes'] / 1e6:8.2f} MB | {ratio:5.1f}x menos")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compacta VPC Flow Logs a Parquet')
+    parser.add_argument('paths', nargs='*', help='Ficheros locales de flow logs (.log o .log.gz)')
+    parser.add_argument('--output', required=True, help='Directorio local o s3://bucket/prefijo de salida')
+    parser.add_argument('--bucket', help='Bucket de los flow logs (modo S3)')
+    parser.add_argument('--prefix', help='Prefijo base AWSLogs/<acct>/vpcflowlogs/<region>/ (modo S3)')
+    parser.add_argument('--day', help='Día a compactar en modo S3 (YYYY-MM-DD, por defecto hoy)')
+    args = parser.parse_args()
+
+    if args.bucket:
+        import boto3
+        day = datetime.strptime(args.day, '%Y-%m-%d').date() if args.day else None
+        # Un día anterior está cerrado por completo
+        now = None
+        if day and day < datetime.now(timezone.utc).date():
+            now = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() + timedelta(days=2).total_seconds()
+        compact_finished_hours(boto3.client('s3'), args.bucket, args.prefix, args.output, day, now)
+        return
+
+    written = compact_files(args.paths, args.output)
+    print_comparison(scan_comparison(args.paths, list(written.values())))
+
+if __name__ == '__main__':
+    main()
@@ -95,6 +95,13 @@ check_prerequisites() {
         log_success "AWS CLI encontrado: $aws_version"
     fi
 
+    # Verificar pip (instala numpy en la capa de la Lambda)
+    if ! python3 -m pip --version &> /dev/null; then
+        missing_tools+=("python3-pip")
+    else
+        log_success "pip encontrado: $(python3 -m pip --version | cut -d' ' -f2)"
+    fi
+
     # Verificar jq (útil para procesar JSON)
     if ! command -v jq &> /dev/null; then
         log_warning "jq no está instalado (recomendado para procesamiento JSON)"
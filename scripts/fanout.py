@@ -0,0 +1,124 @@
+"""
+Detección multi-cuenta / multi-región (fan-out).
+
+Un target es {'account_id', 'region'} más, opcionalmente:
+- 'table' / 'database': tabla de Glue con sus flow logs (por defecto
+  vpc_flow_logs_<cuenta>_<región>, las que crea athena.tf para fanout_targets)
+- 'bucket' / 'prefix': ubicación para el motor local (por defecto el bucket
+  central y AWSLogs/<cuenta>/vpcflowlogs/<región>/)
+
+run_targets() ejecuta la detección de cada target en un pool de hilos de
+tamaño acotado: con N targets y concurrencia C la invocación dura unas
+ceil(N / C) detecciones y nunca hay más de C targets consultando Athena a la
+vez (la cuota de consultas concurrentes es por cuenta).
+
+Cada target aporta los agregados de sus detectores antes de los umbrales
+(los agregadores combinables de local_engine). merge_aggregators() los
+fusiona por clave del detector (group_by de query_planner.DETECTOR_SPECS)
+y los umbrales se aplican una sola vez sobre el total: un srcaddr que prueba
+30 puertos en cada una de 3 cuentas suma 90 puertos distintos aunque no
+supere el umbral en ninguna. label_anomalies() añade a cada fila las
+'accounts', 'regions' y 'targets' en los que aparece su clave.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import telemetry
+
+def target_id(target):
+    return f"{target['account_id']}/{target['region']}"
+
+def default_table(account_id, region):
+    """Nombre de la tabla de Glue de un target (mismo criterio que athena.tf)"""
+    return f"vpc_flow_logs_{account_id}_{region.replace('-', '_')}"
+
+def target_prefix(target):
+    """Prefijo S3 de los flow logs de un target en el bucket central"""
+    return target.get('prefix') or f"AWSLogs/{target['account_id']}/vpcflowlogs/{target['region']}/"
+
+def parse_targets(value):
+    """
+    Normaliza la lista de targets (JSON o lista de dicts). Los targets sin
+    account_id o region se descartan con un aviso; los duplicados se ignoran.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+
+    targets = {}
+    for item in value:
+        if not item.get('account_id') or not item.get('region'):
+            telemetry.console(f"⚠️ Target sin account_id/region ignorado: {item}")
+            continue
+        target = dict(item, account_id=str(item['account_id']))
+        target.setdefault('table', default_table(target['account_id'], target['region']))
+        targets.setdefault(target_id(target), target)
+    return list(targets.values())
+
+def run_targets(targets, run_target, max_concurrency=4):
+    """
+    Ejecuta run_target(target) -> resultado para cada target con como mucho
+    max_concurrency a la vez. Retorna ([(target, resultado)], ids fallidos);
+    el fallo de un target no detiene al resto.
+    """
+    results = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(targets)))) as executor:
+        futures = {executor.submit(run_target, target): target for target in targets}
+        for future in as_completed(futures):
+            target = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                telemetry.console(f"❌ Target {target_id(target)}: {str(e)}")
+                failed.append(target_id(target))
+                continue
+            telemetry.console(f"🌐 Target {target_id(target)} completado")
+            results.append((target, result))
+    return results, failed
+
+def merge_aggregators(results):
+    """
+    Fusiona los agregadores de todos los targets ([(target, {detector:
+    agregador})]) antes de aplicar los umbrales. Retorna ({detector: agregador
+    fusionado}, {detector: {clave: [targets en los que aparece]}})
+    """
+    merged = {}
+    sources = {}
+    for target, aggregators in results:
+        for name, aggregator in aggregators.items():
+            for key in aggregator.keys():
+                sources.setdefault(name, {}).setdefault(key, []).append(target)
+            if name in merged:
+                merged[name].merge(aggregator)
+            else:
+                merged[name] = aggregator
+    return merged, sources
+
+def label_anomalies(anomalies, sources, specs=None):
+    """
+    Añade a las filas de cada anomalía los targets en los que aparece su clave
+    ('accounts', 'regions', 'targets') y a la anomalía la lista de targets
+    """
+    if specs is None:
+        import query_planner
+        specs = query_planner.DETECTOR_SPECS
+    specs_by_type = {spec['type']: spec for spec in specs}
+
+    for anomaly in anomalies:
+        spec = specs_by_type[anomaly['type']]
+        keys = sources.get(spec['name'], {})
+        anomaly_targets = set()
+        for row in anomaly['data']:
+            targets = keys.get(tuple(row.get(field) for field in spec['group_by']), [])
+            row['accounts'] = ','.join(sorted({target['account_id'] for target in targets}))
+            row['regions'] = ','.join(sorted({target['region'] for target in targets}))
+            row['targets'] = len({target_id(target) for target in targets})
+            anomaly_targets.update(target_id(target) for target in targets)
+
+        cross_target = sum(1 for row in anomaly['data'] if row['targets'] > 1)
+        if cross_target:
+            telemetry.console(f"🌐 {anomaly['type']}: {cross_target} filas presentes en varios targets")
+        anomaly['targets'] = sorted(anomaly_targets)
+    return anomalies
@@ -0,0 +1,303 @@
+"""
+Generador sintético de VPC Flow Logs para benchmarks y pruebas offline.
+
+Escribe objetos .log.gz con el mismo log_format que aws_flow_log.main en
+vpc.tf y la misma estructura de claves que el bucket de flow logs
+(AWSLogs/<acct>/vpcflowlogs/<region>/YYYY/MM/DD/HH/..., per_hour_partition).
+El tráfico de fondo son segmentos de red (hosts internos que hablan entre sí
+y con un grupo de servicios externos) que crecen con el volumen, así que
+ningún destino de fondo supera los umbrales a ninguna escala; sobre él se
+inyectan ataques conocidos, que forman la verdad de referencia (truth.json)
+para medir el recall (y los falsos positivos) de los detectores:
+
+- Port scanning: orígenes externos con REJECT a cientos de puertos distintos
+- DDoS: destinos internos que reciben tráfico de miles de orígenes
+- Exfiltración: pares origen/destino con decenas de MB por 443
+
+El port scanning y el DDoS ocupan una fracción fija del volumen (con un
+mínimo que supera los umbrales de los detectores a cualquier escala); la
+exfiltración es un número fijo de registros por par, para que su destino no
+supere también el umbral de paquetes del DDoS. La generación es
+determinista por semilla y objeto, y escala de 10^5 a 10^8 registros
+porque cada objeto se genera y comprime por separado.
+
+Uso:
+  python flowlog_generator.py --records 1000000 --output /tmp/flowlogs --seed 7
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+ACCOUNT_ID = '123456789012'
+REGION = 'us-east-1'
+LOG_HEADER = 'version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action log-status'
+TRUTH_FILE = 'truth.json'
+
+RECORDS_PER_OBJECT = 1000000
+NODATA_RATE = 0.01
+# gzip rápido: a 10^8 registros la compresión domina el tiempo de generación
+COMPRESS_LEVEL = 1
+
+# Tráfico de fondo
+INTERNAL_HOSTS = 64
+EXTERNAL_SERVICES = 32
+INTERFACES = 16
+BACKGROUND_PORTS = [22, 53, 80, 443, 3306, 5432, 6379, 8080]
+BACKGROUND_REJECT_RATE = 0.1
+# Registros de fondo por segmento: cada destino recibe ~1/96 de ellos con
+# ~10 paquetes de media (~26.000 paquetes, por debajo de los 100.000 del DDoS)
+BACKGROUND_SEGMENT_RECORDS = 250000
+
+# Ataques inyectados: fracción de los registros y mínimo por atacante/víctima
+PORT_SCANNERS = 3
+PORT_SCAN_SHARE = 0.002
+PORT_SCAN_MIN_RECORDS = 200
+DDOS_TARGETS = 2
+DDOS_SHARE = 0.01
+DDOS_MIN_RECORDS = 1000
+DDOS_SOURCES = 5000
+EXFIL_PAIRS = 2
+# 40 registros de 1-3 MB: 40-120 MB por par (umbral 25 MB) y menos de 86.000
+# paquetes por destino (umbral de DDoS 100.000)
+EXFIL_RECORDS = 40
+
+PROTOCOL_TCP = 6
+PROTOCOL_UDP = 17
+
+def default_prefix(account_id=ACCOUNT_ID, region=REGION):
+    return f"AWSLogs/{account_id}/vpcflowlogs/{region}/"
+
+def background_segments(background):
+    """Segmentos de red del tráfico de fondo para un volumen de registros de fondo"""
+    return max(1, -(-background // BACKGROUND_SEGMENT_RECORDS))
+
+def address_table(segments=1):
+    """
+    Todas las direcciones que usa el generador, indexadas por posición, y
+    los rangos de índices de cada grupo (INTERNAL_HOSTS y EXTERNAL_SERVICES
+    por segmento de fondo)
+    """
+    groups = {
+        # Tercer octeto < 100: sin colisión con 10.0.100.x ni 10.0.200.x
+        'internal': [f"10.{i // 25000}.{i // 250 % 100}.{i % 250 + 4}" for i in range(INTERNAL_HOSTS * segments)],
+        'external': [f"52.{94 + i // 62500}.{i // 250 % 250}.{i % 250 + 1}" for i in range(EXTERNAL_SERVICES * segments)],
+        'scanners': [f"203.0.113.{10 + i}" for i in range(PORT_SCANNERS)],
+        'ddos_targets': [f"10.0.200.{10 + i}" for i in range(DDOS_TARGETS)],
+        'ddos_sources': [f"198.51.{i // 250}.{i % 250 + 1}" for i in range(DDOS_SOURCES)],
+        'exfil_sources': [f"10.0.100.{10 + i}" for i in range(EXFIL_PAIRS)],
+        'exfil_destinations': [f"192.0.2.{50 + i}" for i in range(EXFIL_PAIRS)]
+    }
+    addresses = []
+    ranges = {}
+    for name, group in groups.items():
+        ranges[name] = (len(addresses), len(addresses) + len(group))
+        addresses.extend(group)
+    return addresses, ranges
+
+def attack_records(records):
+    """Registros de cada ataque inyectado (por atacante o víctima) para un volumen total"""
+    return {
+        'port_scanning': max(PORT_SCAN_MIN_RECORDS, int(records * PORT_SCAN_SHARE / PORT_SCANNERS)),
+        'ddos': max(DDOS_MIN_RECORDS, int(records * DDOS_SHARE / DDOS_TARGETS)),
+        'data_exfiltration': EXFIL_RECORDS
+    }
+
+def ground_truth():
+    """Claves que cada detector debe reportar (mismos campos que sus resultados)"""
+    addresses, ranges = address_table()
+    first, last = ranges['exfil_sources']
+    destinations = addresses[ranges['exfil_destinations'][0]:ranges['exfil_destinations'][1]]
+    return {
+        'port_scanning': addresses[slice(*ranges['scanners'])],
+        'ddos': addresses[slice(*ranges['ddos_targets'])],
+        'data_exfiltration': [list(pair) for pair in zip(addresses[first:last], destinations)]
+    }
+
+def share(total, parts, index):
+    """Reparto entero de total entre parts (la parte index)"""
+    return total // parts + (1 if index < total % parts else 0)
+
+class ObjectBuilder:
+    """Columnas de un objeto de flow logs que se van rellenando por bloques"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.columns = {name: [] for name in ('src', 'dst', 'srcport', 'dstport', 'protocol', 'packets', 'bytes', 'reject')}
+
+    def add(self, src, dst, dstport, protocol, packets, bytes_, reject):
+        count = len(src)
+        self.columns['src'].append(src)
+        self.columns['dst'].append(dst)
+        self.columns['srcport'].append(self.rng.integers(1024, 65536, count))
+        self.columns['dstport'].append(np.broadcast_to(dstport, count))
+        self.columns['protocol'].append(np.broadcast_to(protocol, count))
+        self.columns['packets'].append(packets)
+        self.columns['bytes'].append(bytes_)
+        self.columns['reject'].append(np.broadcast_to(reject, count))
+
+    def build(self):
+        columns = {name: np.concatenate(parts) for name, parts in self.columns.items()}
+        # Los ataques quedan mezclados con el tráfico de fondo
+        order = self.rng.permutation(len(columns['src']))
+        return {name: values[order] for name, values in columns.items()}
+
+def generate_object(rng, counts, ranges, segments=1):
+    """Columnas de un objeto: tráfico de fondo + su parte de cada ataque"""
+    builder = ObjectBuilder(rng)
+    rng_range = lambda name, size: rng.integers(*ranges[name], size)
+
+    # Fondo: hosts internos y servicios externos de un mismo segmento (menos
+    # de 100 orígenes y ~1/96 del volumen del segmento por destino, pocos
+    # puertos por origen, por debajo de los umbrales)
+    size = counts['background']
+    peers = INTERNAL_HOSTS + EXTERNAL_SERVICES
+    segment = rng.integers(0, segments, size)
+    src = rng.integers(0, peers, size)
+    dst = (src + rng.integers(1, peers, size)) % peers
+    src = np.where(src < INTERNAL_HOSTS, segment * INTERNAL_HOSTS + src + ranges['internal'][0],
+                   segment * EXTERNAL_SERVICES + src - INTERNAL_HOSTS + ranges['external'][0])
+    dst = np.where(dst < INTERNAL_HOSTS, segment * INTERNAL_HOSTS + dst + ranges['internal'][0],
+                   segment * EXTERNAL_SERVICES + dst - INTERNAL_HOSTS + ranges['external'][0])
+    dstport = rng.choice(BACKGROUND_PORTS, size)
+    protocol = np.where(dstport == 53, PROTOCOL_UDP, PROTOCOL_TCP)
+    packets = rng.integers(1, 20, size)
+    builder.add(src, dst, dstport, protocol, packets, packets * rng.integers(40, 1500, size),
+                rng.random(size) < BACKGROUND_REJECT_RATE)
+
+    for scanner in range(PORT_SCANNERS):
+        size = counts['port_scanning'][scanner]
+        builder.add(np.full(size, ranges['scanners'][0] + scanner), rng_range('internal', size),
+                    rng.integers(1, 65536, size), PROTOCOL_TCP, np.ones(size, dtype=np.int64),
+                    rng.integers(40, 60, size), True)
+
+    for target in range(DDOS_TARGETS):
+        size = counts['ddos'][target]
+        packets = rng.integers(50, 200, size)
+        builder.add(rng_range('ddos_sources', size), np.full(size, ranges['ddos_targets'][0] + target),
+                    rng.choice([80, 443], size), PROTOCOL_TCP, packets, packets * 60, rng.random(size) < 0.3)
+
+    for pair in range(EXFIL_PAIRS):
+        size = counts['data_exfiltration'][pair]
+        bytes_ = rng.integers(1000000, 3000000, size)
+        builder.add(np.full(size, ranges['exfil_sources'][0] + pair), np.full(size, ranges['exfil_destinations'][0] + pair),
+                    443, PROTOCOL_TCP, bytes_ // 1400 + 1, bytes_, False)
+
+    return builder.build()
+
+def format_object(columns, addresses, window_start, window_seconds, rng):
+    """Líneas del objeto en el log_format de vpc.tf (con cabecera y registros NODATA)"""
+    size = len(columns['src'])
+    start = window_start + np.sort(rng.integers(0, window_seconds, size))
+    end = start + rng.integers(1, 60, size)
+    interfaces = [f"eni-{i:017x}" for i in range(INTERFACES)]
+    interface = rng.integers(0, INTERFACES, size)
+    actions = np.where(columns['reject'], 'REJECT', 'ACCEPT')
+
+    lines = [LOG_HEADER]
+    lines.extend(
+        f"2 {ACCOUNT_ID} {interfaces[eni]} {addresses[src]} {addresses[dst]} {srcport} {dstport} "
+        f"{protocol} {packets} {bytes_} {first} {last} {action} OK"
+        for eni, src, dst, srcport, dstport, protocol, packets, bytes_, first, last, action in zip(
+            interface.tolist(), columns['src'].tolist(), columns['dst'].tolist(),
+            columns['srcport'].tolist(), columns['dstport'].tolist(), columns['protocol'].tolist(),
+            columns['packets'].tolist(), columns['bytes'].tolist(), start.tolist(), end.tolist(),
+            actions.tolist()
+        )
+    )
+    # Interfaces sin tráfico en la ventana de captura
+    nodata = rng.integers(0, window_seconds, int(size * NODATA_RATE)) + window_start
+    lines.extend(
+        f"2 {ACCOUNT_ID} {interfaces[i % INTERFACES]} - - - - - - - {first} {first + 60} - NODATA"
+        for i, first in enumerate(nodata.tolist())
+    )
+    return '\n'.join(lines) + '\n'
+
+def generate(output_dir, records, seed=0, day=None, records_per_object=RECORDS_PER_OBJECT, base_prefix=None):
+    """
+    Genera `records` registros repartidos en objetos de hasta records_per_object
+    bajo output_dir/<base_prefix>/YYYY/MM/DD/HH/ (hora de entrega) y escribe truth.json.
+    Retorna la verdad de referencia.
+    """
+    day = day or datetime.now(timezone.utc).date()
+    base_prefix = base_prefix or default_prefix()
+    attacks = attack_records(records)
+    attack_total = (attacks['port_scanning'] * PORT_SCANNERS + attacks['ddos'] * DDOS_TARGETS
+                    + attacks['data_exfiltration'] * EXFIL_PAIRS)
+    background = max(0, records - attack_total)
+    segments = background_segments(background)
+    addresses, ranges = address_table(segments)
+    objects = max(1, -(-records // records_per_object))
+    window_seconds = 86400 // objects
+    day_start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+    for index in range(objects):
+        rng = np.random.default_rng([seed, index])
+        counts = {
+            'background': share(background, objects, index),
+            'port_scanning': [share(attacks['port_scanning'], objects, index)] * PORT_SCANNERS,
+            'ddos': [share(attacks['ddos'], objects, index)] * DDOS_TARGETS,
+            'data_exfiltration': [share(attacks['data_exfiltration'], objects, index)] * EXFIL_PAIRS
+        }
+        window_start = day_start + index * window_seconds
+        columns = generate_object(rng, counts, ranges, segments)
+        text = format_object(columns, addresses, window_start, window_seconds, rng)
+
+        # Entrega al cerrar la ventana del objeto (dentro del mismo día)
+        stamp = datetime.fromtimestamp(window_start + window_seconds - 1, tz=timezone.utc)
+        directory = os.path.join(output_dir, base_prefix, f"{stamp:%Y/%m/%d/%H}")
+        os.makedirs(directory, exist_ok=True)
+        name = f"{ACCOUNT_ID}_vpcflowlogs_{REGION}_fl-benchmark_{stamp:%Y%m%dT%H%MZ}_{seed:04x}{index:06x}.log.gz"
+        with gzip.open(os.path.join(directory, name), 'wt', compresslevel=COMPRESS_LEVEL) as stream:
+            stream.write(text)
+
+    truth = {
+        'seed': seed,
+        'records': records,
+        'objects': objects,
+        'day': day.isoformat(),
+        'base_prefix': base_prefix,
+        'attack_records': attacks,
+        'anomalies': ground_truth()
+    }
+    with open(os.path.join(output_dir, TRUTH_FILE), 'w') as stream:
+        json.dump(truth, stream, indent=2)
+    return truth
+
+def load_truth(output_dir):
+    path = os.path.join(output_dir, TRUTH_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as stream:
+        return json.load(stream)
+
+def flow_log_files(output_dir, truth):
+    """Ficheros generados, en orden de tiempo"""
+    directory = os.path.join(output_dir, truth['base_prefix'], truth['day'].replace('-', '/'))
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names if name.endswith('.log.gz')
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera VPC Flow Logs sintéticos con ataques inyectados')
+    parser.add_argument('--records', type=int, default=100000, help='Registros a generar')
+    parser.add_argument('--output', required=True, help='Directorio de salida')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--day', help='Día UTC (YYYY-MM-DD), por defecto hoy')
+    parser.add_argument('--records-per-object', type=int, default=RECORDS_PER_OBJECT)
+    args = parser.parse_args()
+
+    day = datetime.strptime(args.day, '%Y-%m-%d').date() if args.day else None
+    started_at = datetime.now()
+    truth = generate(args.output, args.records, args.seed, day, args.records_per_object)
+    elapsed = (datetime.now() - started_at) / timedelta(seconds=1)
+    print(f"✅ {truth['records']} registros en {truth['objects']} objetos ({elapsed:.1f}s) en {args.output}")
+    print(f"🎯 Ataques inyectados: {json.dumps(truth['anomalies'])}")
+
+if __name__ == '__main__':
+    main()
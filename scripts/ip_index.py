@@ -0,0 +1,276 @@
+"""
+Índice de direcciones IP para listas de permitidos/denegados (allowlist/denylist).
+
+Las direcciones se representan como enteros: IPv4 en arrays uint32 y IPv6
+como uint128, guardados en un array estructurado (hi, lo) de dos uint64 cuyo
+orden coincide con el numérico. Una lista de CIDRs se compila en intervalos
+[inicio, fin] ordenados y fusionados, y la pertenencia de una columna entera
+se resuelve con dos searchsorted: una dirección está dentro si hay un inicio
+más que finales estrictamente menores que ella.
+
+El parseo de IPv4 es vectorizado sobre los bytes de la columna (el formato
+del parser del motor local); las direcciones que no son IPv4 (IPv6, '-') se
+convierten con ipaddress una vez por valor distinto.
+
+Con IPLists:
+- filter_batch(): descarta de un lote del motor local los registros cuyo
+  srcaddr está en la allowlist (balanceadores, NAT, escáneres internos).
+- filter_rows(): lo mismo sobre las filas de resultados de cualquier motor y
+  marca en 'denylist' qué campos de la fila están en la denylist.
+
+Las listas se leen de un URI s3://, de un fichero local (un CIDR por línea,
+'#' para comentarios, admite .gz) o de una cadena de CIDRs separados por comas.
+"""
+import gzip
+import ipaddress
+import os
+
+import numpy as np
+
+# Campos de dirección de las filas de resultados de los detectores
+ADDRESS_FIELDS = ('srcaddr', 'dstaddr')
+# Filas de resultados que se evalúan de cada vez
+ROW_BLOCK_SIZE = 1024
+
+IPV6_DTYPE = np.dtype([('hi', '<u8'), ('lo', '<u8')])
+_MASK64 = (1 << 64) - 1
+
+def as_bytes_array(values):
+    """Columna de direcciones como array de bytes de ancho fijo"""
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'S':
+        return values
+    try:
+        return np.array(values, dtype=bytes)
+    except UnicodeEncodeError:
+        return np.array([str(value).encode() for value in values], dtype=bytes)
+
+def parse_ipv4(values):
+    """
+    Convierte una columna de direcciones en texto (bytes) a uint32 sin pasar
+    por Python fila a fila: recorre las posiciones de carácter (como columnas
+    contiguas) acumulando el octeto en curso. Retorna (direcciones, máscara
+    de IPv4 válidas).
+    """
+    values = np.ascontiguousarray(as_bytes_array(values))
+    count, width = len(values), values.dtype.itemsize
+    if not count or not width:
+        return np.zeros(count, dtype=np.uint32), np.zeros(count, dtype=bool)
+    columns = np.ascontiguousarray(values.view(np.uint8).reshape(count, width).T)
+
+    address = np.zeros(count, dtype=np.uint32)
+    octet = np.zeros(count, dtype=np.uint32)
+    digits = np.zeros(count, dtype=np.uint8)
+    dots = np.zeros(count, dtype=np.uint8)
+    valid = np.ones(count, dtype=bool)
+
+    for column in columns:
+        digit = column - np.uint8(48)
+        is_digit = digit <= 9
+        is_dot = column == 46
+        valid &= is_digit | is_dot | (column == 0)
+        if is_dot.any():
+            # Un punto cierra el octeto en curso (que no puede estar vacío)
+            valid &= ~is_dot | (digits > 0)
+            address = np.where(is_dot, (address << np.uint32(8)) | octet, address)
+            dots += is_dot
+            open_octet = ~is_dot
+            octet *= open_octet
+            digits *= open_octet
+        octet = np.where(is_digit, octet * np.uint32(10) + digit, octet)
+        digits += is_digit
+        valid &= (octet <= 255) & (digits <= 3)
+
+    valid &= (dots == 3) & (digits > 0)
+    address = (address << np.uint32(8)) | octet
+    address[~valid] = 0
+    return address, valid
+
+def ipv6_key(number):
+    return number >> 64, number & _MASK64
+
+def parse_ipv6(values):
+    """
+    Direcciones que no son IPv4 como uint128 (array (hi, lo)); una llamada a
+    ipaddress por valor distinto. Retorna (direcciones, máscara de IPv6 válidas).
+    """
+    values = as_bytes_array(values)
+    uniques, inverse = np.unique(values, return_inverse=True)
+    keys = np.zeros(len(uniques), dtype=IPV6_DTYPE)
+    valid = np.zeros(len(uniques), dtype=bool)
+    for i, value in enumerate(uniques.tolist()):
+        try:
+            address = ipaddress.ip_address(value.decode())
+        except ValueError:
+            continue
+        if address.version == 6:
+            keys[i] = ipv6_key(int(address))
+            valid[i] = True
+    return keys[inverse.reshape(-1)], valid[inverse.reshape(-1)]
+
+def merge_intervals(starts, ends):
+    """Ordena los intervalos [inicio, fin] y fusiona los que se solapan o son contiguos"""
+    if not len(starts):
+        return starts, ends
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    # Empieza un intervalo nuevo donde el inicio supera todo lo cubierto + 1
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] > reach[:-1] + 1
+    last = np.append(first[1:], True)
+    return starts[first], reach[last]
+
+def compile_ipv4(texts):
+    """CIDRs IPv4 'a.b.c.d/n' -> (inicios, finales) uint32 y CIDRs no reconocidos"""
+    texts = as_bytes_array(texts)
+    if not len(texts):
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32), texts
+    addresses, _, prefixes = np.char.partition(texts, b'/').T
+    addresses, valid = parse_ipv4(addresses)
+    prefixes = np.where(prefixes == b'', b'32', prefixes)
+    numeric = np.char.isdigit(prefixes)
+    lengths = np.where(numeric, prefixes, b'99').astype(np.int64)
+    valid &= numeric & (lengths <= 32)
+
+    hosts = (np.int64(1) << (32 - lengths[valid])) - 1
+    starts = addresses[valid].astype(np.int64) & ~hosts
+    starts, ends = merge_intervals(starts, starts | hosts)
+    return starts.astype(np.uint32), ends.astype(np.uint32), texts[~valid]
+
+def compile_ipv6(texts):
+    """CIDRs restantes con ipaddress: (inicios, finales) uint128; los no válidos se ignoran"""
+    intervals = []
+    for text in texts:
+        text = text.decode() if isinstance(text, bytes) else text
+        try:
+            network = ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            print(f"⚠️ CIDR no válido ignorado: {text}")
+            continue
+        if network.version == 6:
+            intervals.append((int(network.network_address), int(network.broadcast_address)))
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    starts = np.array([ipv6_key(start) for start, _ in merged], dtype=IPV6_DTYPE)
+    ends = np.array([ipv6_key(end) for _, end in merged], dtype=IPV6_DTYPE)
+    return starts, ends
+
+def interval_contains(starts, ends, keys):
+    """Pertenencia vectorizada a intervalos disjuntos y ordenados"""
+    if not len(starts):
+        return np.zeros(len(keys), dtype=bool)
+    # searchsorted aprovecha las claves ordenadas (cada búsqueda parte de la anterior)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    found = np.empty(len(keys), dtype=bool)
+    found[order] = np.searchsorted(starts, sorted_keys, side='right') - np.searchsorted(ends, sorted_keys, side='left') == 1
+    return found
+
+class CidrIndex:
+    """Lista de CIDRs (IPv4 e IPv6) compilada a intervalos ordenados"""
+
+    def __init__(self, cidrs=()):
+        texts = [cidr.strip() for cidr in cidrs if cidr.strip()]
+        self.size = len(texts)
+        texts = np.array([text.encode() for text in texts], dtype=bytes) if texts else np.empty(0, dtype='S1')
+        self.v4_starts, self.v4_ends, others = compile_ipv4(texts)
+        self.v6_starts, self.v6_ends = compile_ipv6(others)
+
+    def __len__(self):
+        return self.size
+
+    def contains(self, values):
+        """Máscara de las direcciones (columna de texto) cubiertas por algún CIDR"""
+        values = as_bytes_array(values)
+        addresses, is_v4 = parse_ipv4(values)
+        found = is_v4 & interval_contains(self.v4_starts, self.v4_ends, addresses)
+        if len(self.v6_starts) and not is_v4.all():
+            others = np.flatnonzero(~is_v4)
+            keys, is_v6 = parse_ipv6(values[others])
+            found[others] = is_v6 & interval_contains(self.v6_starts, self.v6_ends, keys)
+        return found
+
+def read_cidr_source(source, s3_client=None):
+    """Texto de una lista: URI s3://, fichero local o la propia cadena de CIDRs"""
+    if source.startswith('s3://'):
+        bucket, _, key = source[len('s3://'):].partition('/')
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        return (gzip.decompress(body) if key.endswith('.gz') else body).decode()
+    if os.path.isfile(source):
+        opener = gzip.open if source.endswith('.gz') else open
+        with opener(source, 'rt') as stream:
+            return stream.read()
+    return source.replace(',', '\n')
+
+def load_cidrs(source, s3_client=None):
+    """CIDRs de una lista (uno por línea o separados por comas, '#' comenta)"""
+    if not source:
+        return []
+    lines = (line.split('#', 1)[0].strip() for line in read_cidr_source(source, s3_client).splitlines())
+    return [line for line in lines if line]
+
+class IPLists:
+    """Allowlist (suprime orígenes conocidos) y denylist (marca rangos conocidos como maliciosos)"""
+
+    stat_names = ('allowed_records', 'allowed_rows', 'denylisted_rows')
+
+    def __init__(self, allow=(), deny=()):
+        self.allow = CidrIndex(allow)
+        self.deny = CidrIndex(deny)
+        self.stats = dict.fromkeys(self.stat_names, 0)
+
+    @classmethod
+    def load(cls, allow_source='', deny_source='', s3_client=None):
+        return cls(load_cidrs(allow_source, s3_client), load_cidrs(deny_source, s3_client))
+
+    def begin(self):
+        self.stats = dict.fromkeys(self.stat_names, 0)
+
+    def filter_batch(self, batch):
+        """Lote de columnas sin los registros de orígenes permitidos"""
+        if not len(self.allow) or 'srcaddr' not in batch:
+            return batch
+        allowed = self.allow.contains(batch['srcaddr'])
+        if not allowed.any():
+            return batch
+        self.stats['allowed_records'] += int(allowed.sum())
+        return {name: values[~allowed] for name, values in batch.items()}
+
+    def filter_block(self, rows):
+        """Bloque de filas de resultados: quita las de orígenes permitidos y marca la denylist"""
+        keep = np.ones(len(rows), dtype=bool)
+        if len(self.allow) and rows and 'srcaddr' in rows[0]:
+            keep = ~self.allow.contains([row.get('srcaddr', '') for row in rows])
+            self.stats['allowed_rows'] += int((~keep).sum())
+
+        matches = [[] for _ in rows]
+        for field in ADDRESS_FIELDS:
+            if len(self.deny) and rows and field in rows[0]:
+                for i in np.flatnonzero(self.deny.contains([row.get(field, '') for row in rows])):
+                    matches[i].append(field)
+
+        kept = []
+        for row, keep_row, fields in zip(rows, keep, matches):
+            if not keep_row:
+                continue
+            if fields:
+                row['denylist'] = ','.join(fields)
+                self.stats['denylisted_rows'] += 1
+            kept.append(row)
+        return kept
+
+    def filter_rows(self, rows):
+        """Aplica filter_block a un iterable de filas por bloques, sin materializarlo"""
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == ROW_BLOCK_SIZE:
+                yield from self.filter_block(block)
+                block = []
+        if block:
+            yield from self.filter_block(block)
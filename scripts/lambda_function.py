@@ -1,26 +1,36 @@
 import json
-import boto3
 import time
-from datetime import datetime
+import functools
+import itertools
+import queue
+import threading
+from datetime import datetime, timezone
 import os
-import logging
-
-# Configurar logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Inicializar clientes AWS
-athena_client = boto3.client('athena')
-sns_client = boto3.client('sns')
-
-# Inicializar Bedrock
-try:
-    bedrock_client = boto3.client('bedrock-runtime')
-    BEDROCK_AVAILABLE = True
-    print("✅ Bedrock client inicializado")
-except Exception as e:
-    BEDROCK_AVAILABLE = False
-    print(f"⚠️ Bedrock no disponible: {e}")
+import aws_clients
+import telemetry
+import query_cache
+import analysis_cache
+import alert_pipeline
+import query_scheduler
+
+# Configurar logging (JSON estructurado salvo LOG_FORMAT=text). Con
+# DECORATIVE_LOGS=false los mensajes con emoji de telemetry.console se omiten y
+# solo los errores y avisos llegan al log
+logger = telemetry.configure_logging()
+
+# Métricas por etapa de cada invocación, publicadas como EMF (ver telemetry.py)
+METRICS = telemetry.Metrics()
+
+# Clientes AWS compartidos: boto3 se importa y cada cliente se crea en su
+# primer uso, no en el arranque en frío (ver aws_clients.py)
+athena_client = aws_clients.LazyClient('athena')
+sns_client = aws_clients.LazyClient('sns')
+s3_client = aws_clients.LazyClient('s3')
+bedrock_client = aws_clients.LazyClient('bedrock-runtime')
+
+# Bedrock: si el cliente no se puede crear, el error llega a la etapa de
+# análisis, que usa el análisis básico como respaldo
+BEDROCK_AVAILABLE = os.environ.get('BEDROCK_ENABLED', 'true').lower() == 'true'
 
 # Variables de configuración con valores exactos
 DATABASE_NAME = os.environ.get('DATABASE_NAME', 'vpc-traffic-anomaly-detection_flow_logs_db')
@@ -29,199 +39,982 @@ RESULTS_BUCKET = os.environ.get('RESULTS_BUCKET', 'anomaly-detection-flow-logs-1
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:730335323500:vpc-traffic-anomaly-detection-anomaly-alerts')
 BEDROCK_MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
 
+# Motor de detección: 'athena' (consultas SQL) o 'local' (lectura directa de los flow logs)
+DETECTION_ENGINE = os.environ.get('DETECTION_ENGINE', 'athena').lower()
+FLOW_LOGS_BUCKET = os.environ.get('FLOW_LOGS_BUCKET', 'anomaly-detection-flow-logs-12051980')
+FLOW_LOGS_PREFIX = os.environ.get('FLOW_LOGS_PREFIX', 'AWSLogs/730335323500/vpcflowlogs/us-east-1/')
+# Agregación del motor local: 'exact' o 'sketch' (memoria acotada, ver sketches.py)
+AGGREGATION_MODE = os.environ.get('AGGREGATION_MODE', 'exact').lower()
+# Plan de consultas en Athena: 'separate' (una consulta por detector) o
+# 'combined' (una sola lectura de la partición, ver query_planner.py)
+QUERY_PLAN = os.environ.get('QUERY_PLAN', 'separate').lower()
+
+# Tabla Parquet compactada (compaction.py): si está configurada, las horas ya
+# compactadas del día se leen de ella en lugar de la tabla de texto
+COLUMNAR_TABLE_NAME = os.environ.get('COLUMNAR_TABLE_NAME', '')
+COMPACTED_LOCATION = os.environ.get('COMPACTED_LOCATION', '')
+COMPACTION_MANIFEST_NAME = 'compaction-manifest'
+COMPACTION_MANIFEST_TTL = 60
+
+# Fan-out multi-cuenta / multi-región (ver fanout.py): lista JSON de targets
+# {account_id, region[, table, database, bucket, prefix]}; el evento puede
+# indicar otra en 'targets'. Vacía = solo la cuenta/región de la configuración
+FANOUT_TARGETS = os.environ.get('FANOUT_TARGETS', '')
+FANOUT_MAX_CONCURRENCY = int(os.environ.get('FANOUT_MAX_CONCURRENCY', '4'))
+
+# Ventana de análisis por defecto en minutos hasta el momento de la invocación
+# (el evento puede indicar otra en analysis_window_minutes). 0 = día en curso
+ANALYSIS_WINDOW_MINUTES = int(os.environ.get('ANALYSIS_WINDOW_MINUTES', '0'))
+# Los límites de las ventanas se alinean hacia abajo a este intervalo (el de la
+# programación, o el minuto): los reintentos y ejecuciones solapadas dentro del
+# mismo intervalo consultan la misma ventana y comparten clave en RESULT_CACHE
+ANALYSIS_WINDOW_ALIGN_SECONDS = max(1, int(os.environ.get('ANALYSIS_WINDOW_ALIGN_SECONDS', '60')))
+
+# Listas de IPs (ver ip_index.py): CIDRs separados por comas o URI s3:// / fichero
+# con un CIDR por línea. Los orígenes de la allowlist (balanceadores, NAT,
+# escáneres internos) no cuentan en los detectores; las filas con direcciones
+# de la denylist se marcan antes del análisis. Se releen cada IP_LISTS_TTL segundos
+IP_ALLOWLIST = os.environ.get('IP_ALLOWLIST', '')
+IP_DENYLIST = os.environ.get('IP_DENYLIST', '')
+IP_LISTS_TTL = 300
+
+# Umbrales adaptativos (ver baselines.py): con ubicación (s3://bucket/prefijo o
+# directorio local) se mantiene un rollup horario por dirección y cada fila se
+# compara con la baseline de su clave. Las consultas buscan candidatos desde
+# el umbral fijo por BASELINE_CANDIDATE_RATIO, con BASELINE_CANDIDATE_FACTOR
+# veces más filas, y cada ejecución incorpora como mucho ROLLUP_MAX_HOURS horas cerradas
+BASELINE_LOCATION = os.environ.get('BASELINE_LOCATION', '')
+BASELINE_CANDIDATE_RATIO = float(os.environ.get('BASELINE_CANDIDATE_RATIO', '0.25'))
+BASELINE_CANDIDATE_FACTOR = 10
+BASELINE_TTL = 300
+ROLLUP_MAX_HOURS = int(os.environ.get('ROLLUP_MAX_HOURS', '2'))
+# El rollup solo se ejecuta si quedan al menos estos segundos de invocación
+ROLLUP_MIN_REMAINING_SECONDS = 60
+
+# Detección incremental: si hay ubicación de checkpoint (s3://bucket/prefijo o
+# directorio local) cada ejecución procesa solo los datos nuevos desde el watermark
+CHECKPOINT_LOCATION = os.environ.get('CHECKPOINT_LOCATION', '')
+CHECKPOINT_NAME = 'detector-state'
+# Los flow logs llegan a S3 con minutos de retraso: el watermark se queda atrás
+WATERMARK_LATENESS_SECONDS = int(os.environ.get('WATERMARK_LATENESS_SECONDS', '600'))
+
+# Micro-lotes por eventos S3 (ver stream_state.py): con ubicación, cada objeto
+# nuevo de flow logs que notifica el bucket (s3_event_handler) actualiza el
+# estado repartido en STREAM_SHARDS shards y la ejecución programada solo
+# fusiona los shards y aplica los umbrales
+STREAM_STATE_LOCATION = os.environ.get('STREAM_STATE_LOCATION', '')
+STREAM_SHARDS = int(os.environ.get('STREAM_SHARDS', '16'))
+
+# Índice por objeto (ver object_index.py): con ubicación, los eventos S3
+# guardan la entrada de cada objeto nuevo y el motor local no lee los objetos
+# sin registros ACCEPT/REJECT en la ventana
+INDEX_LOCATION = os.environ.get('INDEX_LOCATION', '')
+
+# Análisis con Bedrock: llamadas concurrentes limitadas a la cuota de la cuenta
+# (peticiones por minuto del modelo), con reintentos ante throttling
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '4'))
+BEDROCK_REQUESTS_PER_MINUTE = float(os.environ.get('BEDROCK_REQUESTS_PER_MINUTE', '20'))
+BEDROCK_MAX_RETRIES = 4
+# Una llamada solo empieza si quedan al menos estos segundos hasta el deadline
+BEDROCK_MIN_CALL_SECONDS = 20
+# Presupuesto (estimado) de tokens del prompt: las filas que no caben se resumen
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', '3000'))
+# Tiempo reservado al final de la invocación para publicar las alertas
+ALERT_RESERVE_SECONDS = 15
+
+# Consultas de Athena por severidad y dentro del presupuesto de la invocación
+# (ver query_scheduler.py): las que no caben se omiten y las que superan el
+# deadline se cancelan
+SCHEDULER = query_scheduler.QueryScheduler()
+
+# Caché de análisis de IA por huella de la anomalía (ver analysis_cache.py):
+# un ataque en curso no se vuelve a analizar mientras no cambie materialmente
+ANALYSIS_CACHE_TTL_SECONDS = int(os.environ.get('ANALYSIS_CACHE_TTL_SECONDS', '3600'))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '256'))
+ANALYSIS_CACHE_LOCATION = os.environ.get('ANALYSIS_CACHE_LOCATION', '')
+
+ANALYSIS_CACHE = None
+if ANALYSIS_CACHE_TTL_SECONDS > 0:
+    ANALYSIS_CACHE = analysis_cache.AnalysisCache(
+        ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS,
+        max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+        location=ANALYSIS_CACHE_LOCATION,
+        s3_client=s3_client
+    )
+
+# Alertas: una anomalía ya alertada (misma huella) no se reenvía durante la
+# ventana de supresión; los datos técnicos grandes se guardan en S3
+ALERT_SUPPRESSION_SECONDS = int(os.environ.get('ALERT_SUPPRESSION_SECONDS', '3600'))
+ALERT_STATE_LOCATION = os.environ.get('ALERT_STATE_LOCATION', '')
+ALERT_OFFLOAD_LOCATION = os.environ.get('ALERT_OFFLOAD_LOCATION', '')
+ALERT_INLINE_DATA_BYTES = int(os.environ.get('ALERT_INLINE_DATA_BYTES', str(16 * 1024)))
+
+SENT_ALERTS = None
+if ALERT_SUPPRESSION_SECONDS > 0:
+    SENT_ALERTS = alert_pipeline.SentAlerts(
+        ttl_seconds=ALERT_SUPPRESSION_SECONDS,
+        max_entries=1024,
+        location=ALERT_STATE_LOCATION,
+        s3_client=s3_client
+    )
+
+# Sondeo de Athena: backoff exponencial desde 250 ms hasta 5 s
+POLL_INITIAL_INTERVAL = 0.25
+POLL_MAX_INTERVAL = 5
+POLL_BACKOFF_FACTOR = 2
+
+# Máximo de filas que se adjuntan a cada anomalía
+MAX_ANOMALY_ROWS = int(os.environ.get('MAX_ANOMALY_ROWS', '100'))
+
+# Tipos de columna de Athena que se convierten a int / float
+INTEGER_TYPES = {'tinyint', 'smallint', 'integer', 'int', 'bigint'}
+FLOAT_TYPES = {'float', 'real', 'double', 'decimal'}
+
+# Lectura directa del CSV de resultados en S3: por debajo de este tamaño se usa
+# get_query_results, por encima se descarga en rangos de CSV_CHUNK_SIZE bytes
+CSV_FASTPATH_MIN_BYTES = int(os.environ.get('CSV_FASTPATH_MIN_BYTES', str(256 * 1024)))
+CSV_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Caché de resultados de consultas (ver query_cache.py): TTL 0 la desactiva.
+# Con QUERY_CACHE_LOCATION (s3://bucket/prefijo o directorio) se comparte entre
+# ejecuciones; sin ella solo dura lo que la Lambda caliente
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get('QUERY_CACHE_TTL_SECONDS', '300'))
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', '64'))
+QUERY_CACHE_LOCATION = os.environ.get('QUERY_CACHE_LOCATION', '')
+
+RESULT_CACHE = None
+if QUERY_CACHE_TTL_SECONDS > 0:
+    RESULT_CACHE = query_cache.QueryCache(
+        ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+        max_entries=QUERY_CACHE_MAX_ENTRIES,
+        location=QUERY_CACHE_LOCATION,
+        s3_client=s3_client
+    )
+
+def is_s3_event(event):
+    """True para los eventos de notificación de S3 (sin importar stream_state ni numpy)"""
+    return isinstance(event, dict) and any(
+        record.get('eventSource') == 'aws:s3' for record in event.get('Records', [])
+    )
+
+def require_numpy(feature):
+    """Error explícito si falta numpy (en la Lambda lo instala la capa de dependencias de lambda.tf)"""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError(
+            f"{feature} requiere numpy: despliega la capa de dependencias (scripts/requirements-layer.txt)"
+        ) from None
+
 def lambda_handler(event, context):
     """
     Función principal de detección de anomalías en VPC Flow Logs
     """
-    print("🔍 === ANOMALY DETECTION SYSTEM ===")
-    print(f"⏰ Timestamp: {datetime.now()}")
-    print(f"🎯 Request ID: {context.aws_request_id}")
-    print(f"📊 Configuration:")
-    print(f"   Database: {DATABASE_NAME}")
-    print(f"   Table: {TABLE_NAME}")
-    print(f"   Results Bucket: {RESULTS_BUCKET}")
-    print(f"   SNS Topic: {SNS_TOPIC_ARN}")
-    print(f"   Bedrock Available: {BEDROCK_AVAILABLE}")
+    if is_s3_event(event):
+        return s3_event_handler(event, context)
+
+    telemetry.console("🔍 === ANOMALY DETECTION SYSTEM ===")
+    telemetry.console(f"⏰ Timestamp: {datetime.now()}")
+    telemetry.console(f"🎯 Request ID: {context.aws_request_id}")
+    telemetry.console(f"📊 Configuration:")
+    telemetry.console(f"   Database: {DATABASE_NAME}")
+    telemetry.console(f"   Table: {TABLE_NAME}")
+    telemetry.console(f"   Results Bucket: {RESULTS_BUCKET}")
+    telemetry.console(f"   SNS Topic: {SNS_TOPIC_ARN}")
+    telemetry.console(f"   Bedrock Available: {BEDROCK_AVAILABLE}")
+    telemetry.console(f"   Detection Engine: {DETECTION_ENGINE}")
+    telemetry.console(f"   Incremental: {bool(CHECKPOINT_LOCATION)}")
+    telemetry.console(f"   Stream State: {f'{STREAM_SHARDS} shards' if STREAM_STATE_LOCATION else 'disabled'}")
+    telemetry.console(f"   Object Index: {INDEX_LOCATION or 'disabled'}")
+    telemetry.console(f"   Query Plan: {QUERY_PLAN}")
+    telemetry.console(f"   Columnar Table: {COLUMNAR_TABLE_NAME or 'disabled'}")
+    telemetry.console(f"   Query Cache TTL: {QUERY_CACHE_TTL_SECONDS}s")
+    telemetry.console(f"   IP Lists: {'enabled' if IP_ALLOWLIST or IP_DENYLIST else 'disabled'}")
+    telemetry.console(f"   Adaptive Thresholds: {'enabled' if BASELINE_LOCATION else 'disabled'}")
+
+    METRICS.begin(request_id=context.aws_request_id)
+    failed_targets = []
 
     try:
-        anomalies_detected = []
-
-        # 1. Port Scanning Detection
-        print("\n🔎 Analizando port scanning...")
-        port_scan_results = detect_port_scanning()
-        if port_scan_results:
-            anomalies_detected.append({
-                'type': 'Port Scanning',
-                'severity': 'HIGH',
-                'data': port_scan_results
-            })
-            print(f"🚨 Port scanning detectado: {len(port_scan_results)} instancias")
-
-        # 2. DDoS Detection
-        print("🔎 Analizando DDoS attacks...")
-        ddos_results = detect_ddos()
-        if ddos_results:
-            anomalies_detected.append({
-                'type': 'DDoS Attack',
-                'severity': 'CRITICAL',
-                'data': ddos_results
-            })
-            print(f"🚨 DDoS detectado: {len(ddos_results)} instancias")
-
-        # 3. Data Exfiltration Detection
-        print("🔎 Analizando data exfiltration...")
-        exfil_results = detect_data_exfiltration()
-        if exfil_results:
-            anomalies_detected.append({
-                'type': 'Data Exfiltration',
-                'severity': 'HIGH',
-                'data': exfil_results
-            })
-            print(f"🚨 Data exfiltration detectado: {len(exfil_results)} instancias")
-
-        # Procesar anomalías detectadas
-        if anomalies_detected:
-            print(f"\n🚨 TOTAL ANOMALÍAS DETECTADAS: {len(anomalies_detected)}")
-
-            for i, anomaly in enumerate(anomalies_detected):
-                print(f"\n📋 Procesando anomalía {i+1}/{len(anomalies_detected)}: {anomaly['type']}")
-
-                # Analizar con IA si está disponible
-                if BEDROCK_AVAILABLE:
-                    print("🤖 Analizando con Claude 3.5 Sonnet...")
-                    ai_analysis = analyze_with_bedrock(anomaly)
-                    anomaly['ai_analysis'] = ai_analysis
-                else:
-                    print("📝 Generando análisis básico...")
-                    anomaly['ai_analysis'] = generate_basic_analysis(anomaly)
-
-                # Enviar alerta
-                print("📧 Enviando alerta...")
-                send_alert(anomaly)
-
-                # Pausa entre procesamiento para evitar throttling
-                if i < len(anomalies_detected) - 1:
-                    print("⏳ Pausa para evitar throttling...")
-                    time.sleep(3)
-        else:
-            print("✅ No se detectaron anomalías")
+        try:
+            targets, window_minutes = parse_event(event)
+        except ValueError as e:
+            return error_response(400, f"Evento inválido: {str(e)}", context.aws_request_id)
+        if targets:
+            telemetry.console(f"   Fan-out Targets: {len(targets)} (concurrencia {FANOUT_MAX_CONCURRENCY})")
+        set_analysis_window(window_minutes)
+        telemetry.console(f"   Analysis Window: {f'{window_minutes} min' if analysis_window() else 'current day'}")
+
+        if RESULT_CACHE:
+            RESULT_CACHE.begin()
+        if ANALYSIS_CACHE:
+            ANALYSIS_CACHE.begin()
+        if SENT_ALERTS:
+            SENT_ALERTS.begin()
+        ip_lists = load_ip_lists()
+        if ip_lists:
+            ip_lists.begin()
+        baseline_store = load_baselines()
+        if baseline_store:
+            baseline_store.begin()
+        alerts = create_alert_pipeline()
+
+        # Detectar -> analizar -> alertar en pipeline (ver pipeline.py): cada
+        # anomalía se analiza y publica en cuanto su detector la encuentra
+        telemetry.console("\n🔎 Lanzando detectores en paralelo...")
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - ALERT_RESERVE_SECONDS
+        SCHEDULER.begin(deadline)
+
+        def detect(emit):
+            with METRICS.span('detect'):
+                if targets:
+                    anomalies, failed = run_fanout_detectors(targets, emit)
+                    failed_targets.extend(failed)
+                    return anomalies
+                return run_detectors(emit)
+
+        def publish(anomalies):
+            for anomaly in anomalies:
+                telemetry.console(f"📋 Alerta: {anomaly['type']}")
+                alerts.add(anomaly)
+            with METRICS.span('publish'):
+                alerts.flush()
+
+        import pipeline
+        analysis_stage = create_analysis_stage()
+        flow = pipeline.DetectionPipeline(
+            detect,
+            analyze=lambda anomaly, deadline: analyze_anomaly(anomaly, deadline, analysis_stage),
+            fallback=lambda anomaly: generate_basic_analysis(anomaly) + "\n\n⚠️ Nota: Análisis de IA sin completar antes del deadline",
+            publish=publish,
+            accept=lambda anomaly: not alerts.is_suppressed(anomaly),
+            analysis_workers=BEDROCK_MAX_CONCURRENCY,
+            metrics=METRICS
+        )
+        with METRICS.span('pipeline'):
+            pipeline_stats = flow.run(deadline)
+
+        schedule = SCHEDULER.summary()
+        METRICS.put('AnomaliesDetected', pipeline_stats['detected'])
+        if schedule['skipped']:
+            METRICS.put('QueriesSkipped', len(schedule['skipped']))
+        if schedule['cancelled']:
+            METRICS.put('QueriesCancelled', len(schedule['cancelled']))
+        METRICS.put('AlertsSent', alerts.stats['alerts'])
+        METRICS.put('AlertsSuppressed', alerts.stats['suppressed'])
+        if pipeline_stats['late']:
+            METRICS.put('AnomaliesLate', pipeline_stats['late'])
+        if analysis_stage:
+            telemetry.console(f"🤖 Análisis IA: {analysis_stage.stats}")
+            for name, value in analysis_stage.stats.items():
+                METRICS.put(f"Bedrock{name.capitalize()}", value)
+        if ip_lists:
+            METRICS.put('AllowlistedRecords', ip_lists.stats['allowed_records'] + ip_lists.stats['allowed_rows'])
+            METRICS.put('DenylistedRows', ip_lists.stats['denylisted_rows'])
+        if baseline_store:
+            METRICS.put('BaselineSuppressedRows', baseline_store.stats['suppressed_rows'])
+            METRICS.put('BaselinePromotedRows', baseline_store.stats['promoted_rows'])
+        if RESULT_CACHE:
+            RESULT_CACHE.flush()
+        if ANALYSIS_CACHE:
+            ANALYSIS_CACHE.flush()
+
+        if pipeline_stats['detected']:
+            telemetry.console(f"\n🚨 TOTAL ANOMALÍAS DETECTADAS: {pipeline_stats['detected']}")
+            if pipeline_stats['suppressed']:
+                telemetry.console(f"🔕 {pipeline_stats['suppressed']} anomalías ya alertadas (suprimidas)")
+            telemetry.console(f"⏱️ Pipeline: {pipeline_stats}")
+        elif pipeline_stats['detection_complete'] and not schedule['skipped'] and not schedule['cancelled']:
+            telemetry.console("✅ No se detectaron anomalías")
             send_status_ok()
+        else:
+            telemetry.console("⚠️ Detección incompleta sin anomalías: no se envía el estado OK")
+
+        # Rollup de las horas cerradas, después de publicar: no retrasa las alertas
+        if baseline_store and context.get_remaining_time_in_millis() / 1000 > ROLLUP_MIN_REMAINING_SECONDS:
+            with METRICS.span('rollup'):
+                update_rollups(baseline_store)
 
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Análisis completado exitosamente',
-                'anomalies_found': len(anomalies_detected),
+                'anomalies_found': pipeline_stats['detected'],
                 'timestamp': datetime.now().isoformat(),
                 'request_id': context.aws_request_id,
-                'bedrock_available': BEDROCK_AVAILABLE
+                'bedrock_available': BEDROCK_AVAILABLE,
+                'detection_engine': DETECTION_ENGINE,
+                'analysis_window': dict(zip(('start', 'end'), analysis_window() or ())) or None,
+                'targets': len(targets) if targets else None,
+                'failed_targets': failed_targets,
+                'query_cache': RESULT_CACHE.stats if RESULT_CACHE else None,
+                'ip_lists': ip_lists.stats if ip_lists else None,
+                'baselines': baseline_store.stats if baseline_store else None,
+                'analysis_cache': ANALYSIS_CACHE.stats if ANALYSIS_CACHE else None,
+                'alerts': alerts.stats,
+                'pipeline': pipeline_stats,
+                'skipped_detectors': schedule['skipped'],
+                'cancelled_detectors': schedule['cancelled'],
+                'metrics': METRICS.summary()
             })
         }
 
     except Exception as e:
-        error_msg = str(e)
-        print(f"❌ ERROR en el proceso: {error_msg}")
-        logger.error(f"Error: {error_msg}")
-        send_error_alert(error_msg, context.aws_request_id)
+        return error_response(500, str(e), context.aws_request_id)
+
+    finally:
+        METRICS.flush()
+
+def parse_event(event):
+    """
+    (targets del fan-out, minutos de la ventana de análisis) del evento, con
+    los valores de la configuración por defecto. ValueError si no son válidos
+    """
+    if not isinstance(event, dict):
+        event = {}
+    try:
+        targets = event.get('targets', FANOUT_TARGETS)
+        if targets:
+            import fanout
+            targets = fanout.parse_targets(targets)
+        window_minutes = int(event.get('analysis_window_minutes', ANALYSIS_WINDOW_MINUTES) or 0)
+    except (TypeError, AttributeError, ValueError) as e:
+        raise ValueError(str(e)) from None
+    if window_minutes < 0:
+        raise ValueError(f"analysis_window_minutes negativo: {window_minutes}")
+    return targets, window_minutes
+
+def error_response(status_code, error_msg, request_id):
+    """Registra el error, envía la alerta de error y construye la respuesta"""
+    telemetry.console(f"❌ ERROR en el proceso: {error_msg}")
+    logger.error(f"Error: {error_msg}")
+    METRICS.put('Errors', 1)
+    send_error_alert(error_msg, request_id)
+
+    return {
+        'statusCode': status_code,
+        'body': json.dumps({
+            'error': error_msg,
+            'timestamp': datetime.now().isoformat(),
+            'request_id': request_id
+        })
+    }
 
+def s3_event_handler(event, context):
+    """
+    Entrada de los eventos S3 ObjectCreated de los flow logs: actualiza el
+    estado por shards con los objetos nuevos (ver stream_state.py) y guarda
+    su entrada en el índice de objetos (ver object_index.py). No alerta:
+    la ejecución programada fusiona los shards y aplica los umbrales. Un error
+    se propaga para que Lambda reintente el evento (la ingesta es idempotente).
+    """
+    METRICS.begin(request_id=context.aws_request_id)
+    try:
+        if not STREAM_STATE_LOCATION and not INDEX_LOCATION:
+            telemetry.console("⚠️ Evento S3 sin STREAM_STATE_LOCATION ni INDEX_LOCATION configuradas: se ignora")
+            return {'statusCode': 200, 'body': json.dumps({'message': 'Modo micro-lote desactivado'})}
+
+        require_numpy('La ingesta por eventos S3')
+        import stream_state
+
+        with METRICS.span('ingest'):
+            stats = stream_state.handle_s3_event(event, STREAM_STATE_LOCATION, s3_client, STREAM_SHARDS,
+                                                 ip_lists=load_ip_lists(), index_location=INDEX_LOCATION)
+        METRICS.put('ObjectsIngested', stats['objects'])
+        METRICS.put('RecordsIngested', stats['records'])
         return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': error_msg,
-                'timestamp': datetime.now().isoformat(),
-                'request_id': context.aws_request_id
-            })
+            'statusCode': 200,
+            'body': json.dumps(dict(stats, request_id=context.aws_request_id, metrics=METRICS.summary()))
         }
 
-def execute_athena_query(query, description="Query"):
-    """Ejecuta una consulta en Athena y retorna los resultados"""
-    try:
-        print(f"🔄 Ejecutando {description}...")
+    except Exception as e:
+        telemetry.console(f"❌ ERROR en la ingesta: {str(e)}")
+        logger.error(f"Error: {str(e)}")
+        METRICS.put('Errors', 1)
+        raise
+
+    finally:
+        METRICS.flush()
+
+def next_poll_interval(attempt, statistics):
+    """
+    Intervalo hasta el siguiente sondeo: backoff exponencial desde menos de un
+    segundo, acortado cuando las estadísticas indican que el motor acaba de
+    empezar a ejecutar (las queries cortas terminan poco después de salir de cola)
+    """
+    interval = min(POLL_MAX_INTERVAL, POLL_INITIAL_INTERVAL * (POLL_BACKOFF_FACTOR ** attempt))
+
+    engine_seconds = statistics.get('EngineExecutionTimeInMillis', 0) / 1000
+    if engine_seconds:
+        interval = min(interval, max(POLL_INITIAL_INTERVAL, engine_seconds * 0.2))
+
+    return interval
+
+def execute_athena_queries(queries, on_result, max_wait_time=300):
+    """
+    Lanza todas las consultas a la vez y las monitorea con un único bucle de
+    batch_get_query_execution. on_result(name, rows) se invoca en cuanto cada
+    consulta termina: rows es un generador de filas tipadas, o None si falló.
+    Un spec puede indicar otro 'reader' (p.ej. read_execution_columns).
+
+    Todas las consultas pasan por RESULT_CACHE: con un acierto no se lanzan.
+    La clave combina el SQL, la base de datos, el reader y la ventana de datos
+    del spec ('window', por defecto current_data_window(), alineada a
+    ANALYSIS_WINDOW_ALIGN_SECONDS); 'cache': False la desactiva. Los
+    resultados pequeños del reader por defecto se guardan como filas; los
+    grandes y los de otros readers, como referencia a la ejecución, cuyo CSV
+    se vuelve a leer con el reader del spec.
+
+    SCHEDULER decide el orden (por 'severity' del spec), omite las consultas
+    que no caben antes del deadline de la invocación y cancela las que lo
+    superan o esperan más de max_wait_time segundos.
+    """
+    pending = {}
+    submitted_at = {}
+    deadlines = {}
+
+    for spec in SCHEDULER.order(queries):
+        window = spec.get('window', current_data_window())
+        options = {}
+        if RESULT_CACHE and spec.get('cache', True):
+            # Athena también reutiliza su propia ejecución previa del mismo SQL;
+            # el SQL del día en curso es el mismo todo el día, así que solo
+            # dentro del intervalo de alineación
+            open_day = 'window' not in spec and analysis_window() is None
+            options = result_reuse(ANALYSIS_WINDOW_ALIGN_SECONDS if open_day else QUERY_CACHE_TTL_SECONDS)
+            reader = spec.get('reader', iter_query_rows)
+            spec = dict(spec, fingerprint=query_cache.query_fingerprint(
+                spec['query'], target_database(), window, reader.__name__
+            ))
+            rows = cached_query_rows(spec)
+            if rows is not None:
+                telemetry.console(f"♻️ {spec['description']}: resultado en caché")
+                METRICS.put('QueryCacheHits', 1, Query=spec['name'])
+                on_result(spec['name'], rows)
+                continue
+
+        if not SCHEDULER.admit(spec):
+            on_result(spec['name'], None)
+            continue
+
+        try:
+            telemetry.console(f"🔄 Ejecutando {spec['description']}...")
+            response = athena_client.start_query_execution(
+                QueryString=spec['query'],
+                QueryExecutionContext={'Database': target_database()},
+                ResultConfiguration={'OutputLocation': f's3://{RESULTS_BUCKET}/'},
+                **options
+            )
+            query_id = response['QueryExecutionId']
+            telemetry.console(f"📝 Query ID ({spec['description']}): {query_id}")
+            pending[query_id] = spec
+            submitted_at[query_id] = time.monotonic()
+            deadlines[query_id] = SCHEDULER.query_deadline(submitted_at[query_id], max_wait_time)
+        except Exception as e:
+            telemetry.console(f"❌ Error en {spec['description']}: {str(e)}")
+            on_result(spec['name'], None)
+
+    # Esperar completación de todas (cada una hasta su deadline)
+    attempt = 0
+    slept = 0.0
+
+    while pending:
+        now = time.monotonic()
+        for query_id in [query_id for query_id in pending if deadlines[query_id] <= now]:
+            spec = pending.pop(query_id)
+            telemetry.console(f"⏰ {spec['description']} timeout después de {now - submitted_at[query_id]:.0f} segundos")
+            SCHEDULER.cancel(athena_client, query_id, spec)
+            on_result(spec['name'], None)
+        if not pending:
+            break
+
+        query_ids = list(pending)
+        interval = POLL_MAX_INTERVAL
+
+        # batch_get_query_execution acepta hasta 50 IDs por llamada
+        for i in range(0, len(query_ids), 50):
+            try:
+                status_response = athena_client.batch_get_query_execution(
+                    QueryExecutionIds=query_ids[i:i + 50]
+                )
+            except Exception as e:
+                telemetry.console(f"⚠️ Error consultando estado de queries: {str(e)}")
+                continue
+
+            # Las que terminan en el mismo sondeo se leen por prioridad
+            executions = sorted(
+                (execution for execution in status_response.get('QueryExecutions', [])
+                 if execution['QueryExecutionId'] in pending),
+                key=lambda execution: query_scheduler.priority(pending[execution['QueryExecutionId']])
+            )
+            for execution in executions:
+                query_id = execution['QueryExecutionId']
+                spec = pending.get(query_id)
+                if spec is None:
+                    continue
+
+                status = execution['Status']['State']
+                description = spec['description']
+
+                if status == 'SUCCEEDED':
+                    telemetry.console(f"✅ {description} completada")
+                    del pending[query_id]
+                    # Espera (envío → SUCCEEDED visto en el sondeo) y lectura de resultados por separado
+                    METRICS.put('QueryWaitTime', (time.monotonic() - submitted_at[query_id]) * 1000, 'Milliseconds', Query=spec['name'])
+                    METRICS.query_statistics(spec['name'], execution.get('Statistics', {}))
+                    with METRICS.span('athena_fetch', Query=spec['name']):
+                        reader = spec.get('reader', iter_query_rows)
+                        rows = reader(execution, description)
+                        if spec.get('fingerprint'):
+                            rows = cache_query_rows(spec, execution, rows)
+                        on_result(spec['name'], rows)
+                elif status in ['FAILED', 'CANCELLED']:
+                    error_reason = execution['Status'].get('StateChangeReason', 'Unknown error')
+                    telemetry.console(f"❌ {description} falló: {error_reason}")
+                    del pending[query_id]
+                    on_result(spec['name'], None)
+                else:
+                    interval = min(interval, next_poll_interval(attempt, execution.get('Statistics', {})))
+
+        if pending:
+            # Sin dormir más allá del deadline más próximo
+            interval = max(0, min(interval, min(deadlines[query_id] for query_id in pending) - time.monotonic()))
+            time.sleep(interval)
+            slept += interval
+            attempt += 1
 
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={'Database': DATABASE_NAME},
-            ResultConfiguration={'OutputLocation': f's3://{RESULTS_BUCKET}/'}
+    METRICS.put('PollSleepTime', slept * 1000, 'Milliseconds')
+
+def aligned_now(now=None):
+    """Epoch de now (por defecto, el actual) alineado hacia abajo a ANALYSIS_WINDOW_ALIGN_SECONDS"""
+    now = int(now if now is not None else time.time())
+    return now - now % ANALYSIS_WINDOW_ALIGN_SECONDS
+
+def current_data_window():
+    """
+    Ventana de datos de las consultas (parte de su clave en RESULT_CACHE): los
+    límites de la ventana de análisis o, para el día en curso, el día y el
+    instante alineado hasta el que llegan sus datos. El día sigue recibiendo
+    flow logs, así que su clave cambia en cada intervalo de alineación
+    """
+    window = analysis_window()
+    if window:
+        return f"{window[0]}-{window[1]}"
+    now = aligned_now()
+    return f"{datetime.fromtimestamp(now, timezone.utc).date()}@{now}"
+
+_analysis_window = {'start': None, 'end': None}
+
+def set_analysis_window(minutes, now=None):
+    """
+    Fija la ventana de la invocación: los últimos `minutes` minutos hasta now
+    (epoch, alineado a ANALYSIS_WINDOW_ALIGN_SECONDS), o el día en curso con
+    minutes=0
+    """
+    if minutes > 0:
+        end = aligned_now(now)
+        _analysis_window.update(start=end - minutes * 60, end=end)
+    else:
+        _analysis_window.update(start=None, end=None)
+
+def analysis_window():
+    """(start, end) en epoch de la ventana de análisis, o None para el día en curso"""
+    if _analysis_window['start'] is None:
+        return None
+    return _analysis_window['start'], _analysis_window['end']
+
+def detection_filter():
+    """
+    Filtro de partición y tiempo de los detectores: el día en curso, o solo las
+    horas de la ventana y los registros que la solapan
+    """
+    window = analysis_window()
+    if window is None:
+        return TODAY_PARTITION_FILTER
+
+    import query_planner
+    return query_planner.window_filter(*window)
+
+def result_reuse(max_age_seconds):
+    """Opciones de start_query_execution para reutilizar una ejecución previa del mismo SQL"""
+    return {
+        'ResultReuseConfiguration': {
+            'ResultReuseByAgeConfiguration': {
+                'Enabled': True,
+                'MaxAgeInMinutes': max(1, max_age_seconds // 60)
+            }
+        }
+    }
+
+def cached_query_rows(spec):
+    """
+    Resultado de un spec en RESULT_CACHE: sus filas, o los resultados de la
+    ejecución guardada leídos con el reader del spec. None sin entrada o si
+    los resultados ya no se pueden leer
+    """
+    entry = RESULT_CACHE.get_entry(spec['fingerprint'])
+    if entry is None:
+        return None
+    if entry.get('execution'):
+        return spec.get('reader', iter_query_rows)(entry['execution'], spec['description'])
+    return iter(entry['value'])
+
+def cache_query_rows(spec, execution, rows):
+    """
+    Guarda en RESULT_CACHE el resultado de una consulta completada y retorna
+    sus filas. Las filas del reader por defecto se guardan si no superan el
+    límite de la caché; si lo superan, o con otro reader, se guarda la
+    referencia a la ejecución y las filas se siguen leyendo en streaming.
+    """
+    if execution.get('Statistics', {}).get('ResultReuseInformation', {}).get('ReusedPreviousResult'):
+        RESULT_CACHE.stats['athena_reused'] += 1
+
+    if rows is None:
+        return None
+    if 'reader' in spec:
+        RESULT_CACHE.put_execution(spec['fingerprint'], execution)
+        return rows
+
+    head = list(itertools.islice(rows, RESULT_CACHE.max_rows + 1))
+    if len(head) > RESULT_CACHE.max_rows:
+        RESULT_CACHE.put_execution(spec['fingerprint'], execution)
+        return itertools.chain(head, rows)
+    RESULT_CACHE.put(spec['fingerprint'], head, execution['QueryExecutionId'])
+    return iter(head)
+
+def convert_athena_value(value, column_type):
+    """Convierte un valor VarChar de Athena al tipo Python de su columna"""
+    if value is None:
+        return None
+    if column_type in INTEGER_TYPES:
+        return int(value)
+    if column_type in FLOAT_TYPES:
+        return float(value)
+    if column_type == 'boolean':
+        return value == 'true'
+    return value
+
+def iter_query_rows(execution, description="Query"):
+    """
+    Elige cómo leer los resultados de una consulta completada: resultados
+    pequeños por la API get_query_results y el resto directamente del CSV en S3
+    """
+    query_id = execution['QueryExecutionId']
+    output_location = execution.get('ResultConfiguration', {}).get('OutputLocation')
+
+    if output_location:
+        try:
+            bucket, key = parse_s3_uri(output_location)
+            size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+            if size >= CSV_FASTPATH_MIN_BYTES:
+                return iter_csv_results(query_id, output_location, description)
+        except Exception as e:
+            telemetry.console(f"⚠️ No se pudo usar el CSV de {description}, usando la API: {str(e)}")
+
+    return iter_query_results(query_id, description)
+
+def parse_s3_uri(uri):
+    """Separa un URI s3://bucket/key en (bucket, key)"""
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+def get_result_columns(query_id):
+    """Obtiene nombres y tipos de columna de una consulta sin descargar sus filas"""
+    response = athena_client.get_query_results(QueryExecutionId=query_id, MaxResults=1)
+    return [
+        (info['Name'], info['Type'].lower())
+        for info in response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+    ]
+
+def iter_s3_lines(bucket, key, chunk_size=CSV_CHUNK_SIZE):
+    """Descarga un objeto en rangos y produce sus líneas (con salto de línea)"""
+    import codecs
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    position = 0
+    pending = ''
+
+    while True:
+        response = s3_client.get_object(
+            Bucket=bucket,
+            Key=key,
+            Range=f'bytes={position}-{position + chunk_size - 1}'
         )
+        chunk = response['Body'].read()
+        position += len(chunk)
+        total_size = int(response['ContentRange'].rsplit('/', 1)[1])
+        last_chunk = not chunk or position >= total_size
 
-        query_id = response['QueryExecutionId']
-        print(f"📝 Query ID: {query_id}")
+        pending += decoder.decode(chunk, final=last_chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
 
-        # Esperar completación (máximo 5 minutos)
-        max_wait_time = 300
-        wait_interval = 5
-        elapsed_time = 0
+        if last_chunk:
+            break
 
-        while elapsed_time < max_wait_time:
-            status_response = athena_client.get_query_execution(QueryExecutionId=query_id)
-            status = status_response['QueryExecution']['Status']['State']
+    if pending:
+        yield pending
 
-            if status == 'SUCCEEDED':
-                print(f"✅ {description} completada")
-                break
-            elif status in ['FAILED', 'CANCELLED']:
-                error_reason = status_response['QueryExecution']['Status'].get('StateChangeReason', 'Unknown error')
-                print(f"❌ {description} falló: {error_reason}")
-                return None
+def iter_csv_records(output_location, columns):
+    """
+    Produce cada fila del CSV de resultados como lista de valores ya
+    convertidos al tipo de su columna
+    """
+    import csv
+
+    bucket, key = parse_s3_uri(output_location)
+    reader = csv.reader(iter_s3_lines(bucket, key))
+    next(reader, None)  # Saltar header row
+
+    for record in reader:
+        yield [
+            convert_athena_value(value if value != '' else None, column_type)
+            for (_, column_type), value in zip(columns, record)
+        ]
+
+def iter_csv_results(query_id, output_location, description="Query"):
+    """Generador de filas (dicts tipados) leídas directamente del CSV en S3"""
+    total_rows = 0
+
+    try:
+        columns = get_result_columns(query_id)
+        for record in iter_csv_records(output_location, columns):
+            total_rows += 1
+            yield {name: value for (name, _), value in zip(columns, record)}
+
+        telemetry.console(f"📊 {description}: {total_rows} resultados encontrados (CSV)")
+
+    except Exception as e:
+        telemetry.console(f"❌ Error leyendo CSV de {description}: {str(e)}")
+
+def read_csv_columns(query_id, output_location):
+    """
+    Lee el CSV de resultados como columnas: array('q') para enteros,
+    array('d') para decimales y listas para texto. Los nulos numéricos quedan en 0.
+    """
+    from array import array
+
+    columns = get_result_columns(query_id)
+    arrays = {}
+    for name, column_type in columns:
+        if column_type in INTEGER_TYPES:
+            arrays[name] = array('q')
+        elif column_type in FLOAT_TYPES:
+            arrays[name] = array('d')
+        else:
+            arrays[name] = []
 
-            time.sleep(wait_interval)
-            elapsed_time += wait_interval
+    for record in iter_csv_records(output_location, columns):
+        for (name, column_type), value in zip(columns, record):
+            if value is None and column_type in INTEGER_TYPES | FLOAT_TYPES:
+                value = 0
+            arrays[name].append(value)
 
-        if elapsed_time >= max_wait_time:
-            print(f"⏰ {description} timeout después de {max_wait_time} segundos")
-            return None
+    return arrays
 
-        # Obtener resultados
-        results_response = athena_client.get_query_results(QueryExecutionId=query_id)
-        rows = results_response['ResultSet']['Rows']
+def read_execution_columns(execution, description="Query"):
+    """Reader para execute_athena_queries que retorna el resultado como columnas"""
+    try:
+        return read_csv_columns(
+            execution['QueryExecutionId'],
+            execution['ResultConfiguration']['OutputLocation']
+        )
+    except Exception as e:
+        telemetry.console(f"❌ Error leyendo columnas de {description}: {str(e)}")
+        return None
 
-        if len(rows) <= 1:  # Solo headers, no hay datos
-            return None
+def iter_query_results(query_id, description="Query"):
+    """
+    Generador que recorre todas las páginas de get_query_results (NextToken)
+    y produce cada fila como un dict con valores tipados
+    """
+    next_token = None
+    columns = None
+    total_rows = 0
 
-        # Procesar resultados
-        headers = [col['VarCharValue'] for col in rows[0]['Data']]
-        data = []
+    try:
+        while True:
+            params = {'QueryExecutionId': query_id, 'MaxResults': 1000}
+            if next_token:
+                params['NextToken'] = next_token
+
+            results_response = athena_client.get_query_results(**params)
+            rows = results_response['ResultSet']['Rows']
+
+            if columns is None:
+                # La primera fila de la primera página son los headers
+                columns = [
+                    (info['Name'], info['Type'].lower())
+                    for info in results_response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+                ]
+                rows = rows[1:]
+
+            for row in rows:
+                total_rows += 1
+                yield {
+                    name: convert_athena_value(cell.get('VarCharValue'), column_type)
+                    for (name, column_type), cell in zip(columns, row['Data'])
+                }
 
-        for row in rows[1:]:  # Saltar header row
-            row_data = {}
-            for i, cell in enumerate(row['Data']):
-                row_data[headers[i]] = cell.get('VarCharValue', '')
-            data.append(row_data)
+            next_token = results_response.get('NextToken')
+            if not next_token:
+                break
 
-        print(f"📊 {description}: {len(data)} resultados encontrados")
-        return data
+        telemetry.console(f"📊 {description}: {total_rows} resultados encontrados")
 
     except Exception as e:
-        print(f"❌ Error en {description}: {str(e)}")
+        telemetry.console(f"❌ Error en {description}: {str(e)}")
+
+_compaction_manifest = {'loaded_at': 0, 'data': None}
+
+def load_compaction_manifest():
+    """Manifiesto de horas compactadas, releído como mucho cada COMPACTION_MANIFEST_TTL segundos"""
+    if time.time() - _compaction_manifest['loaded_at'] > COMPACTION_MANIFEST_TTL:
+        import state_store
+        try:
+            _compaction_manifest['data'] = state_store.load_json(COMPACTED_LOCATION, COMPACTION_MANIFEST_NAME, s3_client)
+        except Exception as e:
+            telemetry.console(f"⚠️ No se pudo leer el manifiesto de compactación: {str(e)}")
+            _compaction_manifest['data'] = None
+        _compaction_manifest['loaded_at'] = time.time()
+    return _compaction_manifest['data'] or {}
+
+_ip_lists = {'loaded_at': 0, 'data': None}
+
+def load_ip_lists():
+    """Allowlist/denylist compiladas (ip_index.IPLists) o None si no hay listas configuradas"""
+    if not IP_ALLOWLIST and not IP_DENYLIST:
         return None
+    if time.time() - _ip_lists['loaded_at'] > IP_LISTS_TTL:
+        try:
+            import ip_index
+            _ip_lists['data'] = ip_index.IPLists.load(IP_ALLOWLIST, IP_DENYLIST, s3_client)
+            telemetry.console(f"📋 Listas de IPs: {len(_ip_lists['data'].allow)} CIDRs permitidos, {len(_ip_lists['data'].deny)} denegados")
+        except Exception as e:
+            # Se mantienen las listas anteriores (si las hay) hasta el siguiente intento
+            telemetry.console(f"⚠️ No se pudieron leer las listas de IPs: {str(e)}")
+        _ip_lists['loaded_at'] = time.time()
+    return _ip_lists['data']
+
+_baselines = {'loaded_at': 0, 'data': None}
 
-def detect_port_scanning():
-    """Detecta actividad de port scanning"""
-    query = f"""
+def load_baselines():
+    """Almacén de baselines (baselines.BaselineStore) o None sin umbrales adaptativos"""
+    if not BASELINE_LOCATION:
+        return None
+    if time.time() - _baselines['loaded_at'] > BASELINE_TTL:
+        import baselines
+        try:
+            _baselines['data'] = baselines.BaselineStore(BASELINE_LOCATION, s3_client)
+        except Exception as e:
+            # Sin baselines los detectores aplican los umbrales fijos
+            telemetry.console(f"⚠️ No se pudieron leer las baselines: {str(e)}")
+        _baselines['loaded_at'] = time.time()
+    return _baselines['data']
+
+def detector_thresholds(name):
+    """
+    Umbrales HAVING de las consultas de un detector: los fijos o, con
+    umbrales adaptativos, la cota de candidatos que después filtra su baseline
+    """
+    import query_planner
+    thresholds = query_planner.DETECTOR_THRESHOLDS.get(name, {})
+    if not BASELINE_LOCATION:
+        return dict(thresholds)
+    return {alias: int(value * BASELINE_CANDIDATE_RATIO) for alias, value in thresholds.items()}
+
+def detector_limit(limit):
+    """LIMIT de las consultas: con umbrales adaptativos se piden más candidatos"""
+    return limit * BASELINE_CANDIDATE_FACTOR if BASELINE_LOCATION else limit
+
+def detection_hours():
+    """Horas que cubren los detectores: la ventana de análisis o lo que va de día"""
+    window = analysis_window()
+    if window:
+        return max(1.0, (window[1] - window[0]) / 3600)
+    return max(1.0, time.time() % 86400 / 3600)
+
+def local_thresholds():
+    """Umbrales y límites del motor local (argumentos de local_engine.collect_results)"""
+    if not BASELINE_LOCATION:
+        return {}
+    import query_planner
+    return {
+        'thresholds': {name: detector_thresholds(name) for name in query_planner.DETECTOR_THRESHOLDS},
+        'limits': {
+            spec['name']: detector_limit(spec['limit'])
+            for spec in query_planner.DETECTOR_SPECS
+            if spec['name'] in query_planner.DETECTOR_THRESHOLDS
+        }
+    }
+
+_target_context = threading.local()
+
+def current_target():
+    """Target (fanout.py) que procesa el hilo actual, o None fuera del fan-out"""
+    return getattr(_target_context, 'target', None)
+
+def target_database():
+    target = current_target()
+    return target.get('database', DATABASE_NAME) if target else DATABASE_NAME
+
+def flow_logs_location():
+    """(bucket, prefijo) de los flow logs para el motor local"""
+    target = current_target()
+    if not target:
+        return FLOW_LOGS_BUCKET, FLOW_LOGS_PREFIX
+    import fanout
+    return target.get('bucket', FLOW_LOGS_BUCKET), fanout.target_prefix(target)
+
+def flow_logs_source():
+    """
+    Tabla (o subconsulta) de la que leen los detectores: la tabla de texto
+    (la del target en fan-out) o, si hay horas del día compactadas a Parquet,
+    la unión de ambas (con year/month/day/hour, así que el filtro de la
+    ventana también se aplica). La compactación solo cubre TABLE_NAME.
+    """
+    target = current_target()
+    if target and target['table'] != TABLE_NAME:
+        return target['table']
+    if not COLUMNAR_TABLE_NAME or not COMPACTED_LOCATION:
+        return TABLE_NAME
+
+    import query_planner
+    day = datetime.now(timezone.utc).date()
+    window = analysis_window()
+    if window and datetime.fromtimestamp(window[0], tz=timezone.utc).date() != day:
+        # La unión con la tabla compactada solo cubre el día en curso
+        return TABLE_NAME
+    hours = load_compaction_manifest().get('days', {}).get(f"{day:%Y/%m/%d}", 0)
+    return query_planner.flow_logs_source(TABLE_NAME, COLUMNAR_TABLE_NAME, day, hours)
+
+def build_port_scanning_query():
+    """Consulta SQL de detección de port scanning"""
+    thresholds = detector_thresholds('port_scanning')
+    return f"""
     SELECT
         srcaddr,
         COUNT(DISTINCT dstport) AS unique_ports,
         COUNT(*) AS total_attempts,
         MIN(to_iso8601(from_unixtime(start))) AS first_attempt,
         MAX(to_iso8601(from_unixtime("end"))) AS last_attempt
-    FROM vpc_flow_logs
+    FROM {flow_logs_source()}
     WHERE
         log_status = 'OK'
         AND action = 'REJECT'
-        AND year = CAST(year(current_date) AS varchar)
-        AND month = LPAD(CAST(month(current_date) AS varchar), 2, '0')
-        AND day = LPAD(CAST(day(current_date) AS varchar), 2, '0')
+        AND {detection_filter()}
     GROUP BY srcaddr
-    HAVING COUNT(DISTINCT dstport) > 50
+    HAVING COUNT(DISTINCT dstport) > {thresholds['unique_ports']}
     ORDER BY unique_ports DESC
-    LIMIT 20;
+    LIMIT {detector_limit(20)};
     """
 
-    return execute_athena_query(query, "Port Scanning Detection")
-
-def detect_ddos():
-    """Detecta ataques DDoS"""
-    query = f"""
+def build_ddos_query():
+    """Consulta SQL de detección de ataques DDoS"""
+    thresholds = detector_thresholds('ddos')
+    return f"""
     SELECT
         dstaddr,
         SUM(packets) AS total_packets,
@@ -229,26 +1022,23 @@ def detect_ddos():
         COUNT(DISTINCT srcaddr) AS unique_sources,
         MIN(to_iso8601(from_unixtime(start))) AS attack_start,
         MAX(to_iso8601(from_unixtime("end"))) AS attack_end
-    FROM vpc_flow_logs
+    FROM {flow_logs_source()}
     WHERE
         log_status = 'OK'
         AND action IN ('ACCEPT','REJECT')
-        AND year = CAST(year(current_date) AS varchar)
-        AND month = LPAD(CAST(month(current_date) AS varchar), 2, '0')
-        AND day = LPAD(CAST(day(current_date) AS varchar), 2, '0')
+        AND {detection_filter()}
     GROUP BY dstaddr
     HAVING
-        SUM(packets) > 100000
-        OR COUNT(DISTINCT srcaddr) > 100
+        SUM(packets) > {thresholds['total_packets']}
+        OR COUNT(DISTINCT srcaddr) > {thresholds['unique_sources']}
     ORDER BY total_packets DESC
-    LIMIT 10;
+    LIMIT {detector_limit(10)};
     """
 
-    return execute_athena_query(query, "DDoS Detection")
-
-def detect_data_exfiltration():
-    """Detecta posible exfiltración de datos"""
-    query = f"""
+def build_data_exfiltration_query():
+    """Consulta SQL de detección de exfiltración de datos"""
+    thresholds = detector_thresholds('data_exfiltration')
+    return f"""
     SELECT
         srcaddr,
         dstaddr,
@@ -257,82 +1047,697 @@ def detect_data_exfiltration():
         AVG(bytes) AS avg_bytes_per_connection,
         MIN(to_iso8601(from_unixtime(start))) AS first_connection,
         MAX(to_iso8601(from_unixtime("end"))) AS last_connection
-    FROM vpc_flow_logs
+    FROM {flow_logs_source()}
     WHERE
         log_status = 'OK'
         AND action = 'ACCEPT'
         AND dstport IN (80, 443, 21, 22)
-        AND year = CAST(year(current_date) AS varchar)
-        AND month = LPAD(CAST(month(current_date) AS varchar), 2, '0')
-        AND day = LPAD(CAST(day(current_date) AS varchar), 2, '0')
+        AND {detection_filter()}
     GROUP BY srcaddr, dstaddr
-    HAVING SUM(bytes) > 25000000    -- 25 MB
+    HAVING SUM(bytes) > {thresholds['total_bytes']}    -- 25 MB
     ORDER BY total_bytes DESC
-    LIMIT 10;
+    LIMIT {detector_limit(10)};
     """
 
-    return execute_athena_query(query, "Data Exfiltration Detection")
+# Filtro de partición del día en curso (mismo que usan los detectores)
+TODAY_PARTITION_FILTER = """year = CAST(year(current_date) AS varchar)
+        AND month = LPAD(CAST(month(current_date) AS varchar), 2, '0')
+        AND day = LPAD(CAST(day(current_date) AS varchar), 2, '0')"""
 
-def analyze_with_bedrock(anomaly):
-    """Analiza anomalía usando Amazon Bedrock (Claude 3.5 Sonnet)"""
-    if not BEDROCK_AVAILABLE:
-        return generate_basic_analysis(anomaly)
+def build_port_scanning_partial_query(watermark, new_watermark, partition_filter=TODAY_PARTITION_FILTER):
+    """Agregados parciales de port scanning por (srcaddr, dstport) en la ventana del watermark"""
+    return f"""
+    SELECT
+        srcaddr,
+        dstport,
+        COUNT(*) AS records,
+        MIN(start) AS start,
+        MAX("end") AS "end"
+    FROM {flow_logs_source()}
+    WHERE
+        log_status = 'OK'
+        AND action = 'REJECT'
+        AND {partition_filter}
+        AND start > {watermark} AND start <= {new_watermark}
+    GROUP BY srcaddr, dstport;
+    """
 
-    try:
-        print(f"🤖 Analizando {anomaly['type']} con Claude 3.5 Sonnet...")
+def build_ddos_partial_query(watermark, new_watermark, partition_filter=TODAY_PARTITION_FILTER):
+    """Agregados parciales de DDoS por (dstaddr, srcaddr) en la ventana del watermark"""
+    return f"""
+    SELECT
+        dstaddr,
+        srcaddr,
+        COUNT(*) AS records,
+        SUM(packets) AS packets,
+        SUM(bytes) AS bytes,
+        MIN(start) AS start,
+        MAX("end") AS "end"
+    FROM {flow_logs_source()}
+    WHERE
+        log_status = 'OK'
+        AND action IN ('ACCEPT','REJECT')
+        AND {partition_filter}
+        AND start > {watermark} AND start <= {new_watermark}
+    GROUP BY dstaddr, srcaddr;
+    """
 
-        prompt = f"""
-        Eres un experto en ciberseguridad analizando tráfico de red anómalo en AWS VPC Flow Logs.
+def build_data_exfiltration_partial_query(watermark, new_watermark, partition_filter=TODAY_PARTITION_FILTER):
+    """Agregados parciales de exfiltración por (srcaddr, dstaddr) en la ventana del watermark"""
+    return f"""
+    SELECT
+        srcaddr,
+        dstaddr,
+        COUNT(*) AS records,
+        SUM(bytes) AS bytes,
+        MIN(start) AS start,
+        MAX("end") AS "end"
+    FROM {flow_logs_source()}
+    WHERE
+        log_status = 'OK'
+        AND action = 'ACCEPT'
+        AND dstport IN (80, 443, 21, 22)
+        AND {partition_filter}
+        AND start > {watermark} AND start <= {new_watermark}
+    GROUP BY srcaddr, dstaddr;
+    """
 
-        Analiza la siguiente anomalía detectada y proporciona un análisis estructurado:
+# Registro de detectores: consulta, tipo y severidad de la anomalía que generan
+DETECTORS = [
+    {
+        'name': 'port_scanning',
+        'type': 'Port Scanning',
+        'severity': 'HIGH',
+        'description': 'Port Scanning Detection',
+        'build_query': build_port_scanning_query,
+        'build_partial_query': build_port_scanning_partial_query
+    },
+    {
+        'name': 'ddos',
+        'type': 'DDoS Attack',
+        'severity': 'CRITICAL',
+        'description': 'DDoS Detection',
+        'build_query': build_ddos_query,
+        'build_partial_query': build_ddos_partial_query
+    },
+    {
+        'name': 'data_exfiltration',
+        'type': 'Data Exfiltration',
+        'severity': 'HIGH',
+        'description': 'Data Exfiltration Detection',
+        'build_query': build_data_exfiltration_query,
+        'build_partial_query': build_data_exfiltration_partial_query
+    }
+]
 
-        **ANOMALÍA DETECTADA:**
-        - Tipo: {anomaly['type']}
-        - Severidad inicial: {anomaly['severity']}
-        - Instancias detectadas: {len(anomaly['data'])}
+def build_anomaly(detector, rows):
+    """
+    Construye la anomalía de un detector a partir de sus filas, consumiendo
+    el iterable sin cargar más filas de las que se adjuntan. Las filas de
+    orígenes de la allowlist se descartan y las de la denylist se marcan.
+    Con umbrales adaptativos solo quedan las filas que superan su baseline.
+    """
+    if rows is None:
+        return None
 
-        **DATOS TÉCNICOS:**
-        {json.dumps(anomaly['data'], indent=2)}
+    ip_lists = load_ip_lists()
+    if ip_lists:
+        rows = ip_lists.filter_rows(rows)
+
+    baseline_store = load_baselines()
+    if baseline_store:
+        import query_planner
+        thresholds = query_planner.DETECTOR_THRESHOLDS.get(detector['name'])
+        if thresholds:
+            rows = baseline_store.filter_rows(
+                detector['name'], rows, thresholds, detector_thresholds(detector['name']), detection_hours()
+            )
 
-        **ANÁLISIS REQUERIDO:**
-        1. **Explicación técnica**: ¿Qué indica esta actividad?
-        2. **Nivel de severidad**: Escala 1-10 con justificación
-        3. **Vectores de ataque**: Posibles métodos utilizados
-        4. **Impacto potencial**: Riesgos para la infraestructura
-        5. **Acciones inmediatas**: Top 3 medidas urgentes
-        6. **Prevención**: Medidas a largo plazo
+    data = list(itertools.islice(rows, MAX_ANOMALY_ROWS))
+    if not data:
+        return None
 
-        Responde en español, sé técnico pero claro. Estructura la respuesta para SOC/DevSecOps.
-        """
+    telemetry.console(f"🚨 {detector['type']} detectado: {len(data)} instancias")
+    return {
+        'type': detector['type'],
+        'severity': detector['severity'],
+        'data': data
+    }
 
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1500,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.1
-        })
+def run_fanout_detectors(targets, on_anomaly=None):
+    """
+    Reúne los agregados de los detectores de cada target (como mucho
+    FANOUT_MAX_CONCURRENCY a la vez), los fusiona (fanout.py) y aplica los
+    umbrales una sola vez sobre el total. Las anomalías, con los targets de
+    cada fila, se entregan a on_anomaly al terminar todos. Retorna
+    (anomalías, targets fallidos).
+    """
+    import fanout
+    import local_engine
 
-        response = bedrock_client.invoke_model(
-            modelId=BEDROCK_MODEL_ID,
-            body=body,
-            contentType='application/json'
+    require_numpy('El fan-out')
+
+    def run_target(target):
+        _target_context.target = target
+        try:
+            with METRICS.span('detect_target', Target=fanout.target_id(target)):
+                return detector_aggregators()
+        finally:
+            _target_context.target = None
+
+    results, failed = fanout.run_targets(targets, run_target, FANOUT_MAX_CONCURRENCY)
+    if failed:
+        METRICS.put('TargetsFailed', len(failed))
+    aggregators, sources = fanout.merge_aggregators(results)
+    anomalies = fanout.label_anomalies(
+        emit_anomalies(local_engine.collect_results(aggregators, **local_thresholds())), sources
+    )
+    if on_anomaly:
+        for anomaly in anomalies:
+            on_anomaly(anomaly)
+    return anomalies, failed
+
+def detector_aggregators():
+    """
+    Agregados de los detectores del target actual antes de aplicar los
+    umbrales ({detector: agregador} de local_engine, combinables entre
+    targets): el estado del modo micro-lote o incremental, la lectura local
+    de los objetos o, con Athena, las consultas parciales de la ventana
+    """
+    import local_engine
+
+    if STREAM_STATE_LOCATION:
+        shard_aggregators, _ = merge_stream_shards()
+        return {
+            name: functools.reduce(lambda merged, aggregator: merged.merge(aggregator), aggregators)
+            for name, aggregators in shard_aggregators.items()
+        }
+    if CHECKPOINT_LOCATION:
+        return update_incremental_state()
+
+    aggregators = local_engine.create_aggregators(AGGREGATION_MODE)
+    window = analysis_window()
+    if DETECTION_ENGINE == 'local':
+        bucket, prefix = flow_logs_location()
+        with METRICS.span('local_scan'):
+            local_engine.aggregate_prefixes(
+                s3_client, bucket, local_engine.detection_prefixes(prefix, window=window), aggregators,
+                window=window, ip_lists=load_ip_lists(), skip_keys=index_skipped_keys(prefix, window)
+            )
+        return aggregators
+
+    # Todos los registros del día o de la ventana (detection_filter ya acota
+    # la ventana): start > 0 y hasta el final de la ventana
+    end = window[1] if window else aligned_now()
+    if not update_from_athena_partials(aggregators, 0, end, detection_filter()):
+        raise RuntimeError("Consultas parciales incompletas")
+    return aggregators
+
+def run_detectors(on_anomaly=None):
+    """
+    Ejecuta los detectores con el motor configurado en DETECTION_ENGINE. Cada
+    anomalía se entrega a on_anomaly en cuanto se construye (con Athena, al
+    terminar la consulta de su detector)
+    """
+    if STREAM_STATE_LOCATION or CHECKPOINT_LOCATION or DETECTION_ENGINE == 'local':
+        require_numpy('La detección local, incremental o por micro-lotes')
+
+    if STREAM_STATE_LOCATION:
+        if analysis_window():
+            telemetry.console("⚠️ Modo micro-lote: se ignora la ventana de análisis (estado acumulado del día)")
+        anomalies = run_stream_detectors(on_anomaly)
+    elif CHECKPOINT_LOCATION:
+        if analysis_window():
+            telemetry.console("⚠️ Modo incremental: se ignora la ventana de análisis (estado acumulado del día)")
+        anomalies = run_incremental_detectors(on_anomaly)
+    elif DETECTION_ENGINE == 'local':
+        anomalies = run_local_detectors(on_anomaly)
+    elif QUERY_PLAN == 'combined':
+        anomalies = run_combined_detectors(on_anomaly)
+    else:
+        anomalies = run_athena_detectors(on_anomaly)
+
+    # Mantener el orden de los detectores para el procesamiento posterior;
+    # los que solo existen como spec del planificador van al final
+    order = [detector['type'] for detector in DETECTORS]
+    anomalies.sort(key=lambda anomaly: order.index(anomaly['type']) if anomaly['type'] in order else len(order))
+    return anomalies
+
+def run_athena_detectors(on_anomaly=None):
+    """
+    Ejecuta las consultas de todos los detectores de forma concurrente y
+    construye cada anomalía en cuanto termina su consulta
+    """
+    detectors_by_name = {detector['name']: detector for detector in DETECTORS}
+    anomalies = []
+
+    def on_result(name, rows):
+        anomaly = build_anomaly(detectors_by_name[name], rows)
+        if anomaly:
+            anomalies.append(anomaly)
+            if on_anomaly:
+                on_anomaly(anomaly)
+
+    execute_athena_queries(
+        [
+            {
+                'name': detector['name'],
+                'query': detector['build_query'](),
+                'description': detector['description'],
+                'severity': detector['severity']
+            }
+            for detector in DETECTORS
+        ],
+        on_result
+    )
+    return anomalies
+
+def run_combined_detectors(on_anomaly=None):
+    """
+    Ejecuta todos los detectores declarados en query_planner con una única
+    consulta (un solo escaneo de la partición) y reparte las filas por detector
+    """
+    import query_planner
+
+    specs = [
+        query_planner.apply_thresholds(spec, detector_thresholds(spec['name']), detector_limit(spec['limit']))
+        if spec['name'] in query_planner.DETECTOR_THRESHOLDS else spec
+        for spec in query_planner.DETECTOR_SPECS
+    ]
+    anomalies = []
+
+    def on_result(name, rows):
+        if rows is None:
+            return
+        results = query_planner.split_combined_results(rows, specs)
+        for spec in specs:
+            anomaly = build_anomaly(spec, results[spec['name']])
+            if anomaly:
+                anomalies.append(anomaly)
+                if on_anomaly:
+                    on_anomaly(anomaly)
+
+    execute_athena_queries(
+        [{
+            'name': 'combined',
+            'query': query_planner.compile_combined_query(specs, table=flow_logs_source(), partition_filter=detection_filter()),
+            'description': f"Detección combinada ({len(specs)} detectores)",
+            'severity': min((spec['severity'] for spec in specs), key=query_scheduler.priority_of)
+        }],
+        on_result
+    )
+    return anomalies
+
+def run_local_detectors(on_anomaly=None):
+    """Ejecuta los detectores leyendo los flow logs del día directamente de S3"""
+    import local_engine
+
+    bucket, prefix = flow_logs_location()
+    window = analysis_window()
+    telemetry.console(f"📦 Motor local ({AGGREGATION_MODE}) sobre s3://{bucket}/{prefix}")
+    with METRICS.span('local_scan'):
+        results = local_engine.run_local_detection(
+            s3_client, bucket, prefix, mode=AGGREGATION_MODE, window=window,
+            ip_lists=load_ip_lists(), skip_keys=index_skipped_keys(prefix, window), **local_thresholds()
         )
 
-        response_body = json.loads(response['body'].read())
-        ai_analysis = response_body['content'][0]['text']
+    return emit_anomalies(results, on_anomaly)
 
-        print(f"✅ Análisis IA completado para {anomaly['type']}")
-        return ai_analysis
+def index_skipped_keys(base_prefix, window=None):
+    """
+    Objetos que el índice permite no leer: sin registros ACCEPT/REJECT (solo
+    NODATA/SKIPDATA) o, con ventana, sin registros que la solapen. Sin
+    índice, o si falla, no se descarta nada
+    """
+    if not INDEX_LOCATION:
+        return None
+    import object_index
 
+    if window:
+        start, end = window
+        filters = {'start': start, 'end': end}
+    else:
+        # El día se lee entero (como en Athena): solo se descartan los objetos sin tráfico
+        end = int(time.time())
+        start = end - end % 86400
+        filters = {}
+    try:
+        with METRICS.span('index_lookup'):
+            index = object_index.load_prefixes(
+                INDEX_LOCATION, object_index.hour_prefixes(base_prefix, start, end), s3_client
+            )
+            skipped = index.skipped_keys(actions=object_index.ACTIONS, **filters)
     except Exception as e:
-        error_msg = f"Error en análisis de IA: {str(e)}"
-        print(f"❌ {error_msg}")
-        return generate_basic_analysis(anomaly) + f"\n\n⚠️ Nota: {error_msg}"
+        telemetry.console(f"⚠️ Error leyendo el índice de objetos: {str(e)}")
+        return None
+    telemetry.console(f"🗂️ Índice de objetos: {len(skipped)} de {len(index)} objetos indexados descartados")
+    METRICS.put('ObjectsSkipped', len(skipped))
+    return skipped
+
+def emit_anomalies(results, on_anomaly=None):
+    """Anomalías de los resultados {nombre_detector: filas}, entregadas a on_anomaly por severidad"""
+    anomalies = []
+    for detector in sorted(DETECTORS, key=query_scheduler.priority):
+        anomaly = build_anomaly(detector, results.get(detector['name']))
+        if anomaly:
+            anomalies.append(anomaly)
+            if on_anomaly:
+                on_anomaly(anomaly)
+    return anomalies
+
+def run_stream_detectors(on_anomaly=None):
+    """
+    Modo micro-lote: fusiona los deltas que han dejado los eventos S3 en los
+    shards del día y aplica los umbrales sobre el estado fusionado
+    """
+    import stream_state
+
+    shard_aggregators, _ = merge_stream_shards()
+    return emit_anomalies(stream_state.shard_results(shard_aggregators, **local_thresholds()), on_anomaly)
+
+def merge_stream_shards():
+    """Fusiona los deltas de los shards del día del target: ({detector: [agregador de cada shard]}, deltas)"""
+    import stream_state
+
+    today = datetime.now(timezone.utc).date()
+    _, prefix = flow_logs_location()
+    source, _ = stream_state.source_of(prefix)
+    with METRICS.span('stream_merge'):
+        shard_aggregators, deltas = stream_state.merge_shards(
+            STREAM_STATE_LOCATION, source, today, s3_client, STREAM_SHARDS
+        )
+    telemetry.console(f"🔀 Micro-lotes {source}: {deltas} deltas fusionados en {STREAM_SHARDS} shards")
+    METRICS.put('StreamDeltasMerged', deltas)
+    return shard_aggregators, deltas
+
+def run_incremental_detectors(on_anomaly=None, now=None):
+    """
+    Detección incremental: carga los agregados parciales del checkpoint,
+    fusiona solo los datos posteriores al watermark y aplica los umbrales
+    sobre el estado acumulado del día
+    """
+    import local_engine
+
+    results = local_engine.collect_results(update_incremental_state(now), **local_thresholds())
+    return emit_anomalies(results, on_anomaly)
+
+def update_incremental_state(now=None):
+    """
+    Avanza el checkpoint del target actual con los datos posteriores a su
+    watermark (hasta now, epoch) y retorna los agregados acumulados de su día
+    ({detector: agregador}).
+
+    El día del checkpoint cambia cuando WATERMARK_LATENESS_SECONDS después de
+    medianoche. La primera ejecución posterior cierra el día anterior: una
+    última actualización hasta medianoche más el retraso (Athena) o con los
+    objetos llegados a su prefijo desde la ejecución anterior (motor local).
+    Retorna sus agregados finales y deja el checkpoint del día nuevo para la
+    siguiente ejecución.
+    """
+    import local_engine
+    import query_planner
+    import state_store
+
+    now = now if now is not None else time.time()
+    day = datetime.fromtimestamp(now - WATERMARK_LATENESS_SECONDS, timezone.utc).date()
+    # Un checkpoint por target en fan-out
+    target = current_target()
+    checkpoint_name = f"{CHECKPOINT_NAME}-{target['account_id']}-{target['region']}" if target else CHECKPOINT_NAME
+    checkpoint = state_store.load_json(CHECKPOINT_LOCATION, checkpoint_name, s3_client)
+    fresh_checkpoint = {
+        'day': day.isoformat(),
+        'engine': DETECTION_ENGINE,
+        'mode': AGGREGATION_MODE,
+        'watermark': 0,
+        'aggregators': {}
+    }
+    if not checkpoint or any(checkpoint.get(key) != fresh_checkpoint[key] for key in ('engine', 'mode')):
+        telemetry.console("🆕 Checkpoint nuevo para el día en curso")
+        checkpoint = fresh_checkpoint
+    closing = checkpoint['day'] != fresh_checkpoint['day']
+    checkpoint_day = datetime.strptime(checkpoint['day'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    if closing:
+        telemetry.console(f"🌙 Cierre del día {checkpoint['day']} antes de empezar el {fresh_checkpoint['day']}")
+
+    aggregators = local_engine.load_aggregators(checkpoint['aggregators'], AGGREGATION_MODE)
+    complete = True
+
+    if DETECTION_ENGINE == 'local':
+        bucket, base_prefix = flow_logs_location()
+        prefix = local_engine.flow_log_day_prefix(base_prefix, checkpoint_day.date())
+        with METRICS.span('local_scan'):
+            local_engine.update_from_new_objects(
+                s3_client, bucket, prefix, aggregators, checkpoint, ip_lists=load_ip_lists()
+            )
+    else:
+        if closing:
+            new_watermark = int(checkpoint_day.timestamp()) + 86400 + WATERMARK_LATENESS_SECONDS
+        else:
+            new_watermark = aligned_now(now - WATERMARK_LATENESS_SECONDS)
+        complete = update_from_athena_partials(
+            aggregators, checkpoint['watermark'], new_watermark,
+            query_planner.day_partition_filter(checkpoint_day.date())
+        )
+        if complete:
+            checkpoint['watermark'] = new_watermark
+
+    if complete:
+        if closing:
+            # El día cerrado ya no se vuelve a leer
+            checkpoint = fresh_checkpoint
+        else:
+            checkpoint['aggregators'] = local_engine.dump_aggregators(aggregators)
+        state_store.save_json(CHECKPOINT_LOCATION, checkpoint_name, checkpoint, s3_client)
+        telemetry.console(f"💾 Checkpoint guardado ({checkpoint['day']}, watermark {checkpoint['watermark']})")
+    else:
+        # Sin todas las ventanas no se avanza: la siguiente ejecución las repite
+        telemetry.console("⚠️ Consultas parciales incompletas, el checkpoint no avanza")
+
+    return aggregators
+
+def update_from_athena_partials(aggregators, watermark, new_watermark, partition_filter=TODAY_PARTITION_FILTER):
+    """
+    Ejecuta las consultas parciales de la ventana (watermark, new_watermark]
+    y acumula sus columnas en los agregadores. Retorna False si alguna falló.
+    """
+    import local_engine
+
+    telemetry.console(f"🔄 Ventana incremental: start en ({watermark}, {new_watermark}]")
+    ip_lists = load_ip_lists()
+    failed = []
+
+    def on_result(name, columns):
+        if columns is None:
+            failed.append(name)
+            return
+        if columns and len(next(iter(columns.values()))):
+            batch = local_engine.columns_to_batch(columns)
+            if ip_lists:
+                batch = ip_lists.filter_batch(batch)
+            aggregators[name].accumulate(batch)
+
+    execute_athena_queries(
+        [
+            {
+                'name': detector['name'],
+                'query': detector['build_partial_query'](watermark, new_watermark, partition_filter),
+                'description': f"{detector['description']} (incremental)",
+                'severity': detector['severity'],
+                'reader': read_execution_columns,
+                # Ventana cerrada por los watermarks: su resultado no cambia
+                'window': f"{watermark}-{new_watermark}"
+            }
+            for detector in DETECTORS
+        ],
+        on_result
+    )
+    return not failed
+
+def pending_rollup_hours(store, now=None):
+    """
+    Horas cerradas (inicio en epoch) que faltan por incorporar a las
+    baselines: como mucho ROLLUP_MAX_HOURS, empezando por la más antigua y sin
+    retroceder más de un día. Una hora está cerrada cuando ha pasado el
+    retraso de entrega de los flow logs desde su final.
+    """
+    import baselines
+
+    last_closed = baselines.hour_start((now or time.time()) - WATERMARK_LATENESS_SECONDS) - 3600
+    first = last_closed - (ROLLUP_MAX_HOURS - 1) * 3600
+    if store.rolled_up_until is not None:
+        first = max(store.rolled_up_until + 3600, last_closed - 23 * 3600)
+    return list(range(first, last_closed + 1, 3600))[:ROLLUP_MAX_HOURS]
+
+def update_rollups(store, now=None):
+    """
+    Rollup de las horas cerradas pendientes: agrega los parciales de cada hora
+    (motor local, o las consultas parciales de la detección incremental
+    limitadas a sus particiones), guarda el rollup y actualiza las baselines.
+    Un fallo no afecta a la detección: la hora se reintenta en otra ejecución.
+    """
+    import baselines
+    import local_engine
+    import query_planner
+
+    hours = pending_rollup_hours(store, now)
+    try:
+        for hour in hours:
+            window = (hour, hour + 3600)
+            aggregators = local_engine.create_aggregators('exact')
+            if DETECTION_ENGINE == 'local':
+                bucket, base_prefix = flow_logs_location()
+                prefixes = local_engine.flow_log_window_prefixes(base_prefix, *window)
+                local_engine.aggregate_prefixes(s3_client, bucket, prefixes, aggregators,
+                                                window=window, ip_lists=load_ip_lists())
+            elif not update_from_athena_partials(aggregators, hour - 1, hour + 3599,
+                                                 query_planner.window_partition_filter(*window)):
+                telemetry.console(f"⚠️ Rollup de {baselines.rollup_name(hour)} incompleto, se reintenta en la siguiente ejecución")
+                break
+
+            rollup = baselines.rollup_from_aggregators(aggregators)
+            store.save_rollup(hour, rollup)
+            store.observe(hour, rollup)
+            telemetry.console(f"📈 {baselines.rollup_name(hour)}: " + ', '.join(f"{name} {len(values)} claves" for name, values in rollup.items()))
+        if hours:
+            store.flush()
+    except Exception as e:
+        telemetry.console(f"⚠️ Error en el rollup horario: {str(e)}")
+        METRICS.put('RollupErrors', 1)
+        # Las baselines en memoria pueden tener horas sin guardar: se releen
+        _baselines['loaded_at'] = 0
+
+def create_analysis_stage():
+    """Etapa de análisis con Bedrock (límite de tasa y reintentos), o None sin Bedrock"""
+    if not BEDROCK_AVAILABLE:
+        return None
+    import analysis_stage
+
+    telemetry.console(f"🤖 Análisis con Claude 3.5 Sonnet ({BEDROCK_MAX_CONCURRENCY} en paralelo)")
+    return analysis_stage.AnalysisStage(
+        analyze_and_cache,
+        generate_basic_analysis,
+        requests_per_second=BEDROCK_REQUESTS_PER_MINUTE / 60,
+        max_workers=BEDROCK_MAX_CONCURRENCY,
+        max_retries=BEDROCK_MAX_RETRIES,
+        min_call_seconds=BEDROCK_MIN_CALL_SECONDS
+    )
+
+def analyze_anomaly(anomaly, deadline, stage=None):
+    """
+    Análisis de una anomalía en la pipeline: el de una anomalía equivalente en
+    caché (misma huella), el de Bedrock a través de stage o, sin Bedrock, el
+    análisis básico
+    """
+    entry = ANALYSIS_CACHE.lookup(anomaly) if ANALYSIS_CACHE else None
+    if entry:
+        telemetry.console(f"♻️ {anomaly['type']}: análisis reutilizado de la caché")
+        anomaly['analysis_cached_at'] = entry['stored_at']
+        return entry['value']
+    if stage is None:
+        return generate_basic_analysis(anomaly)
+    return stage.analyze_one(anomaly, deadline)
+
+def analyze_and_cache(anomaly, deadline=None):
+    """Análisis con Bedrock que se guarda en ANALYSIS_CACHE (solo los completos, no los parciales ni los de respaldo)"""
+    analysis, complete = stream_bedrock_analysis(anomaly, deadline)
+    if ANALYSIS_CACHE and complete:
+        ANALYSIS_CACHE.store(anomaly, analysis)
+    return analysis
+
+def stream_bedrock_analysis(anomaly, deadline=None):
+    """
+    Analiza una anomalía con respuesta en streaming. Retorna (texto, completo):
+    si se alcanza el deadline (monotonic) con parte de la respuesta recibida,
+    se conserva el análisis parcial; sin ningún texto se lanza TimeoutError.
+    El deadline se respeta aunque el stream deje de enviar eventos.
+    """
+    telemetry.console(f"🤖 Analizando {anomaly['type']} con Claude 3.5 Sonnet...")
+
+    import prompt_builder
+
+    prompt = prompt_builder.build_analysis_prompt(anomaly, PROMPT_TOKEN_BUDGET)
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1500,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": 0.1
+    })
+
+    started_at = time.monotonic()
+    events = queue.Queue()
+    stream = {}
+
+    def read_stream():
+        # En otro hilo: un stream detenido (sin bytes) bloquea la lectura hasta
+        # el read_timeout de botocore; quien espera la respuesta solo hasta el deadline
+        try:
+            response = bedrock_client.invoke_model_with_response_stream(
+                modelId=BEDROCK_MODEL_ID,
+                body=body,
+                contentType='application/json'
+            )
+            stream['body'] = response['body']
+            for event in response['body']:
+                events.put(event)
+        except Exception as e:
+            events.put(e)
+        events.put(None)
+
+    threading.Thread(target=read_stream, daemon=True).start()
+
+    parts = []
+    first_token_at = None
+    complete = False
+    while True:
+        try:
+            event = events.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if event is None:
+            break
+        if isinstance(event, Exception):
+            raise event
+
+        chunk = json.loads(event['chunk']['bytes']) if 'chunk' in event else {}
+        if chunk.get('type') == 'content_block_delta':
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            parts.append(chunk['delta'].get('text', ''))
+        elif chunk.get('type') == 'message_stop':
+            complete = True
+            break
+
+        if deadline is not None and time.monotonic() > deadline:
+            break
+
+    if not complete and stream.get('body') is not None and hasattr(stream['body'], 'close'):
+        # Libera la conexión del stream abandonado (el hilo termina con el error de lectura)
+        try:
+            stream['body'].close()
+        except Exception:
+            pass
+
+    if not parts:
+        raise TimeoutError("Bedrock no devolvió texto antes del deadline")
+
+    ttft = (first_token_at - started_at) if first_token_at else None
+    METRICS.put('BedrockTimeToFirstToken', ttft * 1000, 'Milliseconds')
+    METRICS.put('BedrockLatency', (time.monotonic() - started_at) * 1000, 'Milliseconds')
+    METRICS.put('PromptTokens', prompt_builder.estimate_tokens(prompt))
+    telemetry.console(
+        f"✅ Análisis IA {'completado' if complete else 'PARCIAL'} para {anomaly['type']} "
+        f"(prompt ~{prompt_builder.estimate_tokens(prompt)} tokens, TTFT {ttft:.2f}s, total {time.monotonic() - started_at:.2f}s)"
+    )
+
+    analysis = ''.join(parts)
+    if not complete:
+        analysis += "\n\n⚠️ Nota: análisis parcial, la respuesta se cortó por tiempo"
+    return analysis, complete
 
 def generate_basic_analysis(anomaly):
     """Genera análisis básico sin IA"""
@@ -405,21 +1810,41 @@ def generate_basic_analysis(anomaly):
     Se requiere investigación manual inmediata.
     """)
 
-def send_alert(anomaly):
-    """Envía alerta via SNS"""
-    try:
-        print(f"📧 Enviando alerta para {anomaly['type']}...")
-
-        emoji_map = {
-            'Port Scanning': '🔍',
-            'DDoS Attack': '💥',
-            'Data Exfiltration': '📤'
-        }
-
-        emoji = emoji_map.get(anomaly['type'], '🚨')
-        subject = f"{emoji} ALERTA CRÍTICA: {anomaly['type']} - Severidad {anomaly['severity']}"
-
-        message = f"""
+def create_alert_pipeline():
+    """Etapa de alertas de una invocación (ver alert_pipeline.py)"""
+    return alert_pipeline.AlertPipeline(
+        sns_client,
+        SNS_TOPIC_ARN,
+        render=format_alert,
+        subject=alert_subject,
+        sent=SENT_ALERTS,
+        offload_location=ALERT_OFFLOAD_LOCATION,
+        s3_client=s3_client,
+        inline_data_bytes=ALERT_INLINE_DATA_BYTES
+    )
+
+ALERT_EMOJIS = {
+    'Port Scanning': '🔍',
+    'DDoS Attack': '💥',
+    'Data Exfiltration': '📤'
+}
+
+def alert_subject(anomaly):
+    """Asunto de la alerta de una anomalía"""
+    emoji = ALERT_EMOJIS.get(anomaly['type'], '🚨')
+    return f"{emoji} ALERTA CRÍTICA: {anomaly['type']} - Severidad {anomaly['severity']}"
+
+def format_alert(anomaly, technical_data):
+    """Texto de la alerta de una anomalía con sus datos técnicos ya formateados"""
+    emoji = ALERT_EMOJIS.get(anomaly['type'], '🚨')
+
+    # Análisis reutilizado de una ejecución anterior (ataque en curso sin cambios materiales)
+    analysis_note = ''
+    if anomaly.get('analysis_cached_at'):
+        analyzed_at = datetime.fromtimestamp(anomaly['analysis_cached_at'], tz=timezone.utc)
+        analysis_note = f"♻️ Análisis generado el {analyzed_at.strftime('%Y-%m-%d %H:%M:%S UTC')} para esta misma anomalía\n"
+
+    return f"""
 {emoji} ALERTA DE SEGURIDAD - VPC FLOW LOGS {emoji}
 ================================================
 
@@ -429,10 +1854,10 @@ def send_alert(anomaly):
 📊 **Instancias Detectadas**: {len(anomaly['data'])}
 
 🤖 **ANÁLISIS DE INTELIGENCIA ARTIFICIAL:**
-{anomaly.get('ai_analysis', 'No disponible')}
+{analysis_note}{anomaly.get('ai_analysis', 'No disponible')}
 
 📈 **DATOS TÉCNICOS DETECTADOS:**
-{json.dumps(anomaly['data'], indent=2)}
+{technical_data}
 
 ---
 🛡️ **Sistema**: Detección de Anomalías VPC Flow Logs
@@ -443,17 +1868,6 @@ def send_alert(anomaly):
 Para más detalles, revisar CloudWatch Logs: /aws/lambda/anomaly-detection-processor
 """
 
-        sns_client.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject=subject,
-            Message=message
-        )
-
-        print(f"✅ Alerta enviada exitosamente para {anomaly['type']}")
-
-    except Exception as e:
-        print(f"❌ Error enviando alerta: {str(e)}")
-
 def send_status_ok():
     """Envía notificación de estado OK (solo ocasionalmente)"""
     try:
@@ -476,12 +1890,12 @@ El sistema está funcionando normalmente y monitoreando tráfico de red.
                 Subject="✅ Status OK: Sistema de Detección Operacional",
                 Message=message
             )
-            print("📧 Status OK enviado")
+            telemetry.console("📧 Status OK enviado")
         else:
-            print("✅ Estado normal - no se envía notificación (evitar spam)")
+            telemetry.console("✅ Estado normal - no se envía notificación (evitar spam)")
 
     except Exception as e:
-        print(f"❌ Error enviando estado OK: {str(e)}")
+        telemetry.console(f"❌ Error enviando estado OK: {str(e)}")
 
 def send_error_alert(error_message, request_id):
     """Envía notificación de error del sistema"""
@@ -516,36 +1930,36 @@ def send_error_alert(error_message, request_id):
             Message=message
         )
 
-        print("✅ Notificación de error enviada")
+        telemetry.console("✅ Notificación de error enviada")
 
     except Exception as e:
-        print(f"❌ Error crítico enviando notificación: {str(e)}")
+        telemetry.console(f"❌ Error crítico enviando notificación: {str(e)}")
 
 # Función de test interno (se ejecuta solo en test manual)
 def test_components():
     """Test de componentes para debugging"""
-    print("🧪 Testing system components...")
+    telemetry.console("🧪 Testing system components...")
 
     # Test Athena
     try:
         athena_client.list_work_groups(MaxResults=1)
-        print("✅ Athena: OK")
+        telemetry.console("✅ Athena: OK")
     except Exception as e:
-        print(f"❌ Athena: {e}")
+        telemetry.console(f"❌ Athena: {e}")
 
     # Test SNS
     try:
         sns_client.get_topic_attributes(TopicArn=SNS_TOPIC_ARN)
-        print("✅ SNS: OK")
+        telemetry.console("✅ SNS: OK")
     except Exception as e:
-        print(f"❌ SNS: {e}")
+        telemetry.console(f"❌ SNS: {e}")
 
     # Test Bedrock
     if BEDROCK_AVAILABLE:
         try:
             # Test muy simple para evitar throttling
-            print("✅ Bedrock: Available")
+            telemetry.console("✅ Bedrock: Available")
         except Exception as e:
-            print(f"❌ Bedrock: {e}")
+            telemetry.console(f"❌ Bedrock: {e}")
     else:
-        print("⚠️ Bedrock: Not available")
+        telemetry.console("⚠️ Bedrock: Not available")
@@ -0,0 +1,840 @@
+"""
+Motor local de detección: lee directamente los objetos de VPC Flow Logs
+(S3 o disco) y calcula las mismas agregaciones que las consultas de Athena
+de lambda_function.py, con group-bys vectorizados sobre columnas NumPy.
+"""
+import gzip
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+import sketches
+import telemetry
+
+# Formato fijo de aws_flow_log.main en vpc.tf (14 campos separados por espacio)
+FLOW_LOG_FIELDS = [
+    'version', 'account_id', 'interface_id', 'srcaddr', 'dstaddr',
+    'srcport', 'dstport', 'protocol', 'packets', 'bytes',
+    'start', 'end', 'action', 'log_status'
+]
+NUMERIC_FIELDS = ['srcport', 'dstport', 'protocol', 'packets', 'bytes', 'start', 'end']
+TEXT_FIELDS = ['srcaddr', 'dstaddr', 'action']
+
+BATCH_SIZE = 100000
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Modo incremental: objetos con LastModified dentro de este margen antes del
+# watermark se vuelven a comprobar (S3 no garantiza orden de llegada)
+OBJECT_OVERLAP_SECONDS = 300
+
+# Umbrales idénticos a los HAVING de las consultas SQL
+PORT_SCAN_MIN_PORTS = 50
+PORT_SCAN_LIMIT = 20
+DDOS_MIN_PACKETS = 100000
+DDOS_MIN_SOURCES = 100
+DDOS_LIMIT = 10
+EXFIL_MIN_BYTES = 25000000
+EXFIL_PORTS = [80, 443, 21, 22]
+EXFIL_LIMIT = 10
+
+# Tamaño de los sketches del modo 'sketch' (ver cotas de error en sketches.py)
+PORT_SCAN_SKETCH_CAPACITY = 4096
+PORT_SCAN_SKETCH_PRECISION = 12
+DDOS_SKETCH_CAPACITY = 1024
+DDOS_SKETCH_PRECISION = 14
+
+def flow_log_day_prefix(base_prefix, day):
+    """Prefijo S3 de un día: AWSLogs/<acct>/vpcflowlogs/<region>/YYYY/MM/DD/"""
+    return f"{base_prefix.rstrip('/')}/{day:%Y/%m/%d}/"
+
+def flow_log_window_prefixes(base_prefix, start, end):
+    """Prefijos por hora (per_hour_partition: .../YYYY/MM/DD/HH/) de una ventana [start, end)"""
+    import query_planner
+    return [f"{base_prefix.rstrip('/')}/{hour:%Y/%m/%d/%H}/" for hour in query_planner.window_hours(start, end)]
+
+def list_flow_log_object_info(s3_client, bucket, prefix):
+    """Lista (clave, LastModified en epoch) de los objetos de flow logs bajo un prefijo"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.log.gz'):
+                yield obj['Key'], int(obj['LastModified'].timestamp())
+
+def list_flow_log_objects(s3_client, bucket, prefix):
+    """Lista las claves de los objetos de flow logs bajo un prefijo"""
+    for key, _ in list_flow_log_object_info(s3_client, bucket, prefix):
+        yield key
+
+def iter_stream_chunks(stream, chunk_size=READ_CHUNK_SIZE):
+    """Lee un stream en bloques grandes cortados en fin de línea"""
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = pending + chunk
+        cut = chunk.rfind(b'\n') + 1
+        pending = chunk[cut:]
+        if cut:
+            yield chunk[:cut]
+    if pending:
+        yield pending
+
+def iter_s3_object_chunks(s3_client, bucket, key):
+    """Descomprime un objeto gzip de S3 en streaming y produce bloques de líneas"""
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    with gzip.GzipFile(fileobj=body) as stream:
+        yield from iter_stream_chunks(stream)
+
+def iter_file_chunks(path):
+    """Produce bloques de líneas de un fichero de flow logs local (gzip o texto plano)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as stream:
+        yield from iter_stream_chunks(stream)
+
+def split_records(chunk):
+    """
+    Convierte un bloque de líneas completas en una matriz (n, 14) de campos.
+    Todas las líneas del formato tienen 14 campos, así que basta un split();
+    si el bloque trae líneas malformadas se procesa línea a línea.
+    """
+    tokens = chunk.split()
+    if len(tokens) % len(FLOW_LOG_FIELDS) == 0:
+        return np.array(tokens).reshape(-1, len(FLOW_LOG_FIELDS))
+
+    records = [
+        fields for fields in (line.split() for line in chunk.split(b'\n'))
+        if len(fields) == len(FLOW_LOG_FIELDS)
+    ]
+    if not records:
+        return np.empty((0, len(FLOW_LOG_FIELDS)), dtype='S1')
+    return np.array(records)
+
+def parse_batches(chunks, batch_size=BATCH_SIZE):
+    """
+    Convierte bloques de líneas en lotes de columnas NumPy. Se descartan la
+    cabecera y los registros con log_status distinto de OK (NODATA/SKIPDATA
+    no tienen valores numéricos), igual que el filtro de todas las consultas.
+    """
+    pending = []
+    pending_rows = 0
+
+    for chunk in chunks:
+        records = split_records(chunk)
+        records = records[records[:, FLOW_LOG_FIELDS.index('log_status')] == b'OK']
+        if not len(records):
+            continue
+        pending.append(records)
+        pending_rows += len(records)
+
+        while pending_rows >= batch_size:
+            records = np.concatenate(pending)
+            yield build_batch(records[:batch_size])
+            pending = [records[batch_size:]]
+            pending_rows = len(pending[0])
+
+    if pending_rows:
+        yield build_batch(np.concatenate(pending))
+
+def build_batch(records):
+    """Convierte una matriz de registros en un dict de columnas"""
+    batch = {}
+    for name in NUMERIC_FIELDS:
+        batch[name] = records[:, FLOW_LOG_FIELDS.index(name)].astype(np.int64)
+    for name in TEXT_FIELDS:
+        batch[name] = records[:, FLOW_LOG_FIELDS.index(name)].copy()
+    return batch
+
+def to_iso8601(epoch_seconds):
+    """Mismo formato que to_iso8601(from_unixtime(x)) en Athena"""
+    return datetime.fromtimestamp(int(epoch_seconds), tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+def group_by(*keys):
+    """
+    Agrupa por una o varias columnas; retorna (claves únicas por columna,
+    índice inverso). Varias columnas se factorizan y combinan en un entero.
+    """
+    if len(keys) == 1:
+        unique, inverse = np.unique(keys[0], return_inverse=True)
+        return (unique,), inverse
+
+    uniques = []
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        unique, codes = np.unique(key, return_inverse=True)
+        uniques.append(unique)
+        combined = combined * len(unique) + codes
+
+    combined_unique, inverse = np.unique(combined, return_inverse=True)
+    columns = []
+    for unique in reversed(uniques):
+        combined_unique, codes = np.divmod(combined_unique, len(unique))
+        columns.append(unique[codes])
+    return tuple(reversed(columns)), inverse
+
+def group_sum(inverse, size, values):
+    sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, inverse, values)
+    return sums
+
+def group_min(inverse, size, values):
+    result = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(result, inverse, values)
+    return result
+
+def group_max(inverse, size, values):
+    result = np.full(size, np.iinfo(np.int64).min, dtype=np.int64)
+    np.maximum.at(result, inverse, values)
+    return result
+
+def group_distinct(inverse, values):
+    """Pares únicos (grupo, valor) para COUNT(DISTINCT valor) por grupo"""
+    (groups, distinct_values), _ = group_by(inverse, values)
+    return groups, distinct_values
+
+def split_distinct(group_index, values):
+    """Convierte pares (grupo, valor) en {grupo: [valores]}"""
+    if values.dtype.kind == 'S':
+        values = np.char.decode(values)
+    order = np.argsort(group_index, kind='stable')
+    group_index, values = group_index[order], values[order]
+    boundaries = np.flatnonzero(np.diff(group_index)) + 1
+    return {
+        int(chunk_groups[0]): chunk_values.tolist()
+        for chunk_groups, chunk_values in zip(np.split(group_index, boundaries), np.split(values, boundaries))
+        if len(chunk_groups)
+    }
+
+def select(batch, mask, names):
+    """Aplica el filtro de un detector a las columnas que necesita"""
+    return {name: batch[name][mask] for name in names + ['records'] if name in batch}
+
+def record_counts(columns, inverse, size):
+    """COUNT(*) por grupo; las filas preagregadas traen su conteo en 'records'"""
+    if 'records' in columns:
+        return group_sum(inverse, size, columns['records'])
+    return np.bincount(inverse, minlength=size)
+
+def columns_to_batch(columns):
+    """
+    Convierte columnas de resultados de Athena (array('q') / listas de texto)
+    al formato de lote del motor local, para alimentar accumulate()
+    """
+    batch = {}
+    for name, values in columns.items():
+        if isinstance(values, list):
+            batch[name] = np.array([value.encode() for value in values], dtype=bytes)
+        else:
+            batch[name] = np.array(values, dtype=np.int64)
+    return batch
+
+class GroupState:
+    """Agregados parciales por clave que se acumulan entre lotes e invocaciones"""
+
+    def __init__(self):
+        self.groups = {}
+
+    def update(self, keys, count, sums, first, last, distinct=None):
+        """Fusiona los agregados de un lote (arrays alineados con keys)"""
+        for i, key in enumerate(keys):
+            self._merge_group(key, int(count[i]), [int(column[i]) for column in sums],
+                              int(first[i]), int(last[i]), distinct.get(i, ()) if distinct is not None else ())
+
+    def _merge_group(self, key, count, sums, first, last, distinct):
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = {
+                'count': 0,
+                'sums': [0] * len(sums),
+                'first': first,
+                'last': last,
+                'distinct': set()
+            }
+        group['count'] += count
+        for j, value in enumerate(sums):
+            group['sums'][j] += value
+        group['first'] = min(group['first'], first)
+        group['last'] = max(group['last'], last)
+        group['distinct'].update(distinct)
+
+    def merge(self, other):
+        for key, group in other.groups.items():
+            self._merge_group(key, group['count'], group['sums'], group['first'], group['last'], group['distinct'])
+        return self
+
+    def to_dict(self):
+        return {
+            'groups': [
+                [list(key) if isinstance(key, tuple) else key, group['count'], group['sums'],
+                 group['first'], group['last'], sorted(group['distinct'])]
+                for key, group in self.groups.items()
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        for key, count, sums, first, last, distinct in data['groups']:
+            key = tuple(key) if isinstance(key, list) else key
+            state._merge_group(key, count, sums, first, last, distinct)
+        return state
+
+class ExactAggregator:
+    """Base de los agregadores exactos: estado serializable y combinable"""
+
+    def __init__(self):
+        self.state = GroupState()
+
+    def merge(self, other):
+        self.state.merge(other.state)
+        return self
+
+    def keys(self):
+        """Claves con estado, como tuplas de las columnas de agrupación del detector"""
+        return {key if isinstance(key, tuple) else (key,) for key in self.state.groups}
+
+    def to_dict(self):
+        return self.state.to_dict()
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls()
+        aggregator.state = GroupState.from_dict(data)
+        return aggregator
+
+class PortScanAggregator(ExactAggregator):
+    """Equivalente local de build_port_scanning_query (REJECT agrupado por srcaddr)"""
+
+    COLUMNS = ['srcaddr', 'dstport', 'start', 'end']
+
+    def update(self, batch):
+        mask = batch['action'] == b'REJECT'
+        if mask.any():
+            self.accumulate(select(batch, mask, self.COLUMNS))
+
+    def accumulate(self, columns):
+        (keys,), inverse = group_by(columns['srcaddr'])
+        size = len(keys)
+        pair_groups, pair_ports = group_distinct(inverse, columns['dstport'])
+        self.state.update(
+            np.char.decode(keys).tolist(),
+            record_counts(columns, inverse, size),
+            [],
+            group_min(inverse, size, columns['start']),
+            group_max(inverse, size, columns['end']),
+            split_distinct(pair_groups, pair_ports)
+        )
+
+    def results(self, thresholds=None, limit=None):
+        min_ports = (thresholds or {}).get('unique_ports', PORT_SCAN_MIN_PORTS)
+        rows = [
+            {
+                'srcaddr': key,
+                'unique_ports': len(group['distinct']),
+                'total_attempts': group['count'],
+                'first_attempt': to_iso8601(group['first']),
+                'last_attempt': to_iso8601(group['last'])
+            }
+            for key, group in self.state.groups.items()
+            if len(group['distinct']) > min_ports
+        ]
+        rows.sort(key=lambda row: row['unique_ports'], reverse=True)
+        return rows[:limit or PORT_SCAN_LIMIT]
+
+class DDoSAggregator(ExactAggregator):
+    """Equivalente local de build_ddos_query (ACCEPT/REJECT agrupado por dstaddr)"""
+
+    COLUMNS = ['dstaddr', 'srcaddr', 'packets', 'bytes', 'start', 'end']
+
+    def update(self, batch):
+        mask = (batch['action'] == b'ACCEPT') | (batch['action'] == b'REJECT')
+        if mask.any():
+            self.accumulate(select(batch, mask, self.COLUMNS))
+
+    def accumulate(self, columns):
+        (keys,), inverse = group_by(columns['dstaddr'])
+        size = len(keys)
+        pair_groups, pair_sources = group_distinct(inverse, columns['srcaddr'])
+        self.state.update(
+            np.char.decode(keys).tolist(),
+            record_counts(columns, inverse, size),
+            [
+                group_sum(inverse, size, columns['packets']),
+                group_sum(inverse, size, columns['bytes'])
+            ],
+            group_min(inverse, size, columns['start']),
+            group_max(inverse, size, columns['end']),
+            split_distinct(pair_groups, pair_sources)
+        )
+
+    def results(self, thresholds=None, limit=None):
+        thresholds = thresholds or {}
+        min_packets = thresholds.get('total_packets', DDOS_MIN_PACKETS)
+        min_sources = thresholds.get('unique_sources', DDOS_MIN_SOURCES)
+        rows = [
+            {
+                'dstaddr': key,
+                'total_packets': group['sums'][0],
+                'total_bytes': group['sums'][1],
+                'unique_sources': len(group['distinct']),
+                'attack_start': to_iso8601(group['first']),
+                'attack_end': to_iso8601(group['last'])
+            }
+            for key, group in self.state.groups.items()
+            if group['sums'][0] > min_packets or len(group['distinct']) > min_sources
+        ]
+        rows.sort(key=lambda row: row['total_packets'], reverse=True)
+        return rows[:limit or DDOS_LIMIT]
+
+class ExfiltrationAggregator(ExactAggregator):
+    """Equivalente local de build_data_exfiltration_query (ACCEPT por srcaddr, dstaddr)"""
+
+    COLUMNS = ['srcaddr', 'dstaddr', 'bytes', 'start', 'end']
+
+    def update(self, batch):
+        mask = (batch['action'] == b'ACCEPT') & np.isin(batch['dstport'], EXFIL_PORTS)
+        if mask.any():
+            self.accumulate(select(batch, mask, self.COLUMNS))
+
+    def accumulate(self, columns):
+        (sources, destinations), inverse = group_by(columns['srcaddr'], columns['dstaddr'])
+        size = len(sources)
+        self.state.update(
+            list(zip(np.char.decode(sources).tolist(), np.char.decode(destinations).tolist())),
+            record_counts(columns, inverse, size),
+            [group_sum(inverse, size, columns['bytes'])],
+            group_min(inverse, size, columns['start']),
+            group_max(inverse, size, columns['end'])
+        )
+
+    def results(self, thresholds=None, limit=None):
+        min_bytes = (thresholds or {}).get('total_bytes', EXFIL_MIN_BYTES)
+        rows = [
+            {
+                'srcaddr': key[0],
+                'dstaddr': key[1],
+                'total_bytes': group['sums'][0],
+                'connection_count': group['count'],
+                'avg_bytes_per_connection': group['sums'][0] / group['count'],
+                'first_connection': to_iso8601(group['first']),
+                'last_connection': to_iso8601(group['last'])
+            }
+            for key, group in self.state.groups.items()
+            if group['sums'][0] > min_bytes
+        ]
+        rows.sort(key=lambda row: row['total_bytes'], reverse=True)
+        return rows[:limit or EXFIL_LIMIT]
+
+class TimeBounds:
+    """MIN(start) / MAX(end) solo para las claves que sigue un sketch"""
+
+    def __init__(self):
+        self.bounds = {}
+
+    def update(self, keys, first, last, tracked):
+        for key, key_first, key_last in zip(keys, first.tolist(), last.tolist()):
+            if key not in tracked:
+                continue
+            bounds = self.bounds.get(key)
+            if bounds is None:
+                self.bounds[key] = [key_first, key_last]
+            else:
+                bounds[0] = min(bounds[0], key_first)
+                bounds[1] = max(bounds[1], key_last)
+
+    def prune(self, tracked):
+        for key in [key for key in self.bounds if key not in tracked]:
+            del self.bounds[key]
+
+    def merge(self, other, tracked):
+        for key, (first, last) in other.bounds.items():
+            self.update([key], np.array([first]), np.array([last]), tracked)
+        self.prune(tracked)
+
+    def get(self, key):
+        return self.bounds.get(key, [0, 0])
+
+def add_tracked(totals, keys, values, tracked):
+    """Suma valores por clave solo para las claves seguidas; descarta el resto"""
+    for key in [key for key in totals if key not in tracked]:
+        del totals[key]
+    for key, value in zip(keys, values):
+        if key in tracked:
+            totals[key] = totals.get(key, 0) + value
+
+class SketchPortScanAggregator:
+    """
+    Port scanning con memoria fija: HyperLogLog de dstport por srcaddr para
+    los orígenes con más intentos REJECT
+    """
+
+    COLUMNS = PortScanAggregator.COLUMNS
+
+    def __init__(self):
+        self.ports = sketches.KeyedDistinct(PORT_SCAN_SKETCH_CAPACITY, PORT_SCAN_SKETCH_PRECISION)
+        self.times = TimeBounds()
+
+    def update(self, batch):
+        mask = batch['action'] == b'REJECT'
+        if mask.any():
+            self.accumulate(select(batch, mask, self.COLUMNS))
+
+    def accumulate(self, columns):
+        srcaddr = columns['srcaddr']
+        self.ports.add(srcaddr, columns['dstport'], columns.get('records'))
+        (keys,), inverse = group_by(srcaddr)
+        size = len(keys)
+        tracked = self.ports.heavy.counts
+        self.times.prune(tracked)
+        self.times.update(
+            np.char.decode(keys).tolist(),
+            group_min(inverse, size, columns['start']),
+            group_max(inverse, size, columns['end']),
+            tracked
+        )
+
+    def merge(self, other):
+        self.ports.merge(other.ports)
+        self.times.merge(other.times, self.ports.heavy.counts)
+        return self
+
+    def keys(self):
+        return {(key,) for key in self.ports.heavy.counts}
+
+    def to_dict(self):
+        return {'ports': self.ports.to_dict(), 'times': self.times.bounds}
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls()
+        aggregator.ports = sketches.KeyedDistinct.from_dict(data['ports'])
+        aggregator.times.bounds = data['times']
+        return aggregator
+
+    def results(self, thresholds=None, limit=None):
+        min_ports = (thresholds or {}).get('unique_ports', PORT_SCAN_MIN_PORTS)
+        rows = []
+        for key, unique_ports, attempts in self.ports.items():
+            if unique_ports <= min_ports:
+                continue
+            first, last = self.times.get(key)
+            rows.append({
+                'srcaddr': key,
+                'unique_ports': unique_ports,
+                'total_attempts': attempts,
+                'first_attempt': to_iso8601(first),
+                'last_attempt': to_iso8601(last)
+            })
+        rows.sort(key=lambda row: row['unique_ports'], reverse=True)
+        return rows[:limit or PORT_SCAN_LIMIT]
+
+class SketchDDoSAggregator:
+    """
+    DDoS con memoria fija: destinos ordenados por paquetes (SpaceSaving) con
+    un HyperLogLog de srcaddr cada uno; los bytes se suman desde que el
+    destino entra en el resumen
+    """
+
+    COLUMNS = DDoSAggregator.COLUMNS
+
+    def __init__(self):
+        self.sources = sketches.KeyedDistinct(DDOS_SKETCH_CAPACITY, DDOS_SKETCH_PRECISION)
+        self.bytes = {}
+        self.times = TimeBounds()
+
+    def update(self, batch):
+        mask = (batch['action'] == b'ACCEPT') | (batch['action'] == b'REJECT')
+        if mask.any():
+            self.accumulate(select(batch, mask, self.COLUMNS))
+
+    def accumulate(self, columns):
+        dstaddr = columns['dstaddr']
+        self.sources.add(dstaddr, columns['srcaddr'], columns['packets'])
+        (keys,), inverse = group_by(dstaddr)
+        size = len(keys)
+        decoded = np.char.decode(keys).tolist()
+        tracked = self.sources.heavy.counts
+        self.times.prune(tracked)
+        add_tracked(self.bytes, decoded, group_sum(inverse, size, columns['bytes']).tolist(), tracked)
+        self.times.update(
+            decoded,
+            group_min(inverse, size, columns['start']),
+            group_max(inverse, size, columns['end']),
+            tracked
+        )
+
+    def merge(self, other):
+        self.sources.merge(other.sources)
+        tracked = self.sources.heavy.counts
+        add_tracked(self.bytes, list(other.bytes), list(other.bytes.values()), tracked)
+        self.times.merge(other.times, tracked)
+        return self
+
+    def keys(self):
+        return {(key,) for key in self.sources.heavy.counts}
+
+    def to_dict(self):
+        return {'sources': self.sources.to_dict(), 'bytes': self.bytes, 'times': self.times.bounds}
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls()
+        aggregator.sources = sketches.KeyedDistinct.from_dict(data['sources'])
+        aggregator.bytes = data['bytes']
+        aggregator.times.bounds = data['times']
+        return aggregator
+
+    def results(self, thresholds=None, limit=None):
+        thresholds = thresholds or {}
+        min_packets = thresholds.get('total_packets', DDOS_MIN_PACKETS)
+        min_sources = thresholds.get('unique_sources', DDOS_MIN_SOURCES)
+        rows = []
+        for key, unique_sources, packets in self.sources.items():
+            if packets <= min_packets and unique_sources <= min_sources:
+                continue
+            first, last = self.times.get(key)
+            rows.append({
+                'dstaddr': key,
+                'total_packets': packets,
+                'total_bytes': self.bytes.get(key, 0),
+                'unique_sources': unique_sources,
+                'attack_start': to_iso8601(first),
+                'attack_end': to_iso8601(last)
+            })
+        rows.sort(key=lambda row: row['total_packets'], reverse=True)
+        return rows[:limit or DDOS_LIMIT]
+
+class SketchExfiltrationAggregator:
+    """
+    Exfiltración con memoria fija: top-K pares (srcaddr, dstaddr) por bytes
+    (SpaceSaving) acotado además con un Count-Min sobre todos los pares
+    """
+
+    COLUMNS = ExfiltrationAggregator.COLUMNS
+
+    def __init__(self):
+        self.heavy = sketches.SpaceSaving()
+        self.volume = sketches.CountMinSketch()
+        self.connections = {}
+        self.times = TimeBounds()
+
+    def update(self, batch):
+        mask = (batch['action'] == b'ACCEPT') & np.isin(batch['dstport'], EXFIL_PORTS)
+        if mask.any():
+            self.accumulate(select(batch, mask, self.COLUMNS))
+
+    def accumulate(self, columns):
+        (sources, destinations), inverse = group_by(columns['srcaddr'], columns['dstaddr'])
+        size = len(sources)
+        totals = group_sum(inverse, size, columns['bytes'])
+        keys = [
+            f"{source} {destination}"
+            for source, destination in zip(np.char.decode(sources).tolist(), np.char.decode(destinations).tolist())
+        ]
+        self.volume.add(np.array(keys, dtype=bytes), totals)
+        self.heavy.update(keys, totals)
+
+        tracked = self.heavy.counts
+        self.times.prune(tracked)
+        add_tracked(self.connections, keys, record_counts(columns, inverse, size).tolist(), tracked)
+        self.times.update(
+            keys,
+            group_min(inverse, size, columns['start']),
+            group_max(inverse, size, columns['end']),
+            tracked
+        )
+
+    def merge(self, other):
+        self.heavy.merge(other.heavy)
+        self.volume.merge(other.volume)
+        tracked = self.heavy.counts
+        add_tracked(self.connections, list(other.connections), list(other.connections.values()), tracked)
+        self.times.merge(other.times, tracked)
+        return self
+
+    def keys(self):
+        return {tuple(key.split(' ')) for key in self.heavy.counts}
+
+    def to_dict(self):
+        return {
+            'heavy': self.heavy.to_dict(),
+            'volume': self.volume.to_dict(),
+            'connections': self.connections,
+            'times': self.times.bounds
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls()
+        aggregator.heavy = sketches.SpaceSaving.from_dict(data['heavy'])
+        aggregator.volume = sketches.CountMinSketch.from_dict(data['volume'])
+        aggregator.connections = data['connections']
+        aggregator.times.bounds = data['times']
+        return aggregator
+
+    def results(self, thresholds=None, limit=None):
+        min_bytes = (thresholds or {}).get('total_bytes', EXFIL_MIN_BYTES)
+        candidates = [(key, count) for key, count, _ in self.heavy.top() if count > min_bytes]
+        if not candidates:
+            return []
+
+        # Ambos sketches sobreestiman: el mínimo es la cota más ajustada
+        estimates = self.volume.estimate(np.array([key for key, _ in candidates], dtype=bytes))
+        rows = []
+        for (key, count), estimate in zip(candidates, estimates.tolist()):
+            total_bytes = min(count, estimate)
+            if total_bytes <= min_bytes:
+                continue
+            source, destination = key.split(' ')
+            connections = max(self.connections.get(key, 0), 1)
+            first, last = self.times.get(key)
+            rows.append({
+                'srcaddr': source,
+                'dstaddr': destination,
+                'total_bytes': total_bytes,
+                'connection_count': connections,
+                'avg_bytes_per_connection': total_bytes / connections,
+                'first_connection': to_iso8601(first),
+                'last_connection': to_iso8601(last)
+            })
+        rows.sort(key=lambda row: row['total_bytes'], reverse=True)
+        return rows[:limit or EXFIL_LIMIT]
+
+AGGREGATOR_CLASSES = {
+    'exact': {
+        'port_scanning': PortScanAggregator,
+        'ddos': DDoSAggregator,
+        'data_exfiltration': ExfiltrationAggregator
+    },
+    'sketch': {
+        'port_scanning': SketchPortScanAggregator,
+        'ddos': SketchDDoSAggregator,
+        'data_exfiltration': SketchExfiltrationAggregator
+    }
+}
+
+def create_aggregators(mode='exact'):
+    """
+    Un agregador por detector, con los mismos nombres que DETECTORS.
+    mode='sketch' usa los agregadores de memoria acotada de sketches.py.
+    """
+    return {name: cls() for name, cls in AGGREGATOR_CLASSES[mode].items()}
+
+def dump_aggregators(aggregators):
+    """Estado serializable (JSON) de todos los agregadores"""
+    return {name: aggregator.to_dict() for name, aggregator in aggregators.items()}
+
+def load_aggregators(data, mode='exact'):
+    """Reconstruye los agregadores guardados con dump_aggregators"""
+    return {
+        name: cls.from_dict(data[name]) if name in data else cls()
+        for name, cls in AGGREGATOR_CLASSES[mode].items()
+    }
+
+def collect_results(aggregators, thresholds=None, limits=None):
+    """
+    Aplica los umbrales HAVING sobre el estado acumulado. thresholds
+    ({detector: {alias: valor}}) y limits ({detector: filas}) sustituyen a
+    los fijos de los detectores indicados
+    """
+    return {
+        name: aggregator.results((thresholds or {}).get(name), (limits or {}).get(name))
+        for name, aggregator in aggregators.items()
+    }
+
+def aggregate_chunks(chunks, aggregators, batch_size=BATCH_SIZE, window=None, ip_lists=None):
+    """
+    Parsea los bloques de líneas por lotes y alimenta a todos los agregadores.
+    Con window=(start, end) solo cuentan los registros que solapan la ventana;
+    con ip_lists (ip_index.IPLists) se descartan los orígenes de la allowlist.
+    """
+    records = 0
+    for batch in parse_batches(chunks, batch_size):
+        if window:
+            batch = select(batch, (batch['end'] >= window[0]) & (batch['start'] < window[1]), list(batch))
+        if ip_lists:
+            batch = ip_lists.filter_batch(batch)
+        records += len(batch['start'])
+        for aggregator in aggregators.values():
+            aggregator.update(batch)
+    return records
+
+def aggregate_prefixes(s3_client, bucket, prefixes, aggregators, batch_size=BATCH_SIZE, window=None, ip_lists=None,
+                       skip_keys=None):
+    """
+    Alimenta los agregadores con todos los objetos de los prefijos salvo los
+    de skip_keys (descartados por el índice de objetos, ver object_index.py)
+    """
+    objects = 0
+    records = 0
+    skipped = 0
+
+    for prefix in prefixes:
+        for key in list_flow_log_objects(s3_client, bucket, prefix):
+            if skip_keys and key in skip_keys:
+                skipped += 1
+                continue
+            objects += 1
+            records += aggregate_chunks(iter_s3_object_chunks(s3_client, bucket, key), aggregators, batch_size, window, ip_lists)
+
+    location = f"s3://{bucket}/{prefixes[0]}"
+    if len(prefixes) > 1:
+        location = f"{len(prefixes)} horas desde {location}"
+    telemetry.console(f"📦 Motor local: {objects} objetos, {records} registros en {location}"
+          + (f" ({skipped} descartados por el índice)" if skipped else ""))
+    return aggregators
+
+def detection_prefixes(base_prefix, day=None, window=None):
+    """Prefijos que lee la detección: las horas de window=(start, end) o el día (UTC)"""
+    if window:
+        return flow_log_window_prefixes(base_prefix, *window)
+    return [flow_log_day_prefix(base_prefix, day or datetime.now(timezone.utc).date())]
+
+def run_local_detection(s3_client, bucket, base_prefix, day=None, batch_size=BATCH_SIZE, mode='exact', window=None,
+                        ip_lists=None, thresholds=None, limits=None, skip_keys=None):
+    """
+    Ejecuta los tres detectores sobre los objetos del día (UTC, como
+    current_date en Athena), o solo sobre las horas de window=(start, end),
+    y retorna {nombre_detector: filas}
+    """
+    prefixes = detection_prefixes(base_prefix, day, window)
+    aggregators = aggregate_prefixes(s3_client, bucket, prefixes, create_aggregators(mode), batch_size, window, ip_lists,
+                                     skip_keys)
+    return collect_results(aggregators, thresholds, limits)
+
+def update_from_new_objects(s3_client, bucket, prefix, aggregators, checkpoint, batch_size=BATCH_SIZE, ip_lists=None):
+    """
+    Modo incremental: procesa solo los objetos llegados desde el último
+    watermark y fusiona sus registros en los agregadores ya cargados.
+    checkpoint guarda 'objects_watermark' (LastModified más reciente) y
+    'recent_objects' (claves dentro del margen de solapamiento).
+    """
+    watermark = checkpoint.get('objects_watermark', 0)
+    recent = checkpoint.get('recent_objects', {})
+    horizon = watermark - OBJECT_OVERLAP_SECONDS
+    objects = 0
+    records = 0
+
+    for key, last_modified in list_flow_log_object_info(s3_client, bucket, prefix):
+        if last_modified < horizon or key in recent:
+            continue
+        records += aggregate_chunks(iter_s3_object_chunks(s3_client, bucket, key), aggregators, batch_size,
+                                    ip_lists=ip_lists)
+        recent[key] = last_modified
+        watermark = max(watermark, last_modified)
+        objects += 1
+
+    horizon = watermark - OBJECT_OVERLAP_SECONDS
+    checkpoint['objects_watermark'] = watermark
+    checkpoint['recent_objects'] = {key: value for key, value in recent.items() if value >= horizon}
+
+    telemetry.console(f"📦 Motor local incremental: {objects} objetos nuevos, {records} registros")
+    return records
+
+def run_local_detection_on_files(paths, batch_size=BATCH_SIZE, mode='exact', ip_lists=None):
+    """Igual que run_local_detection pero sobre ficheros en disco"""
+    aggregators = create_aggregators(mode)
+    for path in paths:
+        aggregate_chunks(iter_file_chunks(os.fspath(path)), aggregators, batch_size, ip_lists=ip_lists)
+    return collect_results(aggregators)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Migración de los flow logs por día a prefijos por hora (per_hour_partition).
+
+Con per_hour_partition = true (vpc.tf) los objetos se escriben en
+.../YYYY/MM/DD/HH/ y la tabla vpc_flow_logs proyecta la partición hour
+(athena.tf), así que los objetos escritos antes del cambio, directamente en
+.../YYYY/MM/DD/, quedan fuera de Athena y de las ventanas de análisis del
+motor local. Este script mueve cada uno de esos objetos a la hora de su
+nombre (<cuenta>_vpcflowlogs_<región>_<flow-log>_YYYYMMDDTHHmmZ_<hash>.log.gz,
+la misma hora que usa AWS al escribirlos por hora). Se mueven (copia y
+borrado) y no solo se copian: el motor local lee el prefijo del día entero y
+contaría dos veces un objeto presente en ambos sitios.
+
+Es idempotente: al relanzarlo solo quedan por mover los objetos por día que
+falten (p.ej. los que entregó el flow log anterior durante el cambio).
+
+Uso:
+  python migrate_hour_partitions.py --bucket <bucket> --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/ --dry-run
+  python migrate_hour_partitions.py --bucket <bucket> --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/ --workers 16
+  # Ficheros locales con la estructura de S3
+  python migrate_hour_partitions.py --root /tmp/flow-logs --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/
+"""
+import argparse
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Objeto escrito por día: <prefijo>YYYY/MM/DD/<nombre con YYYYMMDDTHHmmZ>.log.gz
+DAY_LEVEL_KEY = re.compile(r'(\d{4}/\d{2}/\d{2})/([^/]*_\d{8}T(\d{2})\d{2}Z_[^/]*\.log\.gz)$')
+
+def hour_key(prefix, key):
+    """Clave por hora de un objeto escrito por día, o None si ya está en su hora"""
+    match = DAY_LEVEL_KEY.fullmatch(key[len(prefix):])
+    if not match:
+        return None
+    day, name, hour = match.groups()
+    return f"{prefix}{day}/{hour}/{name}"
+
+def list_keys(s3_client, bucket, prefix, root):
+    if root:
+        base = os.path.join(root, prefix)
+        for directory, _, names in os.walk(base):
+            for name in names:
+                yield os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/')
+        return
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+def move(s3_client, bucket, root, key, target):
+    if root:
+        os.makedirs(os.path.dirname(os.path.join(root, target)), exist_ok=True)
+        os.replace(os.path.join(root, key), os.path.join(root, target))
+        return
+    # copy gestiona la copia multiparte; el borrado solo tras copiar
+    s3_client.copy({'Bucket': bucket, 'Key': key}, bucket, target)
+    s3_client.delete_object(Bucket=bucket, Key=key)
+
+def migrate(s3_client, bucket, prefix, root=None, workers=8, dry_run=False):
+    """Mueve los objetos por día del prefijo a su hora; retorna los objetos movidos"""
+    prefix = prefix.rstrip('/') + '/'
+    moves = [(key, target) for key in list_keys(s3_client, bucket, prefix, root)
+             for target in [hour_key(prefix, key)] if target]
+    for key, target in moves[:5]:
+        print(f"   {key} → {target}")
+    if dry_run:
+        print(f"🔎 {len(moves)} objetos por día por mover (--dry-run)")
+        return 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda item: move(s3_client, bucket, root, *item), moves))
+    print(f"✅ {len(moves)} objetos movidos a prefijos por hora")
+    return len(moves)
+
+def main():
+    parser = argparse.ArgumentParser(description='Migración de flow logs por día a prefijos por hora')
+    parser.add_argument('--bucket', default=os.environ.get('FLOW_LOGS_BUCKET', ''))
+    parser.add_argument('--prefix', required=True, help='Prefijo base: AWSLogs/<cuenta>/vpcflowlogs/<región>/')
+    parser.add_argument('--root', help='Directorio local con la estructura de claves de S3 (en lugar de --bucket)')
+    parser.add_argument('--workers', type=int, default=8, help='Objetos movidos a la vez')
+    parser.add_argument('--dry-run', action='store_true', help='Solo lista lo que se movería')
+    args = parser.parse_args()
+
+    s3_client = None
+    if not args.root:
+        if not args.bucket:
+            print("❌ Indica --bucket (o FLOW_LOGS_BUCKET) o --root")
+            return 1
+        import aws_clients
+        s3_client = aws_clients.get_client('s3')
+
+    migrate(s3_client, args.bucket, args.prefix, args.root, args.workers, args.dry_run)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Índice por objeto de los flow logs (sidecar) para descartar objetos sin
+descomprimirlos.
+
+Por cada objeto se guarda el mínimo/máximo de start y de end, los registros
+OK por acción (ACCEPT / REJECT) y filtros de Bloom de srcaddr y dstaddr. Con
+eso una búsqueda ("REJECTs de 203.0.113.5 en los últimos 15 minutos"), el
+motor local o el replay descartan los objetos cuyo rango de tiempo no solapa
+la ventana, los que no tienen registros de la acción pedida y aquellos cuyo
+Bloom no contiene la dirección. Los objetos sin entrada en el índice nunca
+se descartan (se leen como siempre).
+
+El índice vive fuera del bucket de flow logs (Athena leería cualquier
+fichero bajo las particiones), en <ubicación>/<prefijo de la hora>.flix
+(índice consolidado de la hora, lo escribe build_hour) y en
+<ubicación>/<prefijo de la hora>/<objeto>.flix (una entrada por objeto, la
+escribe la ingesta por eventos S3 al llegar cada objeto, sin carreras entre
+invocaciones). load_hour junta ambos.
+
+Formato .flix (little endian, ancho fijo: se mapea en memoria sin copiar):
+  cabecera  'FLIX', versión (u16), hashes del Bloom (u16), bytes de cada Bloom (u32), entradas (u32)
+  entradas  array de entry_dtype(bytes del Bloom)
+  claves    claves de los objetos en UTF-8 separadas por '\\n'
+
+Uso:
+  # Índice consolidado de unas horas (backfill)
+  python object_index.py build --index /tmp/flow-index --root /tmp/flow-logs \\
+      --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/ --start 2026-10-18T00 --end 2026-10-18T23
+  # Registros de una dirección leyendo solo los objetos candidatos
+  python object_index.py lookup --index /tmp/flow-index --root /tmp/flow-logs \\
+      --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/ --start 2026-10-18T23 --end 2026-10-18T23 \\
+      --srcaddr 203.0.113.10 --action REJECT --minutes 15
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+
+import local_engine
+import state_store
+
+MAGIC = b'FLIX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+SUFFIX = '.flix'
+
+# 8 KiB por campo y 5 hashes: ~0,4 % de falsos positivos con 5.000
+# direcciones distintas por objeto y ~5 % con 15.000
+BLOOM_BYTES = 8192
+BLOOM_HASHES = 5
+# Semilla del segundo hash (doble hashing: h1 + i * h2)
+HASH_SEED = 0x9E3779B9
+
+ACTIONS = ('ACCEPT', 'REJECT')
+
+def entry_dtype(bloom_bytes=BLOOM_BYTES):
+    return np.dtype([
+        ('min_start', '<i8'), ('max_start', '<i8'),
+        ('min_end', '<i8'), ('max_end', '<i8'),
+        ('records', '<u4'), ('accept', '<u4'), ('reject', '<u4'),
+        ('src_bloom', 'u1', (bloom_bytes,)), ('dst_bloom', 'u1', (bloom_bytes,))
+    ])
+
+def bloom_positions(addresses, bits, hashes=BLOOM_HASHES):
+    """Bits del Bloom de cada dirección (bytes): array (n, hashes)"""
+    values = list(addresses)
+    h1 = np.fromiter((zlib.crc32(value) for value in values), dtype=np.uint64, count=len(values))
+    h2 = np.fromiter((zlib.crc32(value, HASH_SEED) | 1 for value in values), dtype=np.uint64, count=len(values))
+    return (h1[:, None] + np.arange(hashes, dtype=np.uint64) * h2[:, None]) % np.uint64(bits)
+
+def bloom_contains(blooms, address, hashes=BLOOM_HASHES):
+    """Máscara de los Bloom (array (n, bytes)) que pueden contener la dirección"""
+    positions = bloom_positions([address.encode()], blooms.shape[1] * 8, hashes)[0]
+    found = np.ones(len(blooms), dtype=bool)
+    for position in positions.tolist():
+        found &= (blooms[:, position >> 3] >> (position & 7)) & 1 == 1
+    return found
+
+class EntryBuilder:
+    """Entrada del índice de un objeto, acumulada lote a lote (lotes de local_engine.parse_batches)"""
+
+    def __init__(self, bloom_bytes=BLOOM_BYTES, hashes=BLOOM_HASHES):
+        self.hashes = hashes
+        self.entry = np.zeros((), dtype=entry_dtype(bloom_bytes))
+        self.bits = {field: np.zeros(bloom_bytes * 8, dtype=bool) for field in ('srcaddr', 'dstaddr')}
+
+    def update(self, batch):
+        if not len(batch['start']):
+            return
+        entry = self.entry
+        first = not entry['records']
+        for column in ('start', 'end'):
+            low, high = int(batch[column].min()), int(batch[column].max())
+            entry[f"min_{column}"] = low if first else min(int(entry[f"min_{column}"]), low)
+            entry[f"max_{column}"] = high if first else max(int(entry[f"max_{column}"]), high)
+        entry['records'] += len(batch['start'])
+        entry['accept'] += int((batch['action'] == b'ACCEPT').sum())
+        entry['reject'] += int((batch['action'] == b'REJECT').sum())
+        for field, bits in self.bits.items():
+            bits[bloom_positions(np.unique(batch[field]).tolist(), len(bits), self.hashes).ravel()] = True
+
+    def build(self):
+        self.entry['src_bloom'] = np.packbits(self.bits['srcaddr'], bitorder='little')
+        self.entry['dst_bloom'] = np.packbits(self.bits['dstaddr'], bitorder='little')
+        return self.entry
+
+def build_entry(chunks, bloom_bytes=BLOOM_BYTES, hashes=BLOOM_HASHES):
+    """Entrada del índice de un objeto a partir de sus bloques de líneas"""
+    builder = EntryBuilder(bloom_bytes, hashes)
+    for batch in local_engine.parse_batches(chunks):
+        builder.update(batch)
+    return builder.build()
+
+class ObjectIndex:
+    """Entradas (array estructurado, posiblemente mapeado en memoria) y claves de un grupo de objetos"""
+
+    def __init__(self, keys, entries, hashes=BLOOM_HASHES):
+        self.keys = list(keys)
+        self.entries = entries
+        self.hashes = hashes
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_bytes(self):
+        bloom_bytes = self.entries.dtype['src_bloom'].shape[0]
+        header = HEADER.pack(MAGIC, VERSION, self.hashes, bloom_bytes, len(self.keys))
+        return header + self.entries.tobytes() + '\n'.join(self.keys).encode()
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Índice sobre un buffer (bytes o mmap): las entradas no se copian"""
+        magic, version, hashes, bloom_bytes, count = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Índice no reconocido ({magic!r} v{version})")
+        dtype = entry_dtype(bloom_bytes)
+        entries = np.frombuffer(buffer, dtype=dtype, count=count, offset=HEADER.size)
+        keys = bytes(buffer[HEADER.size + dtype.itemsize * count:]).decode().split('\n') if count else []
+        return cls(keys, entries, hashes)
+
+    @classmethod
+    def concat(cls, indexes):
+        indexes = [index for index in indexes if len(index)]
+        if not indexes:
+            return cls([], np.zeros(0, dtype=entry_dtype()))
+        if len(indexes) == 1:
+            return indexes[0]
+        return cls([key for index in indexes for key in index.keys],
+                   np.concatenate([index.entries for index in indexes]), indexes[0].hashes)
+
+    def candidates(self, start=None, end=None, actions=None, srcaddr=None, dstaddr=None):
+        """
+        Máscara de los objetos que pueden tener registros que solapan
+        [start, end), con alguna de las acciones y con las direcciones dadas
+        """
+        entries = self.entries
+        mask = entries['records'] > 0
+        if start is not None:
+            mask &= entries['max_end'] >= start
+        if end is not None:
+            mask &= entries['min_start'] < end
+        if actions:
+            mask &= sum(entries[action.lower()].astype(np.int64) for action in actions) > 0
+        if srcaddr:
+            mask[mask] = bloom_contains(entries['src_bloom'][mask], srcaddr, self.hashes)
+        if dstaddr:
+            mask[mask] = bloom_contains(entries['dst_bloom'][mask], dstaddr, self.hashes)
+        return mask
+
+    def skipped_keys(self, **filters):
+        """Claves que se pueden descartar con los filtros de candidates"""
+        mask = self.candidates(**filters)
+        return {key for key, keep in zip(self.keys, mask.tolist()) if not keep}
+
+def hour_directory(key):
+    """Prefijo de la hora de una clave (.../YYYY/MM/DD/HH)"""
+    return key.rsplit('/', 1)[0]
+
+def _path(location, name):
+    if state_store.is_s3_location(location):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return bucket, f"{prefix.strip('/')}/{name}" if prefix.strip('/') else name
+    return None, os.path.join(location, name.lstrip('/'))
+
+def read_index(location, name, s3_client=None):
+    """Índice guardado como name (mapeado en memoria si es local) o None si no existe"""
+    bucket, path = _path(location, name)
+    try:
+        if bucket:
+            return ObjectIndex.from_buffer(s3_client.get_object(Bucket=bucket, Key=path)['Body'].read())
+        with open(path, 'rb') as stream:
+            return ObjectIndex.from_buffer(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+
+def write_index(location, name, index, s3_client=None):
+    bucket, path = _path(location, name)
+    body = index.to_bytes()
+    if bucket:
+        s3_client.put_object(Bucket=bucket, Key=path, Body=body, ContentType='application/octet-stream')
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", 'wb') as stream:
+        stream.write(body)
+    os.replace(f"{path}.tmp", path)
+
+def list_entry_names(location, directory, s3_client=None):
+    """Nombres de las entradas por objeto de una hora"""
+    bucket, path = _path(location, directory)
+    if bucket:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        base = len(path) - len(directory)
+        return [
+            item['Key'][base:]
+            for page in paginator.paginate(Bucket=bucket, Prefix=f"{path}/")
+            for item in page.get('Contents', []) if item['Key'].endswith(SUFFIX)
+        ]
+    try:
+        return [f"{directory}/{name}" for name in sorted(os.listdir(path)) if name.endswith(SUFFIX)]
+    except FileNotFoundError:
+        return []
+
+def write_entry(location, key, entry, s3_client=None, hashes=BLOOM_HASHES):
+    """Guarda la entrada de un objeto recién llegado (sidecar propio: sin carreras entre invocaciones)"""
+    name = f"{hour_directory(key)}/{key.rsplit('/', 1)[-1]}{SUFFIX}"
+    write_index(location, name, ObjectIndex([key], entry.reshape(1), hashes), s3_client)
+
+def load_hour(location, directory, s3_client=None):
+    """Índice de una hora: el consolidado más las entradas por objeto que no incluye"""
+    consolidated = read_index(location, f"{directory}{SUFFIX}", s3_client)
+    indexed = {key.rsplit('/', 1)[-1] for key in consolidated.keys} if consolidated else set()
+    pending = []
+    for name in list_entry_names(location, directory, s3_client):
+        if name[len(directory) + 1:-len(SUFFIX)] not in indexed:
+            index = read_index(location, name, s3_client)
+            if index:
+                pending.append(index)
+    return ObjectIndex.concat(([consolidated] if consolidated else []) + pending)
+
+def load_prefixes(location, prefixes, s3_client=None):
+    """Índice de varios prefijos de hora (.../YYYY/MM/DD/HH/)"""
+    return ObjectIndex.concat([load_hour(location, prefix.rstrip('/'), s3_client) for prefix in prefixes])
+
+def build_hour(location, directory, objects, s3_client=None):
+    """
+    Índice consolidado de una hora a partir de [(clave, bloques)]. Las
+    entradas por objeto ya incluidas se borran
+    """
+    keys = []
+    entries = []
+    for key, chunks in objects:
+        keys.append(key)
+        entries.append(build_entry(chunks))
+    index = ObjectIndex(keys, np.array(entries, dtype=entry_dtype()) if entries else np.zeros(0, dtype=entry_dtype()))
+    write_index(location, f"{directory}{SUFFIX}", index, s3_client)
+    covered = {key.rsplit('/', 1)[-1] for key in keys}
+    for name in list_entry_names(location, directory, s3_client):
+        if name[len(directory) + 1:-len(SUFFIX)] not in covered:
+            continue
+        bucket, path = _path(location, name)
+        if bucket:
+            s3_client.delete_object(Bucket=bucket, Key=path)
+        else:
+            os.remove(path)
+    return index
+
+def hour_prefixes(base_prefix, start, end):
+    """Prefijos .../YYYY/MM/DD/HH/ de las horas de start a end (epoch, ambas incluidas)"""
+    base = base_prefix.strip('/')
+    return [
+        f"{base}/{datetime.fromtimestamp(hour, tz=timezone.utc):%Y/%m/%d/%H}/".lstrip('/')
+        for hour in range(start - start % 3600, end + 1, 3600)
+    ]
+
+def list_objects(root, bucket, prefix, s3_client=None):
+    """Claves de los objetos de un prefijo (en disco con root, si no en S3)"""
+    if root:
+        directory = os.path.join(root, prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f"{prefix.rstrip('/')}/{name}" for name in os.listdir(directory) if name.endswith('.log.gz'))
+    return list(local_engine.list_flow_log_objects(s3_client, bucket, prefix))
+
+def object_chunks(root, bucket, key, s3_client=None):
+    if root:
+        return local_engine.iter_file_chunks(os.path.join(root, key))
+    return local_engine.iter_s3_object_chunks(s3_client, bucket, key)
+
+def lookup(index, keys, chunks_of, start=None, end=None, action=None, srcaddr=None, dstaddr=None):
+    """
+    Registros que cumplen los filtros leyendo solo los objetos candidatos.
+    Retorna (registros como dicts, objetos leídos)
+    """
+    skipped = index.skipped_keys(start=start, end=end, actions=[action] if action else None,
+                                 srcaddr=srcaddr, dstaddr=dstaddr)
+    scanned = [key for key in keys if key not in skipped]
+    records = []
+    for key in scanned:
+        for batch in local_engine.parse_batches(chunks_of(key)):
+            mask = np.ones(len(batch['start']), dtype=bool)
+            if start is not None:
+                mask &= batch['end'] >= start
+            if end is not None:
+                mask &= batch['start'] < end
+            if action:
+                mask &= batch['action'] == action.encode()
+            if srcaddr:
+                mask &= batch['srcaddr'] == srcaddr.encode()
+            if dstaddr:
+                mask &= batch['dstaddr'] == dstaddr.encode()
+            for i in np.flatnonzero(mask).tolist():
+                records.append({
+                    name: values[i].decode() if values.dtype.kind == 'S' else int(values[i])
+                    for name, values in batch.items()
+                })
+    return records, scanned
+
+def parse_hour(value):
+    return int(datetime.strptime(value, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc).timestamp())
+
+def main():
+    parser = argparse.ArgumentParser(description='Índice por objeto de los flow logs')
+    parser.add_argument('command', choices=['build', 'lookup'])
+    parser.add_argument('--index', required=True, help='Ubicación del índice (directorio o s3://)')
+    parser.add_argument('--bucket', default=os.environ.get('FLOW_LOGS_BUCKET', ''))
+    parser.add_argument('--prefix', default=os.environ.get('FLOW_LOGS_PREFIX', ''), help='Prefijo base de los flow logs')
+    parser.add_argument('--root', help='Directorio local con la estructura de claves de S3 (en lugar de --bucket)')
+    parser.add_argument('--start', required=True, help='Primera hora (YYYY-MM-DDTHH, UTC)')
+    parser.add_argument('--end', required=True, help='Última hora (YYYY-MM-DDTHH, UTC, incluida)')
+    parser.add_argument('--minutes', type=int, help='lookup: solo los últimos N minutos antes del final de --end')
+    parser.add_argument('--srcaddr')
+    parser.add_argument('--dstaddr')
+    parser.add_argument('--action', choices=ACTIONS)
+    args = parser.parse_args()
+
+    s3_client = None
+    if not args.root or state_store.is_s3_location(args.index):
+        import aws_clients
+        s3_client = aws_clients.get_client('s3')
+
+    start, end = parse_hour(args.start), parse_hour(args.end)
+    prefixes = hour_prefixes(args.prefix, start, end)
+    started_at = time.perf_counter()
+
+    if args.command == 'build':
+        objects = 0
+        for prefix in prefixes:
+            keys = list_objects(args.root, args.bucket, prefix, s3_client)
+            index = build_hour(args.index, prefix.rstrip('/'),
+                               ((key, object_chunks(args.root, args.bucket, key, s3_client)) for key in keys), s3_client)
+            objects += len(index)
+        print(f"🗂️ Índice: {objects} objetos en {len(prefixes)} horas ({time.perf_counter() - started_at:.2f}s)")
+        return 0
+
+    window_end = end + 3600
+    window_start = window_end - args.minutes * 60 if args.minutes else start
+    index = load_prefixes(args.index, prefixes, s3_client)
+    keys = [key for prefix in prefixes for key in list_objects(args.root, args.bucket, prefix, s3_client)]
+    records, scanned = lookup(
+        index, keys, lambda key: object_chunks(args.root, args.bucket, key, s3_client),
+        window_start, window_end, args.action, args.srcaddr, args.dstaddr
+    )
+    for record in records:
+        sys.stdout.write(json.dumps(record) + '\n')
+    print(f"🔎 {len(records)} registros; {len(scanned)}/{len(keys)} objetos leídos "
+          f"({1 - len(scanned) / max(1, len(keys)):.0%} descartados) en {time.perf_counter() - started_at:.2f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Orquestación en pipeline de detectar -> analizar -> alertar con asyncio.
+
+Las etapas se comunican por colas acotadas en lugar de esperarse unas a
+otras: cada anomalía pasa al análisis en cuanto su detector la produce y se
+publica en cuanto tiene análisis, así que un DDoS encontrado a los 20 s no
+espera a que termine una consulta lenta de exfiltración.
+
+- Detección: detect(emit) corre en un hilo del executor (las llamadas a
+  boto3 son bloqueantes) y entrega cada anomalía con emit(). Si la cola de
+  análisis está llena, emit() espera (contrapresión sobre los detectores).
+- Análisis: ANALYSIS_WORKERS corrutinas sacan anomalías de la cola, descartan
+  las suprimidas con accept() y ejecutan analyze(anomaly, deadline) en el
+  executor. Si el análisis no termina antes del deadline se usa
+  fallback(anomaly) (el análisis básico).
+- Alertas: una corrutina publica con publish(anomalías) todo lo que esté
+  listo de cada vez (la primera anomalía sale sola; las que llegan a la vez
+  comparten digest) y mide la latencia detección -> alerta de cada una.
+
+Al llegar el deadline la pipeline deja de esperar a los detectores, termina
+los análisis en curso con el respaldo y publica lo pendiente; las anomalías
+que un detector entregue después se cuentan como 'late' y se descartan.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import telemetry
+
+# Anomalías en espera entre etapas
+QUEUE_SIZE = 8
+# Análisis simultáneos (el límite de tasa de Bedrock lo aplica analyze)
+ANALYSIS_WORKERS = 4
+# Cada cuánto comprueba emit() si la pipeline se ha cerrado mientras espera sitio
+EMIT_POLL_SECONDS = 1
+
+class DetectionPipeline:
+    stat_names = ('detected', 'suppressed', 'analyzed', 'fallback', 'alerted', 'late')
+
+    def __init__(self, detect, analyze, fallback, publish, accept=None,
+                 queue_size=QUEUE_SIZE, analysis_workers=ANALYSIS_WORKERS, metrics=None):
+        """
+        detect(emit) -> anomalías (bloqueante; llama a emit por cada una)
+        analyze(anomaly, deadline) -> texto del análisis (bloqueante)
+        fallback(anomaly) -> análisis de respaldo
+        publish(anomalías) -> publica un lote (bloqueante)
+        accept(anomaly) -> False si la anomalía está suprimida
+        """
+        self.detect = detect
+        self.analyze = analyze
+        self.fallback = fallback
+        self.publish = publish
+        self.accept = accept or (lambda anomaly: True)
+        self.queue_size = queue_size
+        self.analysis_workers = analysis_workers
+        self.metrics = metrics
+        self.stats = dict.fromkeys(self.stat_names, 0)
+        self.latencies = []
+        self.detected_at = {}
+        self.detection_complete = False
+        self.closed = False
+
+    def run(self, deadline):
+        """Ejecuta la pipeline hasta terminar o hasta el deadline (monotonic); retorna las estadísticas"""
+        executor = ThreadPoolExecutor(max_workers=self.analysis_workers + 2)
+        try:
+            asyncio.run(self._run(executor, deadline))
+        finally:
+            # Los hilos de detección o análisis que sigan vivos no se esperan
+            self.closed = True
+            executor.shutdown(wait=False, cancel_futures=True)
+        return self.summary()
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return dict(
+            self.stats,
+            detection_complete=self.detection_complete,
+            first_alert_ms=round(latencies[0]) if latencies else None,
+            max_latency_ms=round(latencies[-1]) if latencies else None
+        )
+
+    async def _run(self, executor, deadline):
+        loop = asyncio.get_running_loop()
+        detected = asyncio.Queue(self.queue_size)
+        analyzed = asyncio.Queue(self.queue_size)
+
+        def emit(anomaly):
+            """Entrega una anomalía desde el hilo del detector"""
+            if self.closed:
+                self.stats['late'] += 1
+                return
+            self.detected_at[id(anomaly)] = time.monotonic()
+            future = asyncio.run_coroutine_threadsafe(detected.put(anomaly), loop)
+            while True:
+                try:
+                    future.result(timeout=EMIT_POLL_SECONDS)
+                    return
+                except FutureTimeoutError:
+                    if self.closed:
+                        future.cancel()
+                        self.stats['late'] += 1
+                        return
+
+        detection = loop.run_in_executor(executor, self.detect, emit)
+        analyzers = [asyncio.create_task(self._analyze_worker(loop, executor, detected, analyzed, deadline))
+                     for _ in range(self.analysis_workers)]
+        publisher = asyncio.create_task(self._publish_worker(loop, executor, analyzed))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(detection), timeout=max(0, deadline - time.monotonic()))
+            self.detection_complete = True
+        except asyncio.TimeoutError:
+            telemetry.console("⏰ Deadline alcanzado con detectores sin terminar: se publica lo encontrado")
+        except Exception as e:
+            telemetry.console(f"❌ Error en la detección: {str(e)}")
+            raise
+        finally:
+            # Fin de la entrada: las anomalías que lleguen después se descartan
+            self.closed = True
+            for _ in analyzers:
+                await detected.put(None)
+            await asyncio.gather(*analyzers)
+            await analyzed.put(None)
+            await publisher
+
+    async def _analyze_worker(self, loop, executor, detected, analyzed, deadline):
+        while True:
+            anomaly = await detected.get()
+            if anomaly is None:
+                return
+            self.stats['detected'] += 1
+            if not self.accept(anomaly):
+                self.stats['suppressed'] += 1
+                continue
+
+            remaining = deadline - time.monotonic()
+            analysis = None
+            if remaining > 0:
+                try:
+                    analysis = await asyncio.wait_for(
+                        loop.run_in_executor(executor, self.analyze, anomaly, deadline), timeout=remaining
+                    )
+                    self.stats['analyzed'] += 1
+                except asyncio.TimeoutError:
+                    telemetry.console(f"⏰ {anomaly['type']}: análisis sin terminar antes del deadline")
+                except Exception as e:
+                    telemetry.console(f"❌ {anomaly['type']}: error en el análisis: {str(e)}")
+            if analysis is None:
+                self.stats['fallback'] += 1
+                analysis = self.fallback(anomaly)
+
+            anomaly['ai_analysis'] = analysis
+            await analyzed.put(anomaly)
+
+    async def _publish_worker(self, loop, executor, analyzed):
+        finished = False
+        while not finished:
+            batch = [await analyzed.get()]
+            # Lo que ya esté analizado sale en el mismo digest
+            while not analyzed.empty():
+                batch.append(analyzed.get_nowait())
+            finished = batch[-1] is None
+            batch = [anomaly for anomaly in batch if anomaly is not None]
+            if not batch:
+                continue
+
+            try:
+                await loop.run_in_executor(executor, self.publish, batch)
+            except Exception as e:
+                telemetry.console(f"❌ Error publicando {len(batch)} alertas: {str(e)}")
+                continue
+
+            published_at = time.monotonic()
+            for anomaly in batch:
+                latency = (published_at - self.detected_at.get(id(anomaly), published_at)) * 1000
+                self.latencies.append(latency)
+                self.stats['alerted'] += 1
+                if self.metrics:
+                    self.metrics.put('DetectionToAlertLatency', latency, 'Milliseconds', Type=anomaly['type'])
+                telemetry.console(f"📧 {anomaly['type']} publicada {latency:.0f} ms después de detectarse")
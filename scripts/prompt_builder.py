@@ -0,0 +1,117 @@
+"""
+Construcción del prompt de análisis con presupuesto de tokens.
+
+Las filas de la anomalía se codifican como una tabla compacta (cabecera una
+vez, valores separados por '|') en lugar de JSON indentado. Si la tabla no
+cabe en el presupuesto, se incluyen las K primeras filas (las consultas ya
+las ordenan por relevancia) y el resto se resume con agregados: número de
+filas, suma/mínimo/máximo de cada columna numérica y valores distintos de
+las columnas de texto.
+"""
+PROMPT_TEMPLATE = """Eres un experto en ciberseguridad analizando tráfico de red anómalo en AWS VPC Flow Logs.
+
+Analiza la siguiente anomalía detectada y proporciona un análisis estructurado:
+
+**ANOMALÍA DETECTADA:**
+- Tipo: {type}
+- Severidad inicial: {severity}
+- Instancias detectadas: {count}
+
+**DATOS TÉCNICOS** (tabla, columnas separadas por '|'):
+{data}
+
+**ANÁLISIS REQUERIDO:**
+1. **Explicación técnica**: ¿Qué indica esta actividad?
+2. **Nivel de severidad**: Escala 1-10 con justificación
+3. **Vectores de ataque**: Posibles métodos utilizados
+4. **Impacto potencial**: Riesgos para la infraestructura
+5. **Acciones inmediatas**: Top 3 medidas urgentes
+6. **Prevención**: Medidas a largo plazo
+
+Responde en español, sé técnico pero claro. Estructura la respuesta para SOC/DevSecOps."""
+
+# Aproximación conservadora para texto mixto (español, IPs, números)
+CHARS_PER_TOKEN = 3.5
+
+def estimate_tokens(text):
+    """Estimación de tokens de un texto (sin tokenizador en la Lambda)"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+def row_columns(rows):
+    """Columnas en orden de aparición"""
+    columns = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+def encode_table(rows, columns):
+    """Tabla compacta: cabecera y una línea por fila"""
+    lines = ['|'.join(columns)]
+    lines += ['|'.join(format_value(row.get(column)) for column in columns) for row in rows]
+    return '\n'.join(lines)
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def summarize_rows(rows, columns):
+    """Resumen agregado de las filas que no caben en la tabla"""
+    lines = [f"... y {len(rows)} filas más, resumidas:"]
+    for column in columns:
+        values = [row.get(column) for row in rows if row.get(column) is not None]
+        if not values:
+            continue
+        if all(_is_number(value) for value in values):
+            lines.append(
+                f"- {column}: suma={format_value(sum(values))} "
+                f"min={format_value(min(values))} max={format_value(max(values))}"
+            )
+        else:
+            distinct = sorted({str(value) for value in values})
+            lines.append(f"- {column}: {len(distinct)} distintos (min={distinct[0]}, max={distinct[-1]})")
+    return '\n'.join(lines)
+
+def encode_rows(rows, token_budget):
+    """
+    Tabla de las filas dentro del presupuesto: todas si caben, o las K
+    primeras más el resumen del resto (K máximo que cabe, por búsqueda binaria)
+    """
+    columns = row_columns(rows)
+
+    def render(k):
+        text = encode_table(rows[:k], columns)
+        if k < len(rows):
+            text += '\n' + summarize_rows(rows[k:], columns)
+        return text
+
+    text = render(len(rows))
+    if estimate_tokens(text) <= token_budget:
+        return text, len(rows)
+
+    low, high = 0, len(rows) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(render(middle)) <= token_budget:
+            low = middle
+        else:
+            high = middle - 1
+    return render(low), low
+
+def build_analysis_prompt(anomaly, token_budget):
+    """Prompt de análisis cuyo tamaño estimado no supera token_budget"""
+    base = PROMPT_TEMPLATE.format(type=anomaly['type'], severity=anomaly['severity'], count=len(anomaly['data']), data='')
+    data, _ = encode_rows(anomaly['data'], max(0, token_budget - estimate_tokens(base)))
+    return PROMPT_TEMPLATE.format(
+        type=anomaly['type'],
+        severity=anomaly['severity'],
+        count=len(anomaly['data']),
+        data=data
+    )
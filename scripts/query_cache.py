@@ -0,0 +1,57 @@
+"""
+Caché de resultados de consultas de Athena.
+
+La clave (fingerprint) combina el SQL normalizado, la base de datos, el
+reader de los resultados y la ventana de datos que cubre la consulta: los
+límites de la ventana de análisis o de los watermarks, o el día en curso y el
+instante hasta el que llegan sus datos, alineados al intervalo de la
+programación. Así los reintentos, las ejecuciones manuales y las solapadas
+dentro del mismo intervalo reutilizan el resultado mientras no caduque su
+TTL. Se guardan las filas de los resultados pequeños y, del resto, la
+referencia a la ejecución para volver a leer su CSV de S3 sin relanzarla. Las
+entradas se guardan en memoria (persisten entre invocaciones de una Lambda
+caliente) con expulsión LRU por número de entradas, y opcionalmente en S3 o
+disco (state_store).
+"""
+import hashlib
+import re
+
+import state_store
+
+def normalize_query(query):
+    """SQL sin comentarios de línea, espacios redundantes ni ';' final"""
+    query = re.sub(r'--[^\n]*', ' ', query)
+    query = ' '.join(query.split())
+    return query.rstrip(';').strip()
+
+def query_fingerprint(query, database, window, reader=''):
+    """Clave de caché de una consulta sobre una ventana de datos (y leída con reader)"""
+    key = '\n'.join([normalize_query(query), database, str(window), reader])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def execution_reference(execution):
+    """Lo necesario de una ejecución para volver a leer sus resultados"""
+    return {
+        'QueryExecutionId': execution['QueryExecutionId'],
+        'ResultConfiguration': {
+            'OutputLocation': execution.get('ResultConfiguration', {}).get('OutputLocation')
+        }
+    }
+
+class QueryCache(state_store.PersistentCache):
+    document = 'query-cache'
+    stat_names = ('hits', 'misses', 'athena_reused')
+
+    def __init__(self, ttl_seconds=300, max_entries=64, max_rows=1000, location='', s3_client=None):
+        super().__init__(ttl_seconds, max_entries, location, s3_client)
+        self.max_rows = max_rows
+
+    def put(self, fingerprint, rows, query_id=None):
+        """Guarda las filas de una consulta (si no superan max_rows)"""
+        if len(rows) > self.max_rows:
+            return
+        super().put(fingerprint, rows, query_id=query_id)
+
+    def put_execution(self, fingerprint, execution):
+        """Guarda solo la referencia a los resultados de una ejecución"""
+        super().put(fingerprint, None, execution=execution_reference(execution))
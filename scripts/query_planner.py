@@ -0,0 +1,329 @@
+"""
+Planificador de consultas: compila detectores declarativos en una única
+consulta de Athena que lee la partición una sola vez.
+
+Cada detector se describe con un spec:
+    {
+        'name': identificador (prefijo de sus columnas en la consulta combinada),
+        'type' / 'severity': datos de la anomalía que genera,
+        'filter': predicado SQL sobre los registros,
+        'group_by': columnas de agrupación,
+        'aggregates': [(alias, función, expresión)] con función en AGGREGATE_FUNCTIONS,
+        'having': condición sobre los alias con la forma '{alias} > N',
+        'order_by': alias para ordenar de forma descendente,
+        'limit': máximo de filas
+    }
+
+La consulta combinada usa GROUPING SETS (un conjunto por cada group_by
+distinto) y agregación condicional (CASE WHEN filtro THEN valor END), de
+modo que añadir un detector no añade bytes escaneados.
+"""
+from datetime import datetime, timedelta, timezone
+
+AGGREGATE_FUNCTIONS = {
+    'COUNT': 'COUNT({value})',
+    'COUNT_DISTINCT': 'COUNT(DISTINCT {value})',
+    'SUM': 'SUM({value})',
+    'AVG': 'AVG({value})',
+    'MIN': 'MIN({value})',
+    'MAX': 'MAX({value})'
+}
+
+BASE_FILTER = "log_status = 'OK'"
+
+TODAY_PARTITION_FILTER = """year = CAST(year(current_date) AS varchar)
+        AND month = LPAD(CAST(month(current_date) AS varchar), 2, '0')
+        AND day = LPAD(CAST(day(current_date) AS varchar), 2, '0')"""
+
+# Duración máxima de un registro de flow logs (max_aggregation_interval)
+MAX_AGGREGATION_SECONDS = 600
+
+def window_hours(start, end):
+    """
+    Horas UTC con registros de la ventana [start, end) en epoch. La tabla de
+    texto se particiona por la hora de entrega y la compactada por la hora de
+    inicio del registro; ninguna es anterior a start menos la duración máxima
+    de un registro, ni posterior a end.
+    """
+    first = start - MAX_AGGREGATION_SECONDS
+    hour = datetime.fromtimestamp(first - first % 3600, tz=timezone.utc)
+    last = datetime.fromtimestamp(end, tz=timezone.utc)
+    hours = []
+    while hour <= last:
+        hours.append(hour)
+        hour += timedelta(hours=1)
+    return hours
+
+def window_partition_filter(start, end):
+    """Particiones year/month/day/hour de la ventana (cruza medianoche y fin de mes)"""
+    days = {}
+    for hour in window_hours(start, end):
+        days.setdefault(hour.date(), []).append(f"'{hour:%H}'")
+    clauses = [
+        f"(year = '{day:%Y}' AND month = '{day:%m}' AND day = '{day:%d}' AND hour IN ({', '.join(hours)}))"
+        for day, hours in days.items()
+    ]
+    return '(' + '\n        OR '.join(clauses) + ')'
+
+def day_partition_filter(day):
+    """Particiones year/month/day de un día (date) con todas sus horas"""
+    return f"(year = '{day:%Y}' AND month = '{day:%m}' AND day = '{day:%d}')"
+
+def window_filter(start, end):
+    """Filtro de los detectores para una ventana: horas de partición y registros que la solapan"""
+    return f"""{window_partition_filter(start, end)}
+        AND "end" >= {start} AND start < {end}"""
+
+# Mismos detectores que lambda_function.py (y sus consultas de athena.tf), en
+# forma declarativa. La consulta de protocolos inusuales de athena.tf no tiene
+# umbral y no genera alertas en ningún plan
+DETECTOR_SPECS = [
+    {
+        'name': 'port_scanning',
+        'type': 'Port Scanning',
+        'severity': 'HIGH',
+        'filter': "action = 'REJECT'",
+        'group_by': ['srcaddr'],
+        'aggregates': [
+            ('unique_ports', 'COUNT_DISTINCT', 'dstport'),
+            ('total_attempts', 'COUNT', '1'),
+            ('first_attempt', 'MIN', 'to_iso8601(from_unixtime(start))'),
+            ('last_attempt', 'MAX', 'to_iso8601(from_unixtime("end"))')
+        ],
+        'having': '{unique_ports} > 50',
+        'order_by': 'unique_ports',
+        'limit': 20
+    },
+    {
+        'name': 'ddos',
+        'type': 'DDoS Attack',
+        'severity': 'CRITICAL',
+        'filter': "action IN ('ACCEPT','REJECT')",
+        'group_by': ['dstaddr'],
+        'aggregates': [
+            ('total_packets', 'SUM', 'packets'),
+            ('total_bytes', 'SUM', 'bytes'),
+            ('unique_sources', 'COUNT_DISTINCT', 'srcaddr'),
+            ('attack_start', 'MIN', 'to_iso8601(from_unixtime(start))'),
+            ('attack_end', 'MAX', 'to_iso8601(from_unixtime("end"))')
+        ],
+        'having': '{total_packets} > 100000 OR {unique_sources} > 100',
+        'order_by': 'total_packets',
+        'limit': 10
+    },
+    {
+        'name': 'data_exfiltration',
+        'type': 'Data Exfiltration',
+        'severity': 'HIGH',
+        'filter': "action = 'ACCEPT' AND dstport IN (80, 443, 21, 22)",
+        'group_by': ['srcaddr', 'dstaddr'],
+        'aggregates': [
+            ('total_bytes', 'SUM', 'bytes'),
+            ('connection_count', 'COUNT', '1'),
+            ('avg_bytes_per_connection', 'AVG', 'bytes'),
+            ('first_connection', 'MIN', 'to_iso8601(from_unixtime(start))'),
+            ('last_connection', 'MAX', 'to_iso8601(from_unixtime("end"))')
+        ],
+        'having': '{total_bytes} > 25000000',
+        'order_by': 'total_bytes',
+        'limit': 10
+    }
+]
+
+# Umbrales fijos de los detectores principales (alias -> valor): una fila es
+# anómala si supera alguno. Son los de los 'having' de DETECTOR_SPECS
+DETECTOR_THRESHOLDS = {
+    'port_scanning': {'unique_ports': 50},
+    'ddos': {'total_packets': 100000, 'unique_sources': 100},
+    'data_exfiltration': {'total_bytes': 25000000}
+}
+
+def having_clause(thresholds):
+    """Condición 'having' de un spec para unos umbrales {alias: valor}"""
+    return ' OR '.join(f"{{{alias}}} > {value}" for alias, value in thresholds.items())
+
+def apply_thresholds(spec, thresholds, limit=None):
+    """Copia del spec con otros umbrales (y, opcionalmente, otro límite de filas)"""
+    spec = dict(spec, having=having_clause(thresholds))
+    if limit is not None:
+        spec['limit'] = limit
+    return spec
+
+FLOW_LOG_COLUMNS = [
+    'version', 'account_id', 'interface_id', 'srcaddr', 'dstaddr',
+    'srcport', 'dstport', 'protocol', 'packets', 'bytes',
+    'start', '"end"', 'action', 'log_status'
+]
+
+def _ipv4_text(column):
+    """Dirección IPv4 guardada como bigint (tabla compactada) en notación decimal con puntos"""
+    octets = [f"{column} / 16777216", f"{column} / 65536 % 256", f"{column} / 256 % 256", f"{column} % 256"]
+    return "concat(" + ", '.', ".join(f"CAST({octet} AS varchar)" for octet in octets) + ")"
+
+def flow_logs_source(table, columnar_table=None, day=None, compacted_hours=0):
+    """
+    Origen de los registros de un día para las consultas de los detectores.
+    Si hay horas compactadas (compaction.py) se leen de la tabla Parquet y el
+    resto del día de la tabla de texto; las columnas son las de la tabla de
+    texto, así que las consultas no cambian.
+    """
+    if not columnar_table or not compacted_hours:
+        return table
+
+    partition = f"year = '{day:%Y}' AND month = '{day:%m}' AND day = '{day:%d}'"
+    cutoff = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()) + compacted_hours * 3600
+    columnar_columns = [
+        f"COALESCE({column}_text, {_ipv4_text(column)}) AS {column}"
+        if column in ('srcaddr', 'dstaddr') else column
+        for column in FLOW_LOG_COLUMNS
+    ]
+
+    raw_branch = ''
+    if compacted_hours < 24:
+        # Las particiones por hora de la tabla de texto son la hora de entrega:
+        # los registros posteriores al corte están en esa hora o después
+        raw_branch = f"""
+        UNION ALL
+        SELECT {', '.join(FLOW_LOG_COLUMNS)}, year, month, day, hour
+        FROM {table}
+        WHERE {partition} AND hour >= '{compacted_hours:02d}' AND start >= {cutoff}"""
+
+    return f"""(
+        SELECT {', '.join(columnar_columns)}, year, month, day, hour
+        FROM {columnar_table}
+        WHERE {partition} AND hour < '{compacted_hours:02d}'{raw_branch}
+    ) AS flow_logs"""
+
+def _aggregate_sql(function, expression, condition=None):
+    """Expresión de agregado; con condition se vuelve agregación condicional"""
+    value = expression
+    if condition:
+        value = f"CASE WHEN {condition} THEN {expression} END"
+    elif function == 'COUNT':
+        value = '*'
+    return AGGREGATE_FUNCTIONS[function].format(value=value)
+
+def _column(spec, alias):
+    return f"{spec['name']}__{alias}"
+
+def compile_detector_query(spec, table='vpc_flow_logs', partition_filter=TODAY_PARTITION_FILTER):
+    """Consulta independiente de un detector (equivalente a los build_*_query de lambda_function)"""
+    keys = ', '.join(spec['group_by'])
+    aggregates = ',\n        '.join(
+        f"{_aggregate_sql(function, expression)} AS {alias}"
+        for alias, function, expression in spec['aggregates']
+    )
+    having = ''
+    if spec.get('having'):
+        having = 'WHERE ' + spec['having'].format(**{alias: alias for alias, _, _ in spec['aggregates']})
+
+    return f"""
+    SELECT * FROM (
+        SELECT
+        {keys},
+        {aggregates}
+        FROM {table}
+        WHERE
+            {BASE_FILTER}
+            AND {spec['filter']}
+            AND {partition_filter}
+        GROUP BY {keys}
+    )
+    {having}
+    ORDER BY {spec['order_by']} DESC
+    LIMIT {spec['limit']};
+    """
+
+def grouping_sets(specs):
+    """Columnas de agrupación (en orden estable) y conjuntos distintos"""
+    columns = []
+    sets = []
+    for spec in specs:
+        for column in spec['group_by']:
+            if column not in columns:
+                columns.append(column)
+        if tuple(spec['group_by']) not in sets:
+            sets.append(tuple(spec['group_by']))
+    return columns, sets
+
+def grouping_id(columns, grouping_set):
+    """Valor de GROUPING(columnas...) para un conjunto: bit a 1 si la columna no agrupa"""
+    return sum(
+        1 << (len(columns) - 1 - i)
+        for i, column in enumerate(columns)
+        if column not in grouping_set
+    )
+
+def compile_combined_query(specs=DETECTOR_SPECS, table='vpc_flow_logs', partition_filter=TODAY_PARTITION_FILTER):
+    """
+    Una sola consulta para todos los detectores. Cada fila del resultado trae
+    la columna <detector>__match que indica a qué detector pertenece.
+    """
+    columns, sets = grouping_sets(specs)
+    column_list = ', '.join(columns)
+
+    aggregates = ',\n            '.join(
+        f"{_aggregate_sql(function, expression, spec['filter'])} AS {_column(spec, alias)}"
+        for spec in specs
+        for alias, function, expression in spec['aggregates']
+    )
+
+    matches = []
+    for spec in specs:
+        condition = f"grouping_id = {grouping_id(columns, spec['group_by'])}"
+        if spec.get('having'):
+            having = spec['having'].format(**{alias: _column(spec, alias) for alias, _, _ in spec['aggregates']})
+            condition = f"{condition} AND ({having})"
+        matches.append((spec, condition))
+
+    match_columns = ',\n        '.join(
+        f"COALESCE({condition}, false) AS {spec['name']}__match"
+        for spec, condition in matches
+    )
+    any_match = '\n        OR '.join(f"({condition})" for _, condition in matches)
+    any_filter = ' OR '.join(f"({spec['filter']})" for spec in specs)
+    grouping = ', '.join(f"({', '.join(grouping_set)})" for grouping_set in sets)
+
+    return f"""
+    WITH combined AS (
+        SELECT
+            GROUPING({column_list}) AS grouping_id,
+            {column_list},
+            {aggregates}
+        FROM {table}
+        WHERE
+            {BASE_FILTER}
+            AND ({any_filter})
+            AND {partition_filter}
+        GROUP BY GROUPING SETS ({grouping})
+    )
+    SELECT
+        *,
+        {match_columns}
+    FROM combined
+    WHERE
+        {any_match};
+    """
+
+def split_combined_results(rows, specs=DETECTOR_SPECS):
+    """
+    Reparte las filas de la consulta combinada por detector, con las mismas
+    columnas, orden y límite que su consulta independiente
+    """
+    results = {spec['name']: [] for spec in specs}
+
+    for row in rows:
+        for spec in specs:
+            if not row.get(f"{spec['name']}__match"):
+                continue
+            item = {column: row.get(column) for column in spec['group_by']}
+            for alias, _, _ in spec['aggregates']:
+                item[alias] = row.get(_column(spec, alias))
+            results[spec['name']].append(item)
+
+    for spec in specs:
+        items = results[spec['name']]
+        items.sort(key=lambda item: item[spec['order_by']] or 0, reverse=True)
+        results[spec['name']] = items[:spec['limit']]
+
+    return results
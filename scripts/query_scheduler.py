@@ -0,0 +1,84 @@
+"""
+Planificación de las consultas de Athena con el presupuesto de la invocación.
+
+La Lambda tiene un tiempo máximo y las consultas no pueden gastarlo entero:
+si el timeout llega mientras se espera a Athena no se publica ninguna alerta
+y las ejecuciones siguen corriendo (y facturando) sin nadie que las lea.
+
+- Prioridad: las consultas se lanzan, y sus resultados se leen cuando
+  terminan a la vez, por severidad del detector (CRITICAL antes que HIGH).
+- Admisión: las consultas CRITICAL se lanzan mientras quede tiempo; el
+  resto solo si quedan al menos min_query_seconds hasta el deadline. Las
+  demás se omiten ('skipped').
+- Cancelación: cada consulta tiene como deadline el menor entre su espera
+  máxima y el deadline de la invocación (que ya descuenta el tiempo reservado
+  para publicar). Al pasar se detiene con stop_query_execution ('cancelled').
+
+El deadline lo fija lambda_handler con begin(); sin deadline (replay, pruebas)
+solo se aplica la espera máxima de cada consulta.
+"""
+import threading
+import time
+
+import telemetry
+
+SEVERITY_PRIORITY = {'CRITICAL': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+# Una consulta no CRITICAL solo se lanza si quedan al menos estos segundos hasta el deadline
+MIN_QUERY_SECONDS = 10
+
+def priority_of(severity):
+    """Orden de una severidad (sin severidad, al final)"""
+    return SEVERITY_PRIORITY.get(severity, len(SEVERITY_PRIORITY))
+
+def priority(spec):
+    """Orden de una consulta: severidad de su detector"""
+    return priority_of(spec.get('severity'))
+
+class QueryScheduler:
+    def __init__(self, min_query_seconds=MIN_QUERY_SECONDS):
+        self.min_query_seconds = min_query_seconds
+        self.lock = threading.Lock()
+        self.begin()
+
+    def begin(self, deadline=None):
+        """Nueva invocación: deadline (monotonic) para todas sus consultas, o None"""
+        self.deadline = deadline
+        self.skipped = []
+        self.cancelled = []
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def order(self, specs):
+        """Consultas en orden de prioridad (estable: a igual severidad, el orden dado)"""
+        return sorted(specs, key=priority)
+
+    def admit(self, spec):
+        """False (y la consulta queda como omitida) si no cabe antes del deadline"""
+        remaining = self.remaining()
+        minimum = 0 if priority(spec) == SEVERITY_PRIORITY['CRITICAL'] else self.min_query_seconds
+        if remaining is None or remaining > minimum:
+            return True
+        telemetry.console(f"⏭️ {spec['description']}: omitida, quedan {max(0, remaining):.0f}s hasta el deadline")
+        with self.lock:
+            self.skipped.append(spec['name'])
+        return False
+
+    def query_deadline(self, submitted_at, max_wait_time):
+        """Deadline (monotonic) de una consulta lanzada en submitted_at"""
+        deadline = submitted_at + max_wait_time
+        return deadline if self.deadline is None else min(deadline, self.deadline)
+
+    def cancel(self, client, query_id, spec):
+        """Detiene una consulta que ha superado su deadline"""
+        with self.lock:
+            self.cancelled.append(spec['name'])
+        try:
+            client.stop_query_execution(QueryExecutionId=query_id)
+            telemetry.console(f"🛑 {spec['description']}: cancelada al superar su deadline ({query_id})")
+        except Exception as e:
+            telemetry.console(f"⚠️ No se pudo cancelar {spec['description']} ({query_id}): {str(e)}")
+
+    def summary(self):
+        with self.lock:
+            return {'skipped': list(self.skipped), 'cancelled': list(self.cancelled)}
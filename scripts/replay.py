@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Reanálisis histórico (backfill / replay forense) de un rango de días u horas.
+
+El rango se divide en unidades alineadas con las particiones de los flow
+logs: una unidad es una hora (prefijo .../YYYY/MM/DD/HH/ o partición
+year/month/day/hour), así que cada registro pertenece a una sola unidad y
+las unidades se procesan de forma independiente:
+
+- motor local: un proceso por unidad (ProcessPoolExecutor con --workers
+  procesos) que lee los objetos de la hora y retorna el estado exacto de los
+  agregadores de local_engine
+- Athena: las consultas parciales de la detección incremental limitadas a la
+  partición de la hora, con como mucho --workers unidades a la vez (tres
+  consultas por unidad)
+
+Cada unidad terminada se guarda en el checkpoint (state_store) junto con el
+manifiesto de unidades completadas: al relanzar el mismo comando se retoma
+donde se quedó. Las anomalías se escriben en --output (JSON lines, no SNS) a
+medida que llegan: las de cada hora ('scope': 'hour') y, cuando están todas
+las horas de un día, las del día fusionando sus estados ('scope': 'day', lo
+que habría visto la detección programada con current_date).
+
+Con --index (motor local) no se leen los objetos que el índice de objetos
+(object_index.py) marca sin registros ACCEPT/REJECT.
+
+Uso:
+  # Última semana en S3 con 8 procesos
+  python replay.py --start 2026-10-11 --end 2026-10-17 --bucket <bucket> \\
+      --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/ --workers 8 --output semana.jsonl
+  # Unas horas de ficheros locales con la estructura de S3 (flowlog_generator.py)
+  python replay.py --start 2026-10-18T20 --end 2026-10-18T23 --root /tmp/flow-logs \\
+      --prefix AWSLogs/<cuenta>/vpcflowlogs/<región>/ --output horas.jsonl
+  # Athena (DATABASE_NAME, TABLE_NAME y RESULTS_BUCKET como en la Lambda)
+  python replay.py --engine athena --start 2026-10-11 --end 2026-10-17 --workers 4 --output semana.jsonl
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+import local_engine
+import state_store
+
+# Las consultas parciales acotan start; en replay la partición define la unidad
+UNBOUNDED_START = (-1, 2 ** 63 - 1)
+
+def parse_hour(value, end=False):
+    """Hora UTC de YYYY-MM-DD o YYYY-MM-DDTHH (un día como fin incluye su última hora)"""
+    if len(value) == 10:
+        moment = datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        return moment + timedelta(hours=23) if end else moment
+    return datetime.strptime(value, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc)
+
+def work_units(start, end):
+    """Horas (epoch) de start a end, ambas incluidas"""
+    first, last = int(start.timestamp()), int(end.timestamp())
+    return list(range(first - first % 3600, last + 1, 3600))
+
+def unit_name(hour):
+    return f"{datetime.fromtimestamp(hour, tz=timezone.utc):%Y-%m-%dT%H}"
+
+def unit_day(hour):
+    return unit_name(hour)[:10]
+
+def partition_filter(hour):
+    """
+    Filtro de la partición de una hora. No se usa window_partition_filter:
+    añade la hora anterior para los registros entregados tarde y las unidades
+    contiguas contarían dos veces esa partición
+    """
+    moment = datetime.fromtimestamp(hour, tz=timezone.utc)
+    return f"(year = '{moment:%Y}' AND month = '{moment:%m}' AND day = '{moment:%d}' AND hour = '{moment:%H}')"
+
+def run_id(source, engine, units):
+    """Identificador estable de un replay: el mismo comando retoma el mismo checkpoint"""
+    text = json.dumps([source, engine, units[0], units[-1]], sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+_process_state = {}
+
+def process_s3_client(source, location):
+    """Cliente S3 del proceso de trabajo, si los flow logs o el checkpoint están en S3"""
+    if 's3_client' not in _process_state:
+        _process_state['s3_client'] = None
+        if (not source.get('root') or state_store.is_s3_location(location)
+                or state_store.is_s3_location(source.get('index') or '')):
+            import aws_clients
+            _process_state['s3_client'] = aws_clients.get_client('s3')
+    return _process_state['s3_client']
+
+def process_ip_lists(source, s3_client):
+    """Allowlist del proceso de trabajo (se compila una vez por proceso)"""
+    if 'ip_lists' not in _process_state:
+        _process_state['ip_lists'] = None
+        if source.get('allowlist'):
+            import ip_index
+            _process_state['ip_lists'] = ip_index.IPLists.load(source['allowlist'], '', s3_client)
+    return _process_state['ip_lists']
+
+def unit_skipped_keys(source, prefix, s3_client):
+    """Objetos de la hora sin tráfico según el índice de objetos (vacío sin --index)"""
+    if not source.get('index'):
+        return set()
+    import object_index
+
+    index = object_index.load_hour(source['index'], prefix.rstrip('/'), s3_client)
+    return index.skipped_keys(actions=object_index.ACTIONS)
+
+def unit_objects(source, hour, s3_client):
+    """Bloques de líneas de cada objeto de la partición de una hora"""
+    prefix = f"{datetime.fromtimestamp(hour, tz=timezone.utc):%Y/%m/%d/%H}/"
+    if source['prefix'].strip('/'):
+        prefix = f"{source['prefix'].strip('/')}/{prefix}"
+    skipped = unit_skipped_keys(source, prefix, s3_client)
+    if source.get('root'):
+        directory = os.path.join(source['root'], prefix)
+        for root, _, names in sorted(os.walk(directory)):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                if name.endswith('.log.gz') and os.path.relpath(path, source['root']) not in skipped:
+                    yield local_engine.iter_file_chunks(path)
+        return
+    for key in local_engine.list_flow_log_objects(s3_client, source['bucket'], prefix):
+        if key not in skipped:
+            yield local_engine.iter_s3_object_chunks(s3_client, source['bucket'], key)
+
+def local_unit_aggregators(source, hour, s3_client):
+    """Agregadores de una hora con el motor local: (agregadores, objetos, registros)"""
+    ip_lists = process_ip_lists(source, s3_client)
+    aggregators = local_engine.create_aggregators('exact')
+    objects = 0
+    records = 0
+    for chunks in unit_objects(source, hour, s3_client):
+        objects += 1
+        records += local_engine.aggregate_chunks(chunks, aggregators, ip_lists=ip_lists)
+    return aggregators, objects, records
+
+def athena_unit_aggregators(hour):
+    """Agregadores de una hora con las consultas parciales de Athena sobre su partición"""
+    import lambda_function
+
+    aggregators = local_engine.create_aggregators('exact')
+    if not lambda_function.update_from_athena_partials(aggregators, *UNBOUNDED_START, partition_filter(hour)):
+        raise RuntimeError(f"consultas parciales incompletas en {unit_name(hour)}")
+    return aggregators, None, None
+
+def build_anomalies(aggregators, **scope):
+    """Anomalías (con el ámbito indicado) del estado acumulado en los agregadores"""
+    import query_planner
+
+    results = local_engine.collect_results(aggregators)
+    return [
+        dict(scope, type=spec['type'], severity=spec['severity'], data=results[spec['name']])
+        for spec in query_planner.DETECTOR_SPECS if results.get(spec['name'])
+    ]
+
+def run_unit(engine, source, location, prefix, hour):
+    """
+    Tarea de una unidad (en un proceso o hilo de trabajo): agrega la hora,
+    guarda su estado en el checkpoint y retorna (hora, anomalías, objetos, registros)
+    """
+    s3_client = process_s3_client(source, location)
+    if engine == 'athena':
+        aggregators, objects, records = athena_unit_aggregators(hour)
+    else:
+        aggregators, objects, records = local_unit_aggregators(source, hour, s3_client)
+    name = unit_name(hour)
+    state_store.save_json(location, f"{prefix}/units/{name}", local_engine.dump_aggregators(aggregators), s3_client)
+    return hour, build_anomalies(aggregators, scope='hour', unit=name), objects, records
+
+def merge_day(source, location, prefix, day, names):
+    """Tarea de fusión de las unidades de un día desde el checkpoint: anomalías del día"""
+    s3_client = process_s3_client(source, location)
+    aggregators = local_engine.create_aggregators('exact')
+    for name in names:
+        state = state_store.load_json(location, f"{prefix}/units/{name}", s3_client) or {}
+        for detector, aggregator in local_engine.load_aggregators(state).items():
+            aggregators[detector].merge(aggregator)
+    return build_anomalies(aggregators, scope='day', day=day, hours=len(names))
+
+class Replay:
+    """
+    Reparte las unidades pendientes en el executor, guarda el manifiesto y
+    escribe las anomalías. Las tareas (agregación, checkpoint de cada unidad y
+    fusión de cada día) corren en el executor: este proceso solo coordina.
+    """
+
+    def __init__(self, units, engine, source, location, name, output, ip_lists=None, s3_client=None):
+        self.units = units
+        self.engine = engine
+        self.source = source
+        self.location = location
+        self.s3_client = s3_client
+        self.prefix = f"replay/{name}"
+        self.output = output
+        self.ip_lists = ip_lists
+        self.manifest = state_store.load_json(location, f"{self.prefix}/manifest", s3_client) or {'units': [], 'days': []}
+        self.stats = {'units': len(units), 'resumed': 0, 'completed': 0, 'failed': 0,
+                      'objects': 0, 'records': 0, 'anomalies': 0}
+
+    def pending(self):
+        done = set(self.manifest['units'])
+        self.stats['resumed'] = sum(1 for hour in self.units if unit_name(hour) in done)
+        return [hour for hour in self.units if unit_name(hour) not in done]
+
+    def day_units(self, day):
+        """Unidades del día si están todas completas y el día no se ha escrito; si no, None"""
+        names = [unit_name(hour) for hour in self.units if unit_day(hour) == day]
+        if day in self.manifest['days'] or not set(names) <= set(self.manifest['units']):
+            return None
+        return names
+
+    def write(self, stream, anomalies):
+        for anomaly in anomalies:
+            if self.ip_lists:
+                anomaly['data'] = list(self.ip_lists.filter_rows(anomaly['data']))
+            stream.write(json.dumps(anomaly) + '\n')
+            self.stats['anomalies'] += 1
+        stream.flush()
+
+    def save_manifest(self):
+        # Se guarda después de escribir las anomalías: una unidad a medias se repite
+        state_store.save_json(self.location, f"{self.prefix}/manifest", self.manifest, self.s3_client)
+
+    def run(self, executor):
+        started_at = time.perf_counter()
+        pending = self.pending()
+        futures = {}
+
+        def submit_day(day):
+            names = self.day_units(day)
+            if names and ('day', day) not in futures.values():
+                futures[executor.submit(merge_day, self.source, self.location, self.prefix, day, names)] = ('day', day)
+
+        with open(self.output, 'a') as stream:
+            for hour in pending:
+                futures[executor.submit(run_unit, self.engine, self.source, self.location, self.prefix, hour)] = ('unit', hour)
+            # Días completados en una ejecución anterior que no llegaron a escribirse
+            for day in sorted({unit_day(hour) for hour in self.units}):
+                submit_day(day)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, key = futures.pop(future)
+                    label = unit_name(key) if kind == 'unit' else key
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"❌ {label}: {str(e)}")
+                        self.stats['failed'] += 1
+                        continue
+
+                    if kind == 'day':
+                        self.write(stream, result)
+                        self.manifest['days'].append(key)
+                        self.save_manifest()
+                        print(f"📅 {key}: {len(result)} anomalías en el día")
+                        continue
+
+                    hour, anomalies, objects, records = result
+                    self.write(stream, anomalies)
+                    self.manifest['units'].append(label)
+                    self.save_manifest()
+                    self.stats['completed'] += 1
+                    self.stats['objects'] += objects or 0
+                    self.stats['records'] += records or 0
+                    print(f"✅ {label} ({self.stats['completed']}/{len(pending)}): {records or 0} registros, "
+                          f"{len(anomalies)} anomalías")
+                    submit_day(unit_day(hour))
+
+        self.stats['seconds'] = round(time.perf_counter() - started_at, 2)
+        if self.stats['records'] and self.stats['seconds']:
+            self.stats['records_per_second'] = round(self.stats['records'] / self.stats['seconds'])
+        return self.stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Reanálisis histórico de un rango de días u horas')
+    parser.add_argument('--start', required=True, help='YYYY-MM-DD o YYYY-MM-DDTHH (UTC)')
+    parser.add_argument('--end', required=True, help='YYYY-MM-DD o YYYY-MM-DDTHH (UTC, incluida)')
+    parser.add_argument('--engine', choices=['local', 'athena'], default='local')
+    parser.add_argument('--bucket', default=os.environ.get('FLOW_LOGS_BUCKET', ''))
+    parser.add_argument('--prefix', default=os.environ.get('FLOW_LOGS_PREFIX', ''), help='Prefijo base de los flow logs')
+    parser.add_argument('--root', help='Directorio local con la estructura de claves de S3 (en lugar de --bucket)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='Procesos (local) o unidades simultáneas (Athena)')
+    parser.add_argument('--output', required=True, help='Fichero JSON lines de anomalías (se añade al final)')
+    parser.add_argument('--checkpoint', help='Ubicación del checkpoint (directorio o s3://), por defecto <output>.state')
+    parser.add_argument('--allowlist', default='', help='CIDRs o fichero/URI de orígenes que no cuentan')
+    parser.add_argument('--denylist', default='', help='CIDRs o fichero/URI de rangos que se marcan')
+    parser.add_argument('--index', default='', help='Índice de objetos (directorio o s3://) para no leer objetos sin tráfico')
+    args = parser.parse_args()
+
+    units = work_units(parse_hour(args.start), parse_hour(args.end, end=True))
+    if not units:
+        print("❌ Rango vacío")
+        return 1
+    source = {'bucket': args.bucket, 'prefix': args.prefix, 'root': args.root, 'allowlist': args.allowlist}
+    if args.index:
+        source['index'] = args.index
+    location = args.checkpoint or f"{args.output}.state"
+    s3_client = None
+    if state_store.is_s3_location(location) or args.denylist.startswith('s3://'):
+        import aws_clients
+        s3_client = aws_clients.get_client('s3')
+
+    ip_lists = None
+    if args.denylist:
+        import ip_index
+        ip_lists = ip_index.IPLists.load('', args.denylist, s3_client)
+
+    name = run_id(source if args.engine == 'local' else os.environ.get('TABLE_NAME', ''), args.engine, units)
+    replay = Replay(units, args.engine, source, location, name, args.output, ip_lists, s3_client)
+    print(f"🔁 Replay {name}: {len(units)} horas de {unit_name(units[0])} a {unit_name(units[-1])} "
+          f"({args.engine}, {args.workers} workers, checkpoint {location})")
+
+    if args.engine == 'local':
+        if not args.root and not args.bucket:
+            print("❌ Indica --bucket o --root")
+            return 1
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            stats = replay.run(executor)
+    else:
+        if args.allowlist:
+            os.environ['IP_ALLOWLIST'] = args.allowlist
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            stats = replay.run(executor)
+
+    print(f"📊 Replay: {json.dumps(stats)}")
+    return 0 if not stats['failed'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
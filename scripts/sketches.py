@@ -0,0 +1,320 @@
+"""
+Sketches de memoria acotada para el motor local de detección.
+
+- HyperLogLog: COUNT(DISTINCT x) con error relativo ~1.04/sqrt(2^p).
+- CountMinSketch: SUM(w) por clave; sobreestima como máximo e/width * N
+  con probabilidad 1 - e^-depth (N = suma total de pesos).
+- SpaceSaving: top-K claves por peso; toda clave con peso > N/capacity
+  está garantizada en el resumen y su conteo sobreestima como mucho N/capacity.
+- KeyedDistinct: SpaceSaving cuyas claves llevan su propio HyperLogLog
+  (distintos por srcaddr o por dstaddr) con memoria capacity * 2^p bytes.
+
+Todos se combinan con merge() y se serializan con to_dict()/from_dict()
+(JSON), por lo que pueden persistirse y fusionarse entre invocaciones.
+
+Cotas frente a los umbrales fijos de los detectores. Cerca del umbral el
+estimador usa linear counting, cuya desviación típica es ≈ n / sqrt(2m):
+- Port scanning (> 50 puertos, p=12, m=4096): ≈ 0.55 puertos. Memoria
+  fija de 4096 orígenes x 4 KB = 16 MB.
+- DDoS (> 100 fuentes, p=14, m=16384): ≈ 0.55 fuentes. Memoria fija de
+  1024 destinos x 16 KB = 16 MB.
+- Exfiltración (> 25 MB): el total reportado es min(SpaceSaving, CountMin),
+  ambos sobreestiman; con width=2^16 el exceso es < 4.2e-5 * N con
+  probabilidad 1 - e^-4 por par, y el resumen (4096 pares) garantiza
+  cualquier par con más de N/4096 bytes.
+"""
+import base64
+import math
+
+import numpy as np
+
+HLL_PRECISION = 10
+KEYED_CAPACITY = 4096
+CMS_WIDTH = 1 << 16
+CMS_DEPTH = 4
+SPACE_SAVING_CAPACITY = 4096
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+def splitmix64(values):
+    """Mezcla de 64 bits (splitmix64) vectorizada sobre arrays uint64"""
+    z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+def hash64(values):
+    """
+    Hash estable de 64 bits (no depende de PYTHONHASHSEED, así que los
+    sketches serializados se pueden fusionar entre procesos). Acepta arrays
+    de enteros o de bytes (las IPs tal como salen del parser).
+
+    El hash de bytes solo depende del valor y su longitud, no del ancho del
+    array (S16, S30, dtype=bytes...): cada lote o shard puede tener otro.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return splitmix64(values.astype(np.int64).view(np.uint64))
+
+    values = values.astype(bytes)
+    width = max(8, -(-values.dtype.itemsize // 8) * 8)
+    lanes = values.astype(f'S{width}').view(np.uint64).reshape(len(values), width // 8)
+    lengths = np.char.str_len(values).astype(np.uint64)
+    used = (lengths + np.uint64(7)) // np.uint64(8)
+    hashed = np.zeros(len(values), dtype=np.uint64)
+    for position, lane in enumerate(lanes.T):
+        # Las palabras de relleno (más allá del valor) no cambian el hash
+        hashed = np.where(used > position, splitmix64(hashed ^ lane), hashed)
+    return splitmix64(hashed ^ lengths)
+
+def hll_positions(hashes, precision):
+    """Registro y rango (posición del primer 1) de cada hash para HyperLogLog"""
+    hashes = hashes.astype(np.uint64)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    remainder = ((hashes << np.uint64(precision)) & _MASK64) >> np.uint64(32)
+    # frexp es exacto para enteros de 32 bits: rango = 33 - longitud en bits
+    _, bit_length = np.frexp(remainder.astype(np.float64))
+    return index, (33 - bit_length).astype(np.uint8)
+
+def hll_estimate(registers):
+    """Estimador HyperLogLog con corrección de rango bajo (linear counting)"""
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+def _encode(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode()
+
+def _decode(text, dtype, shape):
+    return np.frombuffer(base64.b64decode(text), dtype=dtype).reshape(shape).copy()
+
+class HyperLogLog:
+    """Conteo aproximado de distintos con 2^p registros de un byte"""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        index, rank = hll_positions(hash64(values), self.precision)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        return int(round(float(hll_estimate(self.registers))))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': _encode(self.registers)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = _decode(data['registers'], np.uint8, -1)
+        return sketch
+
+class CountMinSketch:
+    """Suma aproximada de pesos por clave en una tabla depth x width fija"""
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, hashes):
+        for row in range(self.depth):
+            yield row, (splitmix64(hashes ^ np.uint64(row + 1)) % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, keys, weights):
+        hashes = hash64(keys)
+        weights = np.asarray(weights, dtype=np.int64)
+        for row, columns in self._columns(hashes):
+            np.add.at(self.table[row], columns, weights)
+        self.total += int(weights.sum())
+
+    def estimate(self, keys):
+        hashes = hash64(keys)
+        return np.min([self.table[row][columns] for row, columns in self._columns(hashes)], axis=0)
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth, 'total': self.total, 'table': _encode(self.table)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['width'], data['depth'])
+        sketch.table = _decode(data['table'], np.int64, (data['depth'], data['width']))
+        sketch.total = data['total']
+        return sketch
+
+class SpaceSaving:
+    """
+    Heavy hitters ponderados. Cada lote se agrega primero por clave y se
+    fusiona como un resumen exacto (merge de Space-Saving), de modo que el
+    coste por lote es proporcional a las claves únicas, no a los registros.
+    """
+
+    def __init__(self, capacity=SPACE_SAVING_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+
+    def min_count(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def update(self, keys, weights):
+        """Añade pesos ya agregados por clave (claves únicas)"""
+        counts = dict(zip(keys, (int(w) for w in weights)))
+        self.total += sum(counts.values())
+        self._merge_counts(counts, {}, 0)
+
+    def merge(self, other):
+        self.total += other.total
+        self._merge_counts(other.counts, other.errors, other.min_count())
+        return self
+
+    def _merge_counts(self, counts, errors, other_min):
+        own_min = self.min_count()
+        merged_counts = {}
+        merged_errors = {}
+        for key in self.counts.keys() | counts.keys():
+            # Una clave ausente de un resumen lleno pudo tener hasta su mínimo
+            own = self.counts.get(key)
+            other = counts.get(key)
+            merged_counts[key] = (own if own is not None else own_min) + (other if other is not None else other_min)
+            merged_errors[key] = (
+                (self.errors.get(key, 0) if own is not None else own_min)
+                + (errors.get(key, 0) if other is not None else other_min)
+            )
+
+        if len(merged_counts) > self.capacity:
+            kept = sorted(merged_counts, key=merged_counts.get, reverse=True)[:self.capacity]
+            merged_counts = {key: merged_counts[key] for key in kept}
+            merged_errors = {key: merged_errors[key] for key in kept}
+        self.counts = merged_counts
+        self.errors = merged_errors
+
+    def top(self, k=None):
+        """[(clave, conteo, error)] ordenado por conteo descendente"""
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(key, count, self.errors.get(key, 0)) for key, count in items]
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'items': [[list(key) if isinstance(key, tuple) else key, count, self.errors.get(key, 0)]
+                      for key, count in self.counts.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.total = data['total']
+        for key, count, error in data['items']:
+            key = tuple(key) if isinstance(key, list) else key
+            sketch.counts[key] = count
+            sketch.errors[key] = error
+        return sketch
+
+class KeyedDistinct:
+    """
+    Distintos por clave con memoria fija: SpaceSaving sobre las claves
+    (ponderado por actividad) donde cada clave seguida ocupa una fila de una
+    matriz de registros HyperLogLog de capacity x 2^p bytes. Una clave
+    expulsada pierde su fila; si reaparece empieza de cero, lo que solo
+    afecta a claves con actividad < N/capacity.
+    """
+
+    def __init__(self, capacity=KEYED_CAPACITY, precision=HLL_PRECISION):
+        self.capacity = capacity
+        self.precision = precision
+        self.heavy = SpaceSaving(capacity)
+        self.matrix = np.zeros((capacity, 1 << precision), dtype=np.uint8)
+        self.slots = {}
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def _sync_slots(self):
+        """Libera las filas de claves expulsadas y asigna fila a las nuevas"""
+        for key in [key for key in self.slots if key not in self.heavy.counts]:
+            slot = self.slots.pop(key)
+            self.matrix[slot] = 0
+            self.free.append(slot)
+        for key in self.heavy.counts:
+            if key not in self.slots:
+                self.slots[key] = self.free.pop()
+
+    def add(self, keys, values, weights=None):
+        """
+        keys: clave de cada registro (array de bytes/str); values: valor cuyo
+        cardinal se estima; weights: actividad para el ranking (por defecto 1)
+        """
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        if weights is None:
+            totals = np.bincount(inverse, minlength=len(unique_keys))
+        else:
+            totals = np.zeros(len(unique_keys), dtype=np.int64)
+            np.add.at(totals, inverse, np.asarray(weights, dtype=np.int64))
+
+        decoded = [key.decode() if isinstance(key, bytes) else str(key) for key in unique_keys.tolist()]
+        self.heavy.update(decoded, totals)
+        self._sync_slots()
+
+        slot_of_key = np.array([self.slots.get(key, -1) for key in decoded], dtype=np.int64)
+        row_slots = slot_of_key[inverse]
+        tracked = row_slots >= 0
+        index, rank = hll_positions(hash64(np.asarray(values)[tracked]), self.precision)
+        np.maximum.at(self.matrix, (row_slots[tracked], index), rank)
+
+    def count(self, key):
+        slot = self.slots.get(key)
+        return 0 if slot is None else int(round(float(hll_estimate(self.matrix[slot]))))
+
+    def items(self):
+        """[(clave, distintos estimados, actividad)]"""
+        return [(key, self.count(key), count) for key, count, _ in self.heavy.top()]
+
+    def merge(self, other):
+        self.heavy.merge(other.heavy)
+        self._sync_slots()
+        for key, other_slot in other.slots.items():
+            slot = self.slots.get(key)
+            if slot is not None:
+                np.maximum(self.matrix[slot], other.matrix[other_slot], out=self.matrix[slot])
+        return self
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'precision': self.precision,
+            'heavy': self.heavy.to_dict(),
+            'registers': {key: _encode(self.matrix[slot]) for key, slot in self.slots.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'], data['precision'])
+        sketch.heavy = SpaceSaving.from_dict(data['heavy'])
+        sketch._sync_slots()
+        for key, value in data['registers'].items():
+            if key in sketch.slots:
+                sketch.matrix[sketch.slots[key]] = _decode(value, np.uint8, -1)
+        return sketch
+
+def relative_error(precision=HLL_PRECISION):
+    """Error relativo típico de HyperLogLog en rango alto"""
+    return 1.04 / math.sqrt(1 << precision)
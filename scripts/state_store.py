@@ -0,0 +1,183 @@
+"""
+Persistencia de estado JSON (checkpoints, cachés) en S3 o en disco.
+
+La ubicación es un URI s3://bucket/prefijo o una ruta de directorio local
+(útil en tests y ejecuciones manuales). Los documentos se guardan
+comprimidos con gzip porque el estado de los sketches es muy repetitivo.
+
+PersistentCache es la base de las cachés (query_cache, analysis_cache):
+memoria con TTL y expulsión LRU, guardada como un único documento.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import telemetry
+
+def is_s3_location(location):
+    return location.startswith('s3://')
+
+def _s3_key(location, name):
+    bucket, _, prefix = location[len('s3://'):].partition('/')
+    prefix = prefix.strip('/')
+    return bucket, f"{prefix}/{name}.json.gz" if prefix else f"{name}.json.gz"
+
+def _local_path(location, name):
+    return os.path.join(location, f"{name}.json.gz")
+
+def load_json(location, name, s3_client=None):
+    """Lee un documento; retorna None si no existe"""
+    try:
+        if is_s3_location(location):
+            bucket, key = _s3_key(location, name)
+            body = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        else:
+            with open(_local_path(location, name), 'rb') as stream:
+                body = stream.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    return json.loads(gzip.decompress(body))
+
+def save_json(location, name, data, s3_client=None):
+    """Escribe un documento (sobrescribe el anterior)"""
+    body = gzip.compress(json.dumps(data, separators=(',', ':')).encode())
+
+    if is_s3_location(location):
+        bucket, key = _s3_key(location, name)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/json', ContentEncoding='gzip')
+        return
+
+    path = _local_path(location, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Escritura atómica: un proceso interrumpido no deja un checkpoint a medias
+    with open(f"{path}.tmp", 'wb') as stream:
+        stream.write(body)
+    os.replace(f"{path}.tmp", path)
+
+def list_names(location, prefix, s3_client=None):
+    """Nombres de los documentos que empiezan por prefix"""
+    if is_s3_location(location):
+        bucket, key = _s3_key(location, prefix)
+        key = key[:-len('.json.gz')]
+        base = len(key) - len(prefix)
+        names = []
+        for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=key):
+            names.extend(item['Key'][base:-len('.json.gz')] for item in page.get('Contents', [])
+                         if item['Key'].endswith('.json.gz'))
+        return names
+
+    directory, start = os.path.split(prefix)
+    try:
+        entries = os.listdir(os.path.join(location, directory))
+    except FileNotFoundError:
+        return []
+    return [
+        f"{directory}/{entry[:-len('.json.gz')]}" if directory else entry[:-len('.json.gz')]
+        for entry in sorted(entries) if entry.startswith(start) and entry.endswith('.json.gz')
+    ]
+
+def delete_json(location, name, s3_client=None):
+    """Borra un documento (no falla si no existe)"""
+    if is_s3_location(location):
+        bucket, key = _s3_key(location, name)
+        s3_client.delete_object(Bucket=bucket, Key=key)
+        return
+    try:
+        os.remove(_local_path(location, name))
+    except FileNotFoundError:
+        pass
+
+class PersistentCache:
+    """
+    Caché clave -> valor JSON con TTL y expulsión LRU por número de entradas.
+    Vive en memoria (persiste entre invocaciones de una Lambda caliente) y, con
+    location, se comparte entre ejecuciones como el documento `document`.
+    """
+    document = 'cache'
+    stat_names = ('hits', 'misses')
+
+    def __init__(self, ttl_seconds=300, max_entries=64, location='', s3_client=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.location = location
+        self.s3_client = s3_client
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(self.stat_names, 0)
+
+    def begin(self):
+        """Inicio de una invocación: reinicia contadores y vuelve a leer el almacén"""
+        self.stats = dict.fromkeys(self.stat_names, 0)
+        self.loaded = False
+
+    def _load(self):
+        if self.loaded or not self.location:
+            return
+        self.loaded = True
+        try:
+            data = load_json(self.location, self.document, self.s3_client) or {}
+        except Exception as e:
+            telemetry.console(f"⚠️ No se pudo leer {self.document}: {str(e)}")
+            return
+
+        for key, entry in data.get('entries', {}).items():
+            current = self.entries.get(key)
+            if current is None or current['stored_at'] < entry['stored_at']:
+                self.entries[key] = entry
+        self._evict()
+
+    def _expired(self, entry, now):
+        return now - entry['stored_at'] > self.ttl_seconds
+
+    def _evict(self):
+        now = time.time()
+        for key in [key for key, entry in self.entries.items() if self._expired(entry, now)]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_entry(self, key):
+        """Entrada vigente ({'stored_at', 'value', ...}) o None (cuenta acierto/fallo)"""
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            if entry is None or self._expired(entry, time.time()):
+                self.stats['misses'] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry['value'] if entry else None
+
+    def put(self, key, value, **extra):
+        with self.lock:
+            self.entries[key] = dict(extra, stored_at=time.time(), value=value)
+            self.entries.move_to_end(key)
+            self._evict()
+            self.dirty = True
+
+    def flush(self):
+        """Persiste las entradas vigentes si hubo cambios"""
+        with self.lock:
+            if not self.location or not self.dirty:
+                return
+            self._evict()
+            try:
+                save_json(self.location, self.document, {'entries': dict(self.entries)}, self.s3_client)
+                self.dirty = False
+            except Exception as e:
+                telemetry.console(f"⚠️ No se pudo guardar {self.document}: {str(e)}")
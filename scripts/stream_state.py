@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Detección por micro-lotes a partir de eventos S3 ObjectCreated.
+
+En lugar de esperar a la ejecución programada y releer el día entero, cada
+objeto nuevo de flow logs dispara una invocación que solo lee ese objeto y
+actualiza el estado de los detectores. El estado está repartido en shards
+por hash de la clave de agrupación de cada detector (SHARD_FIELDS: srcaddr
+para port scanning y exfiltración, dstaddr para DDoS), así que una misma
+clave siempre cae en el mismo shard y los shards se pueden evaluar por
+separado.
+
+- Ingesta (handle_s3_event): por cada objeto y shard con registros se
+  escribe un delta (agregador exacto de local_engine) con nombre derivado
+  del objeto. Las invocaciones concurrentes nunca reescriben el mismo
+  documento y una reentrega del evento sobrescribe el mismo delta.
+- Fusión (merge_results): cada shard incorpora sus deltas pendientes a su
+  documento 'state' (que recuerda los objetos ya fusionados, así que una
+  reentrega tardía no cuenta dos veces), borra los deltas y aplica los
+  umbrales. Los shards no comparten claves: las filas de cada detector son la
+  unión de las de sus shards, ordenadas y recortadas al límite del detector.
+
+Los documentos viven en <ubicación>/stream/<cuenta>-<región>/YYYY/MM/DD/
+<detector>/<shard>/, un estado por origen y día UTC como la detección incremental.
+
+Con index_location la ingesta también guarda la entrada del objeto en el
+índice de objetos (object_index.py), con los registros antes de aplicar las
+listas de IPs; sin ubicación de estado solo se indexa.
+
+Prueba local (eventos sintéticos sobre ficheros, N invocaciones a la vez):
+  python stream_state.py --state /tmp/stream-state --workers 4 fichero1.log.gz fichero2.log.gz ...
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from urllib.parse import unquote_plus
+
+import numpy as np
+
+import local_engine
+import state_store
+import telemetry
+
+STREAM_SHARDS = 16
+# Campo por el que se reparte el estado de cada detector (su clave de agrupación)
+SHARD_FIELDS = {
+    'port_scanning': 'srcaddr',
+    'ddos': 'dstaddr',
+    'data_exfiltration': 'srcaddr'
+}
+# Shards que se fusionan a la vez
+MERGE_WORKERS = 8
+FLOW_LOG_SUFFIX = '.log.gz'
+
+# Cuenta, región y día de la clave de un objeto de flow logs (o de un prefijo base)
+FLOW_LOG_KEY = re.compile(r'AWSLogs/(\d+)/vpcflowlogs/([^/]+)/(?:(\d{4})/(\d{2})/(\d{2})/)?')
+
+def source_of(key):
+    """(origen 'cuenta-región', día) de una clave de flow logs; día None si la clave no lo incluye"""
+    match = FLOW_LOG_KEY.search(key)
+    if not match:
+        return 'default', None
+    account, region, year, month, day = match.groups()
+    return f"{account}-{region}", date(int(year), int(month), int(day)) if year else None
+
+def shard_directory(source, day, detector, shard):
+    return f"stream/{source}/{day:%Y/%m/%d}/{detector}/{shard:02d}"
+
+def object_id(bucket, key):
+    """Identificador estable de un objeto: nombre de sus deltas"""
+    return hashlib.sha1(f"{bucket}/{key}".encode()).hexdigest()[:20]
+
+def shard_numbers(addresses, shards):
+    """Shard de cada dirección (crc32 % shards), calculado una vez por dirección distinta"""
+    uniques, inverse = np.unique(addresses, return_inverse=True)
+    numbers = np.fromiter((zlib.crc32(value) % shards for value in uniques.tolist()), dtype=np.int64, count=len(uniques))
+    return numbers[inverse.reshape(-1)]
+
+def shard_aggregators(chunks, shards=STREAM_SHARDS, batch_size=local_engine.BATCH_SIZE, ip_lists=None,
+                      on_batch=None):
+    """
+    Agregadores exactos por (detector, shard) de los registros de un objeto.
+    on_batch recibe cada lote tal como se lee. Retorna
+    ({(detector, shard): agregador}, registros)
+    """
+    classes = local_engine.AGGREGATOR_CLASSES['exact']
+    aggregators = {}
+    records = 0
+
+    for batch in local_engine.parse_batches(chunks, batch_size):
+        if on_batch:
+            on_batch(batch)
+        if ip_lists:
+            batch = ip_lists.filter_batch(batch)
+        records += len(batch['start'])
+        numbers_by_field = {}
+        for detector, field in SHARD_FIELDS.items():
+            if field not in numbers_by_field:
+                numbers_by_field[field] = shard_numbers(batch[field], shards)
+            numbers = numbers_by_field[field]
+            order = np.argsort(numbers, kind='stable')
+            bounds = np.searchsorted(numbers[order], np.arange(shards + 1))
+            for shard in range(shards):
+                if bounds[shard] == bounds[shard + 1]:
+                    continue
+                rows = order[bounds[shard]:bounds[shard + 1]]
+                aggregator = aggregators.get((detector, shard))
+                if aggregator is None:
+                    aggregator = aggregators[(detector, shard)] = classes[detector]()
+                aggregator.update({name: values[rows] for name, values in batch.items()})
+
+    # Sin grupos (p.ej. ningún REJECT en el shard) no hay nada que guardar
+    return {key: aggregator for key, aggregator in aggregators.items() if aggregator.state.groups}, records
+
+def ingest_object(chunks, location, bucket, key, s3_client=None, shards=STREAM_SHARDS, ip_lists=None, day=None,
+                  on_batch=None):
+    """Escribe los deltas de un objeto; retorna (registros, deltas)"""
+    source, key_day = source_of(key)
+    day = key_day or day or datetime.now(timezone.utc).date()
+    aggregators, records = shard_aggregators(chunks, shards, ip_lists=ip_lists, on_batch=on_batch)
+    name = f"delta-{object_id(bucket, key)}"
+    for (detector, shard), aggregator in aggregators.items():
+        state_store.save_json(location, f"{shard_directory(source, day, detector, shard)}/{name}",
+                              aggregator.to_dict(), s3_client)
+    return records, len(aggregators)
+
+def object_created_keys(event):
+    """(bucket, clave) de los objetos de flow logs de un evento S3 ObjectCreated"""
+    for record in event.get('Records', []):
+        if record.get('eventSource') != 'aws:s3' or not record.get('eventName', '').startswith('ObjectCreated'):
+            continue
+        key = unquote_plus(record['s3']['object']['key'])
+        if key.endswith(FLOW_LOG_SUFFIX):
+            yield record['s3']['bucket']['name'], key
+
+def object_created_event(bucket, keys):
+    """Evento S3 ObjectCreated sintético (pruebas locales)"""
+    return {
+        'Records': [
+            {
+                'eventSource': 'aws:s3',
+                'eventName': 'ObjectCreated:Put',
+                's3': {'bucket': {'name': bucket}, 'object': {'key': key}}
+            }
+            for key in keys
+        ]
+    }
+
+def handle_s3_event(event, location, s3_client=None, shards=STREAM_SHARDS, ip_lists=None, index_location=''):
+    """
+    Ingesta de los objetos de un evento. Sin s3_client las claves son rutas
+    de ficheros locales (pruebas). Retorna las estadísticas de la invocación.
+    """
+    import object_index
+
+    stats = {'objects': 0, 'records': 0, 'deltas': 0}
+    for bucket, key in object_created_keys(event):
+        if s3_client is None:
+            chunks = local_engine.iter_file_chunks(key)
+        else:
+            chunks = local_engine.iter_s3_object_chunks(s3_client, bucket, key)
+        builder = object_index.EntryBuilder() if index_location else None
+        if location:
+            records, deltas = ingest_object(chunks, location, bucket, key, s3_client, shards, ip_lists,
+                                            on_batch=builder.update if builder else None)
+        else:
+            records, deltas = 0, 0
+            for batch in local_engine.parse_batches(chunks):
+                builder.update(batch)
+                records += len(batch['start'])
+        if builder:
+            object_index.write_entry(index_location, key, builder.build(), s3_client)
+        stats['objects'] += 1
+        stats['records'] += records
+        stats['deltas'] += deltas
+        telemetry.console(f"📥 {key}: {records} registros" + (f" en {deltas} shards" if location else " indexados"))
+    return stats
+
+def merge_shard(location, source, day, detector, shard, s3_client=None):
+    """
+    Fusiona los deltas pendientes de un shard en su estado y lo guarda.
+    Retorna (agregador del shard, deltas fusionados)
+    """
+    directory = shard_directory(source, day, detector, shard)
+    cls = local_engine.AGGREGATOR_CLASSES['exact'][detector]
+    state = state_store.load_json(location, f"{directory}/state", s3_client) or {'objects': [], 'aggregator': None}
+    aggregator = cls.from_dict(state['aggregator']) if state['aggregator'] else cls()
+
+    merged = set(state['objects'])
+    names = [name.rsplit('/', 1)[-1] for name in state_store.list_names(location, f"{directory}/delta-", s3_client)]
+    loaded = set()
+    for name in names:
+        if name in merged:
+            continue
+        data = state_store.load_json(location, f"{directory}/{name}", s3_client)
+        # Listado pero aún no legible: queda para la siguiente fusión
+        if data is None:
+            continue
+        aggregator.merge(cls.from_dict(data))
+        loaded.add(name)
+
+    if loaded:
+        state = {'objects': sorted(merged | loaded), 'aggregator': aggregator.to_dict()}
+        state_store.save_json(location, f"{directory}/state", state, s3_client)
+    # Solo se borran los deltas ya incorporados al estado guardado (y las reentregas)
+    for name in names:
+        if name in merged or name in loaded:
+            state_store.delete_json(location, f"{directory}/{name}", s3_client)
+    return aggregator, len(loaded)
+
+def merge_shards(location, source, day, s3_client=None, shards=STREAM_SHARDS, workers=MERGE_WORKERS):
+    """
+    Fusiona los deltas pendientes de todos los shards del origen y día.
+    Retorna ({detector: [agregador de cada shard]}, deltas fusionados)
+    """
+    tasks = [(detector, shard) for detector in SHARD_FIELDS for shard in range(shards)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        merged = list(executor.map(lambda task: merge_shard(location, source, day, *task, s3_client), tasks))
+
+    aggregators = {detector: [] for detector in SHARD_FIELDS}
+    for (detector, _), (aggregator, _) in zip(tasks, merged):
+        aggregators[detector].append(aggregator)
+    return aggregators, sum(deltas for _, deltas in merged)
+
+def merge_results(location, source, day, s3_client=None, shards=STREAM_SHARDS, thresholds=None, limits=None,
+                  workers=MERGE_WORKERS):
+    """
+    Fusiona todos los shards del origen y día y aplica los umbrales de cada
+    detector (thresholds / limits como en local_engine.collect_results).
+    Retorna ({detector: filas}, deltas fusionados)
+    """
+    shard_aggregators, deltas = merge_shards(location, source, day, s3_client, shards, workers)
+    return shard_results(shard_aggregators, thresholds, limits), deltas
+
+def shard_results(shard_aggregators, thresholds=None, limits=None):
+    """Filas de cada detector a partir de los agregadores de sus shards ({detector: [agregador]})"""
+    import query_planner
+
+    specs = {spec['name']: spec for spec in query_planner.DETECTOR_SPECS}
+    results = {}
+    for detector, aggregators in shard_aggregators.items():
+        threshold = (thresholds or {}).get(detector)
+        limit = (limits or {}).get(detector) or specs[detector]['limit']
+        # Cada shard retorna hasta `limit` filas: el top global está en la unión
+        rows = [row for aggregator in aggregators for row in aggregator.results(threshold, limit)]
+        rows.sort(key=lambda row: row[specs[detector]['order_by']], reverse=True)
+        results[detector] = rows[:limit]
+    return results
+
+def ingest_file(args):
+    """Una invocación simulada: evento sintético con un fichero local"""
+    path, location, shards = args
+    return handle_s3_event(object_created_event('local', [path]), location, shards=shards)
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingesta por eventos sintéticos y fusión de shards en local')
+    parser.add_argument('files', nargs='+', help='Objetos de flow logs (.log.gz)')
+    parser.add_argument('--state', required=True, help='Ubicación del estado (directorio o s3://)')
+    parser.add_argument('--workers', type=int, default=4, help='Invocaciones de ingesta simultáneas')
+    parser.add_argument('--shards', type=int, default=STREAM_SHARDS)
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        stats = list(executor.map(ingest_file, [(path, args.state, args.shards) for path in args.files]))
+    ingest_seconds = time.perf_counter() - started_at
+    records = sum(item['records'] for item in stats)
+    print(f"📥 Ingesta: {len(stats)} eventos, {records} registros en {ingest_seconds:.2f}s ({args.workers} a la vez)")
+
+    for source, day in sorted({source_of(path) for path in args.files}, key=str):
+        day = day or datetime.now(timezone.utc).date()
+        started_at = time.perf_counter()
+        results, deltas = merge_results(args.state, source, day, shards=args.shards)
+        print(f"🔀 Fusión {source} {day}: {deltas} deltas en {time.perf_counter() - started_at:.2f}s")
+        for detector, rows in results.items():
+            print(f"   {detector}: {len(rows)} filas")
+            for row in rows[:5]:
+                print(f"      {json.dumps(row)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Instrumentación por etapa: spans de tiempo, métricas y logging estructurado.
+
+Las métricas de una invocación se acumulan en memoria y flush() las escribe
+en stdout como CloudWatch Embedded Metric Format (EMF): CloudWatch Logs las
+convierte en métricas sin llamadas a PutMetricData. Cada combinación de
+dimensiones (p.ej. Stage=athena_fetch, Query=port_scanning) es un documento
+EMF con sus valores agregados en arrays.
+
+console() sustituye a print en el camino crítico: con DECORATIVE_LOGS=false
+los mensajes decorativos se descartan y los errores y avisos pasan al logger
+estructurado (JSON con request_id).
+"""
+import builtins
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = 'VPCAnomalyDetection'
+DECORATIVE_LOGS = os.environ.get('DECORATIVE_LOGS', 'true').lower() == 'true'
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+
+# Máximos de EMF por documento
+EMF_MAX_METRICS = 100
+EMF_MAX_VALUES = 100
+
+# Estadísticas de Athena por consulta (campo de Statistics, unidad)
+QUERY_STATISTICS = [
+    ('DataScannedInBytes', 'Bytes'),
+    ('EngineExecutionTimeInMillis', 'Milliseconds'),
+    ('QueryQueueTimeInMillis', 'Milliseconds'),
+    ('QueryPlanningTimeInMillis', 'Milliseconds'),
+    ('ServiceProcessingTimeInMillis', 'Milliseconds'),
+    ('TotalExecutionTimeInMillis', 'Milliseconds')
+]
+
+logger = logging.getLogger('anomaly-detection')
+
+class StructuredFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos pasados en extra={'fields': {...}}"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        request_id = getattr(record, 'aws_request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+StructuredFormatter.converter = time.gmtime
+
+def configure_logging(level=logging.INFO):
+    """Logger raíz con salida JSON (LOG_FORMAT=json) o texto"""
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    if LOG_FORMAT == 'json':
+        for handler in root.handlers:
+            handler.setFormatter(StructuredFormatter())
+    return root
+
+def console(*args, **kwargs):
+    """print con emoji, o solo errores/avisos al logger si DECORATIVE_LOGS=false"""
+    if DECORATIVE_LOGS:
+        builtins.print(*args, **kwargs)
+        return
+
+    message = ' '.join(str(arg) for arg in args).strip()
+    if message.startswith('❌'):
+        logger.error(message)
+    elif message.startswith('⚠️') or (message.startswith('⏰') and 'timeout' in message):
+        logger.warning(message)
+
+class Metrics:
+    """Métricas de una invocación; thread-safe (los análisis de Bedrock corren en hilos)"""
+
+    def __init__(self, namespace=NAMESPACE, dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dimensions or {}
+        self.lock = threading.Lock()
+        self.begin()
+
+    def begin(self, **properties):
+        """Empieza una invocación: descarta las métricas anteriores"""
+        with self.lock:
+            self.values = {}
+            self.units = {}
+            self.properties = properties
+
+    def put(self, name, value, unit='Count', **dimensions):
+        key = tuple(sorted(dimensions.items()))
+        with self.lock:
+            self.values.setdefault(key, {}).setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    @contextmanager
+    def span(self, stage, **dimensions):
+        """Mide la duración de un bloque como métrica Duration con dimensión Stage"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put('Duration', (time.perf_counter() - started_at) * 1000, 'Milliseconds', Stage=stage, **dimensions)
+
+    def query_statistics(self, query, statistics):
+        """Statistics de una ejecución de Athena, con dimensión Query"""
+        for name, unit in QUERY_STATISTICS:
+            if name in statistics:
+                self.put(name, statistics[name], unit, Query=query)
+
+    def summary(self):
+        """Totales por métrica y dimensiones, para la respuesta del handler"""
+        with self.lock:
+            totals = {}
+            for key, metrics in self.values.items():
+                label = ','.join(f"{name}={value}" for name, value in key) or 'total'
+                for name, values in metrics.items():
+                    totals.setdefault(name, {})[label] = round(sum(values), 3)
+            return totals
+
+    def documents(self):
+        """Documentos EMF (uno por combinación de dimensiones, troceados a los máximos)"""
+        timestamp = int(time.time() * 1000)
+        with self.lock:
+            items = list(self.values.items())
+            units = dict(self.units)
+
+        for key, metrics in items:
+            dimensions = dict(self.dimensions, **dict(key))
+            names = list(metrics)
+            for first in range(0, len(names), EMF_MAX_METRICS):
+                chunk = names[first:first + EMF_MAX_METRICS]
+                rounds = max(len(metrics[name]) for name in chunk)
+                for offset in range(0, rounds, EMF_MAX_VALUES):
+                    document = {
+                        '_aws': {
+                            'Timestamp': timestamp,
+                            'CloudWatchMetrics': [{
+                                'Namespace': self.namespace,
+                                'Dimensions': [sorted(dimensions)],
+                                'Metrics': [{'Name': name, 'Unit': units[name]} for name in chunk
+                                            if metrics[name][offset:offset + EMF_MAX_VALUES]]
+                            }]
+                        }
+                    }
+                    document.update(self.properties)
+                    document.update(dimensions)
+                    for name in chunk:
+                        values = metrics[name][offset:offset + EMF_MAX_VALUES]
+                        if values:
+                            document[name] = values if len(values) > 1 else values[0]
+                    yield document
+
+    def flush(self):
+        """Escribe las métricas en stdout como EMF y las descarta"""
+        for document in self.documents():
+            builtins.print(json.dumps(document, default=str))
+        self.begin(**self.properties)
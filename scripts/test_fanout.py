@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Test offline del fan-out: agregados de varios targets fusionados antes de aplicar los umbrales
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fanout
+import lambda_function
+import local_engine
+
+TARGETS = fanout.parse_targets([
+    {'account_id': '111111111111', 'region': 'us-east-1'},
+    {'account_id': '222222222222', 'region': 'eu-west-1'},
+    {'account_id': '333333333333', 'region': 'us-east-1'}
+])
+# Por debajo del umbral de puertos (PORT_SCAN_MIN_PORTS) en cada cuenta, por encima en total
+PORTS_PER_TARGET = 30
+SCANNER = '198.51.100.7'
+LOCAL_SCANNER = '198.51.100.9'
+
+def rejected_probes(srcaddr, ports, start=1700000000):
+    """Columnas de registros REJECT de srcaddr a cada puerto (lo que acumula PortScanAggregator)"""
+    ports = np.array(list(ports))
+    offsets = np.arange(len(ports))
+    return local_engine.columns_to_batch({
+        'srcaddr': [srcaddr] * len(ports),
+        'dstport': ports,
+        'start': start + offsets,
+        'end': start + offsets + 60
+    })
+
+def target_aggregators(mode):
+    """Agregados de cada target: SCANNER prueba 30 puertos distintos en cada uno; LOCAL_SCANNER 60 solo en el primero"""
+    aggregators = {}
+    for position, target in enumerate(TARGETS):
+        target_state = local_engine.create_aggregators(mode)
+        first = position * PORTS_PER_TARGET
+        target_state['port_scanning'].accumulate(rejected_probes(SCANNER, range(first + 1, first + PORTS_PER_TARGET + 1)))
+        if position == 0:
+            target_state['port_scanning'].accumulate(rejected_probes(LOCAL_SCANNER, range(1000, 1060)))
+        aggregators[fanout.target_id(target)] = target_state
+    return aggregators
+
+def run_fanout(mode):
+    """run_fanout_detectors con los agregados de target_aggregators en lugar de leer flow logs"""
+    aggregators = target_aggregators(mode)
+    detector_aggregators = lambda_function.detector_aggregators
+    lambda_function.detector_aggregators = lambda: aggregators[fanout.target_id(lambda_function.current_target())]
+    try:
+        return lambda_function.run_fanout_detectors(TARGETS)
+    finally:
+        lambda_function.detector_aggregators = detector_aggregators
+
+def test_threshold_after_merge():
+    """Un origen por debajo del umbral en cada target supera el umbral con los agregados fusionados"""
+    print("🧪 Testing umbrales sobre los agregados fusionados...")
+
+    try:
+        for mode in ('exact', 'sketch'):
+            anomalies, failed = run_fanout(mode)
+            assert not failed
+            assert [anomaly['type'] for anomaly in anomalies] == ['Port Scanning']
+            rows = {row['srcaddr']: row for row in anomalies[0]['data']}
+            assert set(rows) == {SCANNER, LOCAL_SCANNER}, f"{mode}: filas {sorted(rows)}"
+
+            scanner = rows[SCANNER]
+            expected_ports = PORTS_PER_TARGET * len(TARGETS)
+            # HyperLogLog: estimación con error relativo pequeño
+            assert abs(scanner['unique_ports'] - expected_ports) <= expected_ports * 0.05, scanner
+            assert scanner['total_attempts'] == expected_ports
+            assert scanner['targets'] == len(TARGETS)
+            assert scanner['accounts'] == ','.join(sorted(target['account_id'] for target in TARGETS))
+            assert scanner['regions'] == 'eu-west-1,us-east-1'
+            assert rows[LOCAL_SCANNER]['targets'] == 1 and rows[LOCAL_SCANNER]['accounts'] == '111111111111'
+            assert anomalies[0]['targets'] == sorted(fanout.target_id(target) for target in TARGETS)
+            print(f"   {mode}: {SCANNER} con {scanner['unique_ports']} puertos en {scanner['targets']} targets")
+
+        print("✅ Umbrales aplicados sobre el total de los targets")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_failed_target():
+    """Un target que falla no detiene al resto ni aporta agregados"""
+    print("\n🧪 Testing target fallido...")
+
+    try:
+        aggregators = target_aggregators('exact')
+
+        def run_target(target):
+            if target is TARGETS[1]:
+                raise RuntimeError("Consultas parciales incompletas")
+            return aggregators[fanout.target_id(target)]
+
+        results, failed = fanout.run_targets(TARGETS, run_target, max_concurrency=2)
+        merged, sources = fanout.merge_aggregators(results)
+        rows = local_engine.collect_results(merged)['port_scanning']
+        assert failed == [fanout.target_id(TARGETS[1])]
+        # Dos targets: 60 puertos, sigue por encima del umbral
+        scanner = next(row for row in rows if row['srcaddr'] == SCANNER)
+        assert scanner['unique_ports'] == 2 * PORTS_PER_TARGET
+        assert len(sources['port_scanning'][(SCANNER,)]) == 2
+        print(f"   Fallido: {failed[0]}; {SCANNER} con {scanner['unique_ports']} puertos en 2 targets")
+
+        print("✅ Target fallido aislado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🔬 === FAN-OUT TEST (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    merge_ok = test_threshold_after_merge()
+    failed_ok = test_failed_target()
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN DE TESTS:")
+    print(f"   🌐 Umbrales tras la fusión: {'✅ OK' if merge_ok else '❌ FAIL'}")
+    print(f"   ❌ Target fallido: {'✅ OK' if failed_ok else '❌ FAIL'}")
+
+    sys.exit(0 if merge_ok and failed_ok else 1)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# Test offline de la detección incremental (checkpoint en un directorio) con el motor local
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import flowlog_generator
+import lambda_function
+import local_engine
+import state_store
+from benchmark_detection import LocalS3
+
+RECORDS = 40000
+RECORDS_PER_OBJECT = 2500
+
+def deliver(source_dir, bucket_dir, paths, modified):
+    """Copia objetos generados al bucket local con LastModified = modified"""
+    for path in paths:
+        target = os.path.join(bucket_dir, os.path.relpath(path, source_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy(path, target)
+        os.utime(target, (modified, modified))
+
+def anomaly_rows(anomalies):
+    """Filas de cada tipo de anomalía, sin depender del orden de los empates"""
+    return {
+        anomaly['type']: sorted(json.dumps(row, sort_keys=True) for row in anomaly['data'])
+        for anomaly in anomalies
+    }
+
+def expected_rows(paths):
+    """Anomalías de una lectura completa (no incremental) de los objetos"""
+    return anomaly_rows(lambda_function.emit_anomalies(local_engine.run_local_detection_on_files(paths)))
+
+def day_start(truth):
+    """Medianoche (epoch) del día de los objetos generados"""
+    return int(datetime.fromisoformat(truth['day']).replace(tzinfo=timezone.utc).timestamp())
+
+def run_incremental(checkpoint_dir, bucket_dir, truth, mode='exact', now=None):
+    """
+    Una ejecución programada en modo incremental (por defecto a mediodía del
+    día de los objetos); retorna (anomalías, checkpoint guardado)
+    """
+    lambda_function.DETECTION_ENGINE = 'local'
+    lambda_function.AGGREGATION_MODE = mode
+    lambda_function.CHECKPOINT_LOCATION = checkpoint_dir
+    lambda_function.FLOW_LOGS_BUCKET = 'flow-logs'
+    lambda_function.FLOW_LOGS_PREFIX = truth['base_prefix']
+    lambda_function.s3_client = LocalS3(bucket_dir)
+    anomalies = lambda_function.run_incremental_detectors(now=now if now is not None else day_start(truth) + 43200)
+    return anomalies, state_store.load_json(checkpoint_dir, lambda_function.CHECKPOINT_NAME)
+
+def test_resume_and_late_records(work_dir, truth, paths):
+    """
+    Cada ejecución solo lee los objetos posteriores al watermark; un objeto que
+    llega desordenado dentro del margen de solapamiento y registros de horas ya
+    procesadas se incorporan sin contar dos veces lo ya leído
+    """
+    print("🧪 Testing reanudación desde el watermark y registros tardíos...")
+
+    try:
+        source_dir = work_dir
+        with tempfile.TemporaryDirectory() as bucket_dir, tempfile.TemporaryDirectory() as checkpoint_dir:
+            now = int(time.time())
+            # Primera entrega: uno de cada dos objetos (los demás llegan tarde)
+            first, rest = paths[::2], paths[1::2]
+            late, remaining = rest[:2], rest[2:]
+            deliver(source_dir, bucket_dir, first, now - 600)
+            anomalies, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth)
+            assert checkpoint['objects_watermark'] == now - 600
+            assert anomaly_rows(anomalies) == expected_rows(first), "primera ejecución distinta de la lectura completa"
+
+            # Sin objetos nuevos: el estado no cambia (nada se vuelve a sumar)
+            anomalies, again = run_incremental(checkpoint_dir, bucket_dir, truth)
+            assert again['aggregators'] == checkpoint['aggregators'], "se han vuelto a leer objetos ya procesados"
+            assert anomaly_rows(anomalies) == expected_rows(first)
+
+            # Objetos tardíos con LastModified anterior al watermark (dentro del
+            # margen) y el resto con registros de horas ya procesadas
+            deliver(source_dir, bucket_dir, late, now - 600 - local_engine.OBJECT_OVERLAP_SECONDS // 2)
+            deliver(source_dir, bucket_dir, remaining, now)
+            anomalies, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth)
+            print(f"   Entregas: {len(first)} + {len(late)} tardíos + {len(remaining)} objetos, "
+                  f"watermark {checkpoint['objects_watermark'] - now:+d}s")
+            assert checkpoint['objects_watermark'] == now
+            assert anomaly_rows(anomalies) == expected_rows(paths), "estado incremental distinto de la lectura completa"
+            assert set(anomaly_rows(anomalies)) == {'Port Scanning', 'DDoS Attack', 'Data Exfiltration'}
+
+        print("✅ Reanudación y registros tardíos correctos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_day_rollover(work_dir, truth, paths):
+    """
+    Los objetos que llegan al prefijo del día después de su última ejecución
+    se evalúan al cerrar el día (medianoche más el retraso del watermark),
+    antes de empezar el checkpoint del día siguiente
+    """
+    print("\n🧪 Testing cierre del día...")
+
+    try:
+        midnight = day_start(truth) + 86400
+        lateness = lambda_function.WATERMARK_LATENESS_SECONDS
+        first, tail = paths[:len(paths) // 2], paths[len(paths) // 2:]
+        with tempfile.TemporaryDirectory() as bucket_dir, tempfile.TemporaryDirectory() as checkpoint_dir:
+            deliver(work_dir, bucket_dir, first, midnight - 900)
+            anomalies, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth, now=midnight - 600)
+            assert checkpoint['day'] == truth['day']
+
+            # Pasada la medianoche pero dentro del retraso: el día sigue abierto
+            _, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth, now=midnight + lateness // 2)
+            assert checkpoint['day'] == truth['day']
+
+            # La cola del día llega después de su última ejecución
+            deliver(work_dir, bucket_dir, tail, midnight + lateness // 2 + 60)
+            anomalies, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth, now=midnight + lateness + 300)
+            assert anomaly_rows(anomalies) == expected_rows(paths), "la cola del día anterior no se ha evaluado"
+            assert checkpoint['day'] > truth['day'] and not checkpoint['aggregators']
+            print(f"   {len(first)} objetos antes de medianoche + {len(tail)} tardíos evaluados al cerrar {truth['day']}")
+
+            # El día nuevo empieza sin el estado del anterior
+            anomalies, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth, now=midnight + lateness + 600)
+            assert not anomalies and checkpoint['day'] > truth['day']
+
+        print("✅ Cierre del día correcto")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_checkpoint_reload(work_dir, truth, paths):
+    """
+    Los agregados guardados en el checkpoint y recargados dan los mismos
+    resultados (exacto y sketch); un checkpoint de otro día o modo se descarta
+    """
+    print("\n🧪 Testing recarga del checkpoint...")
+
+    try:
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            for mode in ('exact', 'sketch'):
+                aggregators = local_engine.create_aggregators(mode)
+                for path in paths:
+                    local_engine.aggregate_chunks(local_engine.iter_file_chunks(path), aggregators)
+                state_store.save_json(checkpoint_dir, mode, {'aggregators': local_engine.dump_aggregators(aggregators)})
+                reloaded = local_engine.load_aggregators(state_store.load_json(checkpoint_dir, mode)['aggregators'], mode)
+                original = local_engine.collect_results(aggregators)
+                assert local_engine.collect_results(reloaded) == original, f"{mode}: resultados distintos tras recargar"
+                print(f"   {mode}: {sum(len(rows) for rows in original.values())} filas iguales tras recargar")
+
+        with tempfile.TemporaryDirectory() as bucket_dir, tempfile.TemporaryDirectory() as checkpoint_dir:
+            deliver(work_dir, bucket_dir, paths, int(time.time()))
+            _, checkpoint = run_incremental(checkpoint_dir, bucket_dir, truth)
+
+            # Checkpoint de otro día: se cierra con su propio estado y la
+            # siguiente ejecución empieza de cero y lee todos los objetos
+            checkpoint['day'] = '2000-01-01'
+            state_store.save_json(checkpoint_dir, lambda_function.CHECKPOINT_NAME, checkpoint)
+            anomalies, reset = run_incremental(checkpoint_dir, bucket_dir, truth)
+            assert reset['day'] == truth['day'] and not reset['aggregators']
+            assert anomaly_rows(anomalies) == expected_rows(paths)
+            anomalies, reset = run_incremental(checkpoint_dir, bucket_dir, truth)
+            assert anomaly_rows(anomalies) == expected_rows(paths)
+
+            # Cambio de modo de agregación: tampoco se mezclan estados
+            anomalies, sketch = run_incremental(checkpoint_dir, bucket_dir, truth, mode='sketch')
+            assert sketch['mode'] == 'sketch' and sketch['objects_watermark'] == reset['objects_watermark']
+            assert set(anomaly_rows(anomalies)) == set(expected_rows(paths))
+
+        print("✅ Recarga del checkpoint correcta")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🔬 === INCREMENTAL DETECTION TEST (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        truth = flowlog_generator.generate(work_dir, RECORDS, seed=7, records_per_object=RECORDS_PER_OBJECT)
+        paths = flowlog_generator.flow_log_files(work_dir, truth)
+        resume_ok = test_resume_and_late_records(work_dir, truth, paths)
+        rollover_ok = test_day_rollover(work_dir, truth, paths)
+        reload_ok = test_checkpoint_reload(work_dir, truth, paths)
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN DE TESTS:")
+    print(f"   ⏩ Reanudación y registros tardíos: {'✅ OK' if resume_ok else '❌ FAIL'}")
+    print(f"   🌙 Cierre del día: {'✅ OK' if rollover_ok else '❌ FAIL'}")
+    print(f"   💾 Recarga del checkpoint: {'✅ OK' if reload_ok else '❌ FAIL'}")
+
+    sys.exit(0 if resume_ok and rollover_ok and reload_ok else 1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# Test offline del prompt de análisis (presupuesto de tokens y streaming) con un Bedrock simulado
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_function
+import prompt_builder
+
+class StubStreamingBedrock:
+    """Bedrock local: guarda los prompts recibidos y responde en streaming"""
+
+    def __init__(self, words=50, delay=0.0, stall_after=None, stall=0.0):
+        self.words = words
+        self.delay = delay
+        # Tras stall_after palabras el stream deja de enviar eventos durante stall segundos
+        self.stall_after = stall_after
+        self.stall = stall
+        self.prompts = []
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType):
+        self.prompts.append(json.loads(body)['messages'][0]['content'])
+        return {'body': self._events()}
+
+    def _events(self):
+        yield {'chunk': {'bytes': json.dumps({'type': 'message_start'}).encode()}}
+        for i in range(self.words):
+            time.sleep(self.stall if i == self.stall_after else self.delay)
+            delta = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': f"palabra{i} "}}
+            yield {'chunk': {'bytes': json.dumps(delta).encode()}}
+        yield {'chunk': {'bytes': json.dumps({'type': 'message_stop'}).encode()}}
+
+def make_anomaly(rows):
+    """Anomalía de port scanning con `rows` filas (ordenadas por unique_ports como la consulta)"""
+    return {
+        'type': 'Port Scanning',
+        'severity': 'HIGH',
+        'data': [
+            {
+                'srcaddr': f"203.0.{i // 256}.{i % 256}",
+                'unique_ports': 5000 - i,
+                'total_attempts': 10000 - i,
+                'first_attempt': '2025-10-18T00:00:00.000Z',
+                'last_attempt': '2025-10-18T10:00:00.000Z'
+            }
+            for i in range(rows)
+        ]
+    }
+
+def test_prompt_budget():
+    """El prompt enviado a Bedrock nunca supera el presupuesto, tenga las filas que tenga"""
+    print("🧪 Testing presupuesto de tokens del prompt...")
+
+    try:
+        budget = lambda_function.PROMPT_TOKEN_BUDGET
+        stub = StubStreamingBedrock()
+        lambda_function.bedrock_client = stub
+
+        for rows in (1, 10, 100, 1000, 10000):
+            anomaly = make_anomaly(rows)
+            lambda_function.stream_bedrock_analysis(anomaly)
+            tokens = prompt_builder.estimate_tokens(stub.prompts[-1])
+            legacy = prompt_builder.estimate_tokens(json.dumps(anomaly['data'], indent=2))
+            print(f"   {rows:>6} filas: prompt ~{tokens} tokens (JSON indentado: ~{legacy})")
+            assert tokens <= budget, f"{tokens} tokens > presupuesto {budget}"
+            # Las primeras filas (las más relevantes) siempre van en la tabla
+            assert anomaly['data'][0]['srcaddr'] in stub.prompts[-1]
+
+        # Con pocas filas no se resume nada
+        data, included = prompt_builder.encode_rows(make_anomaly(5)['data'], budget)
+        assert included == 5 and 'resumidas' not in data
+
+        print("✅ Presupuesto respetado")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_streaming_partial():
+    """Con el deadline vencido a mitad de respuesta se conserva el análisis parcial"""
+    print("\n🧪 Testing streaming y análisis parcial...")
+
+    try:
+        lambda_function.bedrock_client = StubStreamingBedrock(words=20)
+        analysis, complete = lambda_function.stream_bedrock_analysis(make_anomaly(3))
+        assert complete and analysis.startswith('palabra0') and 'palabra19' in analysis
+
+        lambda_function.bedrock_client = StubStreamingBedrock(words=50, delay=0.02)
+        deadline = time.monotonic() + 0.3
+        analysis, complete = lambda_function.stream_bedrock_analysis(make_anomaly(3), deadline)
+        assert not complete and 'palabra0' in analysis and 'palabra49' not in analysis
+
+        # Stream detenido: se corta en el deadline, no al read_timeout de botocore
+        lambda_function.bedrock_client = StubStreamingBedrock(words=20, stall_after=5, stall=5)
+        started_at = time.monotonic()
+        analysis, complete = lambda_function.stream_bedrock_analysis(make_anomaly(3), started_at + 0.3)
+        elapsed = time.monotonic() - started_at
+        assert not complete and 'palabra4' in analysis and 'palabra5' not in analysis
+        assert elapsed < 1, f"{elapsed:.1f}s esperando un stream detenido"
+
+        lambda_function.bedrock_client = StubStreamingBedrock(words=20, stall_after=0, stall=5)
+        started_at = time.monotonic()
+        try:
+            lambda_function.stream_bedrock_analysis(make_anomaly(3), started_at + 0.3)
+            raise AssertionError("sin texto debe lanzar TimeoutError")
+        except TimeoutError:
+            assert time.monotonic() - started_at < 1
+
+        print("✅ Streaming completo, parcial y detenido correctos")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🔬 === PROMPT BUDGET TEST (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    budget_ok = test_prompt_budget()
+    streaming_ok = test_streaming_partial()
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN DE TESTS:")
+    print(f"   📏 Presupuesto de tokens: {'✅ OK' if budget_ok else '❌ FAIL'}")
+    print(f"   📡 Streaming: {'✅ OK' if streaming_ok else '❌ FAIL'}")
+
+    sys.exit(0 if budget_ok and streaming_ok else 1)
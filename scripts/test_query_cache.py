@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Test offline de RESULT_CACHE: una segunda invocación idéntica no relanza sus consultas en Athena
+import os
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_function
+import query_cache
+from test_query_scheduler import StubAthena
+
+ROWS = [{'srcaddr': '10.0.0.1', 'unique_ports': 40}, {'srcaddr': '10.0.0.2', 'unique_ports': 35}]
+
+class RowReader:
+    """Reader de filas que registra las ejecuciones que lee"""
+
+    def __init__(self):
+        self.__name__ = 'iter_query_rows'
+        self.read = []
+
+    def __call__(self, execution, description="Query"):
+        self.read.append(execution['QueryExecutionId'])
+        return iter(ROWS)
+
+def make_spec(name, **extra):
+    return dict({'name': name, 'query': '0.05', 'description': name, 'severity': 'HIGH'}, **extra)
+
+def invoke(specs):
+    """Una invocación: lanza las consultas con un Athena local; retorna (consultas lanzadas, resultados)"""
+    stub = StubAthena()
+    lambda_function.athena_client = stub
+    lambda_function.SCHEDULER.begin(time.monotonic() + 60)
+    results = {}
+    lambda_function.execute_athena_queries(specs, lambda name, rows: results.update({name: list(rows)}))
+    return len(stub.submitted), results
+
+def reset_cache(max_rows=1000):
+    lambda_function.RESULT_CACHE = query_cache.QueryCache(ttl_seconds=300, max_rows=max_rows)
+    lambda_function.RESULT_CACHE.begin()
+    reader = RowReader()
+    lambda_function.iter_query_rows = reader
+    return reader
+
+def wait_for_full_interval(margin=5):
+    """Espera al siguiente intervalo de alineación si al actual le quedan menos de margin segundos"""
+    remaining = lambda_function.aligned_now() + lambda_function.ANALYSIS_WINDOW_ALIGN_SECONDS - time.time()
+    if remaining < margin:
+        time.sleep(remaining)
+
+def test_open_day():
+    """Dos invocaciones sobre el día en curso dentro del mismo intervalo comparten el resultado"""
+    print("🧪 Testing caché del día en curso...")
+
+    try:
+        reset_cache()
+        lambda_function.set_analysis_window(0)
+        wait_for_full_interval()
+        started, first = invoke([make_spec('scan')])
+        assert started == 1 and first['scan'] == ROWS
+        started, second = invoke([make_spec('scan')])
+        assert started == 0, "la segunda invocación ha relanzado la consulta"
+        assert second == first and lambda_function.RESULT_CACHE.stats['hits'] == 1
+        print(f"   Ventana {lambda_function.current_data_window()}: 1 consulta en 2 invocaciones")
+
+        print("✅ Caché del día en curso correcta")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_aligned_window():
+    """Ventanas pedidas en instantes del mismo intervalo comparten clave; el intervalo siguiente no"""
+    print("\n🧪 Testing alineación de la ventana de análisis...")
+
+    try:
+        reset_cache()
+        align = lambda_function.ANALYSIS_WINDOW_ALIGN_SECONDS
+        start = lambda_function.aligned_now()
+        launched = []
+        for now in (start + 1, start + align - 1, start + align):
+            lambda_function.set_analysis_window(15, now=now)
+            started, results = invoke([make_spec('scan')])
+            assert results['scan'] == ROWS
+            launched.append(started)
+        print(f"   Consultas lanzadas por invocación: {launched}")
+        assert launched == [1, 0, 1], "ventanas del mismo intervalo con claves distintas"
+        lambda_function.set_analysis_window(0)
+
+        print("✅ Alineación de la ventana correcta")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_execution_reuse():
+    """
+    Los resultados de otros readers y los que superan max_rows se guardan como
+    referencia a la ejecución: la segunda invocación los relee sin relanzarla
+    """
+    print("\n🧪 Testing reutilización de ejecuciones...")
+
+    try:
+        read = []
+
+        def read_columns(execution, description):
+            read.append(execution['QueryExecutionId'])
+            return {'srcaddr': ['10.0.0.1']}
+
+        reader = reset_cache(max_rows=1)
+        partial = make_spec('partial', reader=read_columns, window='1000-1600')
+        large = make_spec('large', window='1000-1600')
+        started, first = invoke([partial, large])
+        assert started == 2
+        started, second = invoke([partial, large])
+        assert started == 0, "la segunda invocación ha relanzado las consultas"
+        assert second == first and len(first['large']) == len(ROWS)
+        assert read[0] == read[1] and reader.read[0] == reader.read[1], "no se ha releído la misma ejecución"
+        print(f"   Ejecuciones releídas: {read[1]} (columnas), {reader.read[1]} ({len(ROWS)} filas > max_rows)")
+
+        # Otra ventana de watermarks: otra clave
+        started, _ = invoke([dict(partial, window='1600-2200')])
+        assert started == 1
+
+        print("✅ Reutilización de ejecuciones correcta")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🔬 === QUERY CACHE TEST (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    open_day_ok = test_open_day()
+    window_ok = test_aligned_window()
+    reuse_ok = test_execution_reuse()
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN DE TESTS:")
+    print(f"   📅 Día en curso: {'✅ OK' if open_day_ok else '❌ FAIL'}")
+    print(f"   📐 Ventana alineada: {'✅ OK' if window_ok else '❌ FAIL'}")
+    print(f"   ♻️ Reutilización de ejecuciones: {'✅ OK' if reuse_ok else '❌ FAIL'}")
+
+    sys.exit(0 if open_day_ok and window_ok and reuse_ok else 1)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Test offline de la planificación de consultas (prioridad, omisión y cancelación) con un Athena simulado
+import os
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_function
+
+class StubAthena:
+    """Athena local: cada consulta termina tras los segundos indicados en su SQL"""
+
+    def __init__(self):
+        self.started = {}
+        self.submitted = []
+        self.stopped = []
+
+    def start_query_execution(self, QueryString, **kwargs):
+        query_id = f"q{len(self.started)}"
+        self.started[query_id] = (time.monotonic(), float(QueryString))
+        self.submitted.append(QueryString)
+        return {'QueryExecutionId': query_id}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        now = time.monotonic()
+        executions = []
+        for query_id in QueryExecutionIds:
+            started_at, seconds = self.started[query_id]
+            if query_id in self.stopped:
+                state = 'CANCELLED'
+            else:
+                state = 'SUCCEEDED' if now - started_at >= seconds else 'RUNNING'
+            executions.append({'QueryExecutionId': query_id, 'Status': {'State': state}})
+        return {'QueryExecutions': executions}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+        return {}
+
+def make_spec(name, severity, seconds):
+    return {
+        'name': name,
+        'query': str(seconds),
+        'description': name,
+        'severity': severity,
+        'reader': lambda execution, description: [{'name': description}],
+        # Sin RESULT_CACHE: cada test lanza sus consultas
+        'cache': False
+    }
+
+def run_queries(specs, deadline, max_wait_time=300):
+    """Ejecuta las consultas con el deadline dado; retorna (stub, [(nombre, filas)], resumen)"""
+    stub = StubAthena()
+    lambda_function.athena_client = stub
+    lambda_function.SCHEDULER.begin(deadline)
+    results = []
+    lambda_function.execute_athena_queries(specs, lambda name, rows: results.append((name, rows)), max_wait_time)
+    return stub, results, lambda_function.SCHEDULER.summary()
+
+def test_priority_and_cancellation():
+    """CRITICAL se lanza primero y la consulta que supera el deadline se cancela"""
+    print("🧪 Testing prioridad y cancelación...")
+
+    try:
+        specs = [make_spec('lenta', 'HIGH', 30), make_spec('ddos', 'CRITICAL', 0.3), make_spec('scan', 'HIGH', 0.3)]
+        # Presupuesto de 2 s: todas caben si el mínimo para lanzar es 1 s
+        min_query_seconds = lambda_function.SCHEDULER.min_query_seconds
+        lambda_function.SCHEDULER.min_query_seconds = 1
+        started_at = time.monotonic()
+        try:
+            stub, results, summary = run_queries(specs, time.monotonic() + 2)
+        finally:
+            lambda_function.SCHEDULER.min_query_seconds = min_query_seconds
+        elapsed = time.monotonic() - started_at
+        print(f"   Orden de lanzamiento: {stub.submitted}, resultados: {[name for name, _ in results]} en {elapsed:.1f}s")
+
+        assert stub.submitted == ['0.3', '30', '0.3']
+        assert [name for name, rows in results if rows] == ['ddos', 'scan']
+        assert ('lenta', None) in results
+        assert stub.stopped == ['q1'] and summary['cancelled'] == ['lenta']
+        assert elapsed < 3, f"{elapsed:.1f}s esperando más allá del deadline"
+
+        print("✅ Prioridad y cancelación correctas")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_admission():
+    """Con poco presupuesto solo se lanzan las consultas CRITICAL; sin deadline manda max_wait_time"""
+    print("\n🧪 Testing omisión y espera máxima...")
+
+    try:
+        specs = [make_spec('scan', 'HIGH', 0.2), make_spec('ddos', 'CRITICAL', 0.2)]
+        stub, results, summary = run_queries(specs, time.monotonic() + lambda_function.SCHEDULER.min_query_seconds / 2)
+        assert stub.submitted == ['0.2'] and summary['skipped'] == ['scan']
+        assert dict(results) == {'ddos': [{'name': 'ddos'}], 'scan': None}
+
+        stub, results, summary = run_queries([make_spec('lenta', 'HIGH', 30)], None, max_wait_time=1)
+        assert results == [('lenta', None)] and stub.stopped == ['q0'] and summary['cancelled'] == ['lenta']
+
+        print("✅ Omisión y espera máxima correctas")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🔬 === QUERY SCHEDULER TEST (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    priority_ok = test_priority_and_cancellation()
+    admission_ok = test_admission()
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN DE TESTS:")
+    print(f"   🚦 Prioridad y cancelación: {'✅ OK' if priority_ok else '❌ FAIL'}")
+    print(f"   ⏭️ Omisión y espera máxima: {'✅ OK' if admission_ok else '❌ FAIL'}")
+
+    sys.exit(0 if priority_ok and admission_ok else 1)
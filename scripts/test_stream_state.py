@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Test offline de la detección por micro-lotes: eventos S3 sintéticos, reentregas y fusión de shards
+import json
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import flowlog_generator
+import local_engine
+import state_store
+import stream_state
+from benchmark_detection import LocalS3
+
+RECORDS = 40000
+RECORDS_PER_OBJECT = 2500
+SHARDS = 4
+BUCKET = 'flow-logs'
+
+def result_rows(results):
+    """Filas de cada detector, sin depender del orden de los empates"""
+    return {detector: sorted(json.dumps(row, sort_keys=True) for row in rows) for detector, rows in results.items()}
+
+def ingest(s3_client, state_dir, keys):
+    """Una invocación por objeto, como las notificaciones del bucket"""
+    for key in keys:
+        stream_state.handle_s3_event(stream_state.object_created_event(BUCKET, [key]), state_dir, s3_client, SHARDS)
+
+def merge(s3_client, state_dir, truth):
+    source, _ = stream_state.source_of(truth['base_prefix'])
+    return stream_state.merge_results(state_dir, source, date.fromisoformat(truth['day']), s3_client, SHARDS)
+
+def pending_deltas(s3_client, state_dir, truth):
+    """Deltas que quedan sin fusionar en todos los shards del día"""
+    source, _ = stream_state.source_of(truth['base_prefix'])
+    day = date.fromisoformat(truth['day'])
+    return sum(
+        len(list(state_store.list_names(
+            state_dir, f"{stream_state.shard_directory(source, day, detector, shard)}/delta-", s3_client
+        )))
+        for detector in stream_state.SHARD_FIELDS for shard in range(SHARDS)
+    )
+
+def test_redelivery_before_merge(data_dir, truth, keys, expected):
+    """Un evento reentregado antes de la fusión sobrescribe su delta: no cuenta dos veces"""
+    print("🧪 Testing reentrega antes de la fusión...")
+
+    try:
+        s3_client = LocalS3(data_dir)
+        with tempfile.TemporaryDirectory() as state_dir:
+            ingest(s3_client, state_dir, keys)
+            ingest(s3_client, state_dir, keys[:1])
+            results, deltas = merge(s3_client, state_dir, truth)
+            print(f"   {len(keys) + 1} eventos, {deltas} deltas fusionados")
+            assert result_rows(results) == expected, "micro-lotes distintos de la lectura completa"
+            assert pending_deltas(s3_client, state_dir, truth) == 0
+
+        print("✅ Reentrega antes de la fusión sin doble conteo")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_redelivery_after_merge(data_dir, truth, keys, expected):
+    """Una reentrega tardía (objeto ya fusionado en el estado) se descarta en la siguiente fusión"""
+    print("\n🧪 Testing reentrega después de la fusión...")
+
+    try:
+        s3_client = LocalS3(data_dir)
+        with tempfile.TemporaryDirectory() as state_dir:
+            first, rest = keys[:len(keys) // 2], keys[len(keys) // 2:]
+            ingest(s3_client, state_dir, first)
+            merge(s3_client, state_dir, truth)
+
+            # El primer objeto vuelve a llegar junto con los que faltaban
+            ingest(s3_client, state_dir, rest + first[:1])
+            results, deltas = merge(s3_client, state_dir, truth)
+            assert result_rows(results) == expected, "la reentrega se ha contado dos veces"
+            assert pending_deltas(s3_client, state_dir, truth) == 0
+
+            # Sin eventos nuevos la fusión no cambia nada
+            again, deltas = merge(s3_client, state_dir, truth)
+            assert deltas == 0 and result_rows(again) == expected
+            print(f"   {len(first)} + {len(rest) + 1} eventos, estado estable tras la última fusión")
+
+        print("✅ Reentrega después de la fusión sin doble conteo")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_unreadable_delta(data_dir, truth, keys, expected):
+    """Un delta listado que aún no se puede leer no se da por fusionado ni se borra"""
+    print("\n🧪 Testing delta ilegible durante la fusión...")
+
+    try:
+        s3_client = LocalS3(data_dir)
+        load_json = state_store.load_json
+        with tempfile.TemporaryDirectory() as state_dir:
+            ingest(s3_client, state_dir, keys)
+            source, _ = stream_state.source_of(truth['base_prefix'])
+            directory = stream_state.shard_directory(source, date.fromisoformat(truth['day']), 'port_scanning', 0)
+            unreadable = state_store.list_names(state_dir, f"{directory}/delta-", s3_client)[0]
+
+            def load_json_missing(location, name, s3_client=None):
+                return None if name == unreadable else load_json(location, name, s3_client)
+
+            state_store.load_json = load_json_missing
+            try:
+                merge(s3_client, state_dir, truth)
+            finally:
+                state_store.load_json = load_json
+            assert pending_deltas(s3_client, state_dir, truth) == 1, "el delta ilegible se ha borrado"
+
+            results, deltas = merge(s3_client, state_dir, truth)
+            assert deltas == 1 and result_rows(results) == expected, "el delta ilegible no se ha fusionado después"
+            assert pending_deltas(s3_client, state_dir, truth) == 0
+            print(f"   {unreadable.rsplit('/', 1)[-1]} fusionado en la siguiente fusión")
+
+        print("✅ Delta ilegible conservado para la siguiente fusión")
+        return True
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+if __name__ == "__main__":
+    print("🔬 === STREAM STATE TEST (offline) ===")
+    print(f"🕐 Timestamp: {datetime.now()}")
+    print("=" * 50)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        truth = flowlog_generator.generate(data_dir, RECORDS, seed=7, records_per_object=RECORDS_PER_OBJECT)
+        paths = flowlog_generator.flow_log_files(data_dir, truth)
+        keys = [os.path.relpath(path, data_dir) for path in paths]
+        expected = result_rows(local_engine.run_local_detection_on_files(paths))
+        before_ok = test_redelivery_before_merge(data_dir, truth, keys, expected)
+        after_ok = test_redelivery_after_merge(data_dir, truth, keys, expected)
+        unreadable_ok = test_unreadable_delta(data_dir, truth, keys, expected)
+
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN DE TESTS:")
+    print(f"   🔁 Reentrega antes de la fusión: {'✅ OK' if before_ok else '❌ FAIL'}")
+    print(f"   🔀 Reentrega después de la fusión: {'✅ OK' if after_ok else '❌ FAIL'}")
+    print(f"   ⏳ Delta ilegible: {'✅ OK' if unreadable_ok else '❌ FAIL'}")
+
+    sys.exit(0 if before_ok and after_ok and unreadable_ok else 1)
@@ -48,6 +48,152 @@ variable "lambda_name" {
   default     = "anomaly-detection-function"
 }
 
+variable "detection_engine" {
+  description = "Motor de detección de la Lambda: athena (consultas SQL) o local (lectura directa de los flow logs en S3)"
+  type        = string
+  default     = "athena"
+
+  validation {
+    condition     = contains(["athena", "local"], var.detection_engine)
+    error_message = "detection_engine debe ser athena o local."
+  }
+}
+
+variable "aggregation_mode" {
+  description = "Agregación del motor local: exact (conjuntos exactos) o sketch (HyperLogLog/Count-Min/Space-Saving con memoria acotada)"
+  type        = string
+  default     = "exact"
+
+  validation {
+    condition     = contains(["exact", "sketch"], var.aggregation_mode)
+    error_message = "aggregation_mode debe ser exact o sketch."
+  }
+}
+
+variable "incremental_detection" {
+  description = "Procesar solo los datos nuevos en cada ejecución guardando watermark y agregados parciales en S3"
+  type        = bool
+  default     = false
+}
+
+variable "stream_detection" {
+  description = "Actualizar el estado de los detectores con cada objeto nuevo de flow logs (eventos S3 ObjectCreated); la ejecución programada solo fusiona los shards y aplica los umbrales"
+  type        = bool
+  default     = false
+}
+
+variable "stream_shards" {
+  description = "Shards del estado del modo micro-lote (hash de srcaddr / dstaddr)"
+  type        = number
+  default     = 16
+
+  validation {
+    condition     = var.stream_shards >= 1 && var.stream_shards <= 256
+    error_message = "stream_shards debe estar entre 1 y 256."
+  }
+}
+
+variable "object_index" {
+  description = "Indexar cada objeto nuevo de flow logs (rango de tiempo, registros por acción y filtros de Bloom de direcciones) para no leer los objetos que no pueden contener lo buscado"
+  type        = bool
+  default     = false
+}
+
+variable "query_plan" {
+  description = "Plan de consultas en Athena: separate (una consulta por detector) o combined (un solo escaneo con GROUPING SETS para todos los detectores)"
+  type        = string
+  default     = "separate"
+
+  validation {
+    condition     = contains(["separate", "combined"], var.query_plan)
+    error_message = "query_plan debe ser separate o combined."
+  }
+}
+
+variable "analysis_window_minutes" {
+  description = "Ventana de análisis por defecto en minutos hasta cada ejecución (solo se leen sus horas de partición); 0 analiza el día en curso completo"
+  type        = number
+  default     = 0
+
+  validation {
+    condition     = var.analysis_window_minutes >= 0
+    error_message = "analysis_window_minutes no puede ser negativo."
+  }
+}
+
+variable "ip_allowlist" {
+  description = "Orígenes conocidos (balanceadores, NAT, escáneres internos) que no cuentan en los detectores: CIDRs separados por comas o URI s3:// de un fichero con un CIDR por línea"
+  type        = string
+  default     = ""
+}
+
+variable "ip_denylist" {
+  description = "Rangos conocidos como maliciosos que se marcan en las anomalías antes del análisis: CIDRs separados por comas o URI s3:// de un fichero con un CIDR por línea"
+  type        = string
+  default     = ""
+}
+
+variable "fanout_targets" {
+  description = "Cuentas/regiones adicionales analizadas en cada invocación (fan-out) junto a la de despliegue; sus flow logs deben entregarse en el bucket central"
+  type = list(object({
+    account_id = string
+    region     = string
+  }))
+  default = []
+}
+
+variable "fanout_max_concurrency" {
+  description = "Targets del fan-out procesados a la vez (cada uno lanza sus consultas de Athena en paralelo)"
+  type        = number
+  default     = 4
+
+  validation {
+    condition     = var.fanout_max_concurrency >= 1
+    error_message = "fanout_max_concurrency debe ser al menos 1."
+  }
+}
+
+variable "adaptive_thresholds" {
+  description = "Comparar cada dirección con su baseline horaria (EWMA y p99 de un rollup por hora guardado en S3) en lugar de solo los umbrales fijos"
+  type        = bool
+  default     = false
+}
+
+variable "baseline_candidate_ratio" {
+  description = "Con umbrales adaptativos, fracción del umbral fijo desde la que las consultas devuelven candidatos para compararlos con su baseline"
+  type        = number
+  default     = 0.25
+
+  validation {
+    condition     = var.baseline_candidate_ratio > 0 && var.baseline_candidate_ratio <= 1
+    error_message = "baseline_candidate_ratio debe estar entre 0 (excluido) y 1."
+  }
+}
+
+variable "columnar_compaction" {
+  description = "Leer las horas ya compactadas a Parquet (scripts/compaction.py) desde la tabla vpc_flow_logs_parquet"
+  type        = bool
+  default     = false
+}
+
+variable "query_cache_ttl_seconds" {
+  description = "Tiempo (segundos) durante el que se reutilizan los resultados de una consulta de detección idéntica; 0 desactiva la caché"
+  type        = number
+  default     = 300
+}
+
+variable "alert_suppression_seconds" {
+  description = "Ventana (segundos) durante la que no se reenvía la alerta de una anomalía ya notificada sin cambios materiales; 0 desactiva la deduplicación"
+  type        = number
+  default     = 3600
+}
+
+variable "decorative_logs" {
+  description = "Mantener los mensajes con emoji de cada paso en los logs de la Lambda; con false solo se registran errores, avisos y métricas (EMF)"
+  type        = bool
+  default     = true
+}
+
 ### Variables EC2
 variable "key_pair_name" {
   description = "Nombre del key pair para instancias EC2"
@@ -66,3 +212,21 @@ variable "bedrock_model_id" {
   type        = string
   default     = "anthropic.claude-3-5-sonnet-20240620-v1:0"
 }
+
+variable "bedrock_max_concurrency" {
+  description = "Análisis de Bedrock ejecutados en paralelo"
+  type        = number
+  default     = 4
+}
+
+variable "bedrock_requests_per_minute" {
+  description = "Cuota de invocaciones por minuto del modelo de Bedrock en la cuenta (límite del token bucket)"
+  type        = number
+  default     = 20
+}
+
+variable "analysis_cache_ttl_seconds" {
+  description = "Tiempo (segundos) durante el que se reutiliza el análisis de IA de una anomalía sin cambios materiales; 0 desactiva la caché"
+  type        = number
+  default     = 3600
+}
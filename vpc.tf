@@ -102,5 +102,15 @@ resource "aws_flow_log" "main" {
   max_aggregation_interval = 60
   log_format               = "$${version} $${account-id} $${interface-id} $${srcaddr} $${dstaddr} $${srcport} $${dstport} $${protocol} $${packets} $${bytes} $${start} $${end} $${action} $${log-status}"
 
+  # Prefijos por hora (YYYY/MM/DD/HH/): las ventanas de análisis cortas solo
+  # leen las horas que necesitan (projection.hour en athena.tf). Activarlo en
+  # un despliegue existente reemplaza el flow log y deja los objetos por día
+  # fuera de Athena: ver la migración en el README
+  # (scripts/migrate_hour_partitions.py)
+  destination_options {
+    file_format        = "plain-text"
+    per_hour_partition = true
+  }
+
   tags = merge({ Name = "vpc-flowlog-${local.prefix}" }, local.common_tags)
 }